@@ -37,8 +37,56 @@ WWW_ROOT = 'data'
 # WWW_ROOT = '/www/data'
 DOC_HOST = 'http://%(family)s.spmjs.org/%(name)s/'
 ALLOW_ANONYMOUS = False
+# size limit of an uploaded tarball, keep it with client_max_body_size
+MAX_PACKAGE_SIZE = 10 * 1024 * 1024
+# seconds an unchanged upload session is kept
+UPLOAD_EXPIRES = 24 * 3600
 ASSETS_ROOT = None
 # ASSETS_ROOT = /www/data/assets
+# files of dist extracted on demand, the least recently used are evicted
+# ASSETS_CACHE_ROOT = /www/data/cache
+ASSETS_CACHE_SIZE = 1024 * 1024 * 1024
+# write .gz siblings of json files and assets, for gzip_static of nginx
+GZIP_STATIC = False
+# combos of the concat syntax, /assets/path/??a.js,b.js, served by the app
+COMBO_MAX_FILES = 999
+COMBO_MAX_AGE = 365 * 24 * 3600
+# bytes of the concatenated files kept in memory by every worker
+COMBO_CACHE_SIZE = 16 * 1024 * 1024
+# identical tarballs and assets are hard links of a blob in WWW_ROOT/.blobs
+BLOB_STORE = True
+# uncompressed bytes between the checkpoints of the tarball index
+TARBALL_CHECKPOINT_INTERVAL = 1024 * 1024
+# let the proxy send tarballs: X-Accel-Redirect of nginx or X-Sendfile
+SENDFILE = None
+# internal location of nginx that is aliased to WWW_ROOT
+SENDFILE_PREFIX = '/_sendfile/'
+
+#: metadata storage: file, sqlite or memory
+# nginx can only serve the json files of the file storage
+METADATA_STORAGE = 'file'
+# METADATA_DATABASE = '/www/data/metadata.sqlite'
+# parsed metadata files kept in memory by every worker
+METADATA_CACHE_SIZE = 1024
+# family listings of the file storage are compacted every so many changes
+FAMILY_LOG_SIZE = 32
+# max seconds a long polling request of the changes feed waits
+CHANGES_TIMEOUT = 60
+# projects in repository/popular.json and repository/latest.json
+RANKING_SIZE = 50
+# nginx access log of the downloads, counted by `manager.py downloads`
+# ACCESS_LOG = '/var/logs/yuan.access.log'
+# download counts kept in memory before they are written to the storage
+DOWNLOADS_BATCH_SIZE = 10000
+
+#: mirror workers, connections to a host, retries of a request
+MIRROR_WORKERS = 10
+MIRROR_CONNECTIONS = 4
+MIRROR_RETRIES = 3
+MIRROR_BACKOFF = 0.5
+MIRROR_TIMEOUT = 30
+# processes extracting assets of the mirrored packages
+MIRROR_EXTRACTORS = 2
 
 MIRROR_URL = [
     'http://spmjs.org/repository/seajs/',
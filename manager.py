@@ -1,13 +1,13 @@
 # coding: utf-8
 
 import os
+import sys
 import gevent.monkey
 gevent.monkey.patch_all()
 
 from flask.ext.script import Manager
 from yuan.app import create_app
 from yuan.models import Project, Package
-from flask import json
 
 ROOTDIR = os.path.abspath(os.path.dirname(__file__))
 CONF = os.path.join(ROOTDIR, 'etc/config.py')
@@ -46,12 +46,16 @@ def createdb():
 @manager.command
 def initsearch():
     """init search engine."""
-    from yuan.elastic import index_project
-    for name in Project.all():
-        for item in Project.list(name):
-            print '%(family)s/%(name)s' % item
-            item = Project(family=item['family'], name=item['name'])
-            index_project(item, 'update')
+    from yuan.elastic import elastic, index_project
+    with elastic.bulk() as bulk:
+        for name in Project.all():
+            for item in Project.list(name):
+                print '%(family)s/%(name)s' % item
+                item = Project(family=item['family'], name=item['name'])
+                index_project(item, 'update', bulk)
+    print('%d indexed, %d failed' % (bulk.count, len(bulk.failures)))
+    for action, id, error in bulk.failures:
+        print('  %s %s: %s' % (action, id, error))
 
 
 @manager.command
@@ -64,6 +68,51 @@ def index():
             index_project(item, 'update')
 
 
+@manager.command
+def manifest(check=False):
+    """rebuild or check the repository manifest."""
+    from yuan.models import rebuild_manifest, check_manifest
+    if not check:
+        data = rebuild_manifest()
+        print('%d projects in manifest' % len(data))
+        return
+
+    drift = check_manifest()
+    for fullname, reason in drift:
+        print('%s: %s' % (reason, fullname))
+    if drift:
+        raise SystemExit(1)
+    print('manifest is consistent')
+
+
+@manager.command
+def compact():
+    """merge the change logs into family listings."""
+    from yuan.models import get_storage
+    get_storage(app.config).compact()
+
+
+@manager.command
+def migrate(source='file', target='sqlite'):
+    """copy metadata from a storage backend to another."""
+    from yuan.models import create_storage, copy_storage
+    root = app.config['WWW_ROOT']
+    database = app.config.get('METADATA_DATABASE')
+    source = create_storage(source, root, database)
+    target = create_storage(target, root, database)
+    count = copy_storage(source, target)
+    print('%d projects copied' % count)
+
+
+@manager.command
+def collectuploads(expires=None):
+    """remove abandoned upload sessions."""
+    from yuan.models import collect_uploads
+    if expires is not None:
+        expires = int(expires)
+    print('%d upload sessions removed' % collect_uploads(expires))
+
+
 @manager.command
 def initassets():
     from yuan.tasks import extract_assets
@@ -77,33 +126,77 @@ def initassets():
 
 
 @manager.command
-def initdependents():
-    from yuan.tasks import calculate_dependents
-    for name in Project.all():
-        for item in Project.list(name):
-            item = Project(family=item['family'], name=item['name'])
-            for key in item.packages:
-                pkg = Package(**item.packages[key])
-                print(pkg)
-                calculate_dependents(pkg, 'update')
+def blobs(dedupe=False, collect=False):
+    """report the space saved by the blob store."""
+    from yuan.models import store_tree, collect_blobs, blob_report
+    if dedupe:
+        root = app.config['WWW_ROOT']
+        count = store_tree(os.path.join(root, 'repository'))
+        if app.config.get('ASSETS_ROOT'):
+            count += store_tree(app.config['ASSETS_ROOT'])
+        print('%d files stored' % count)
+    if collect:
+        print('%d blobs removed' % collect_blobs())
+
+    report = blob_report()
+    print('%(blobs)d blobs, %(links)d links, %(unused)d unused' % report)
+    print('%.1f MB stored, %.1f MB saved' % (
+        report['stored'] / 1024.0 / 1024, report['saved'] / 1024.0 / 1024
+    ))
+
+
+@manager.command
+def gzipstatic(workers=4):
+    """compress json files and assets for gzip_static of nginx."""
+    from yuan.tasks.assets import gzip_tree
+    workers = int(workers)
+    repository = os.path.join(app.config['WWW_ROOT'], 'repository')
+    count = gzip_tree(repository, ('.json',), workers)
+    if app.config.get('ASSETS_ROOT'):
+        count += gzip_tree(app.config['ASSETS_ROOT'], workers=workers)
+    print('%d files compressed' % count)
+
+
+@manager.command
+def initdependents(processes=4):
+    """rebuild the reverse dependency index."""
+    import gevent.subprocess
+    # a multiprocessing pool hangs in a process patched by gevent
+    gevent.subprocess.check_call(
+        [sys.executable, '-m', 'scripts.dependents', CONF, str(processes)],
+        cwd=ROOTDIR,
+    )
 
 
 @manager.command
 def status():
+    """rebuild the popular and latest rankings."""
     from scripts.status import calculate
 
     data = calculate()
-    repo = os.path.join(app.config['WWW_ROOT'], 'repository')
+    print('%d popular, %d latest projects' % (
+        len(data['popular']), len(data['latest'])
+    ))
+
 
-    with open(os.path.join(repo, 'popular.json'), 'w') as f:
-        json.dump(data['popular'], f)
+@manager.command
+def downloads(log=None):
+    """count downloads in the access logs of nginx since the last run."""
+    from scripts.downloads import ingest
 
-    with open(os.path.join(repo, 'latest.json'), 'w') as f:
-        json.dump(data['latest'], f)
+    log = log or app.config.get('ACCESS_LOG')
+    if not log:
+        print('ACCESS_LOG is not configured')
+        sys.exit(1)
+    checkpoint = os.path.join(app.config['WWW_ROOT'], '.downloads.json')
+    count = ingest(
+        log, checkpoint, app.config.get('DOWNLOADS_BATCH_SIZE', 10000)
+    )
+    print('%d downloads' % count)
 
 
 @manager.command
-def mirror(url=None):
+def mirror(url=None, changes=False):
     """sync a mirror site."""
     if not url:
         url = app.config['MIRROR_URL']
@@ -111,11 +204,7 @@ def mirror(url=None):
     from scripts.mirror import mirror
     import time
     print('\n  %s' % time.ctime())
-    if isinstance(url, (list, tuple)):
-        for i in url:
-            mirror(i, app.config)
-    else:
-        mirror(url, app.config)
+    mirror(url, app.config, changes)
 
 
 if __name__ == '__main__':
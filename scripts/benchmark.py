@@ -0,0 +1,434 @@
+# coding: utf-8
+"""
+Benchmarks of the hot paths, run one with::
+
+    python -m scripts.benchmark <name> [args]
+"""
+
+import os
+import sys
+import timeit
+
+
+def records(versions=500):
+    """Per-access cost and per-object memory of package summaries."""
+    from yuan.models import PackageRecord
+    from yuan.models.record import to_unicode
+
+    class LegacyModel(dict):
+        # the dict model that decodes values on every access
+        def __getattr__(self, key):
+            try:
+                return to_unicode(self[key])
+            except KeyError:
+                return None
+
+        def __getitem__(self, key):
+            return to_unicode(super(LegacyModel, self).__getitem__(key))
+
+    versions = int(versions)
+    before = {}
+    after = {}
+    for i in range(versions):
+        data = _package(i)
+        before[data['version']] = LegacyModel(data)
+        after[data['version']] = PackageRecord(data)
+
+    def access(packages):
+        def run():
+            for pkg in packages.itervalues():
+                pkg['tag'], pkg['md5'], pkg.version, pkg.description
+        return run
+
+    print('%d versions, %d accesses per round' % (versions, versions * 4))
+    for label, packages in (('before', before), ('after', after)):
+        seconds = min(timeit.repeat(access(packages), number=20, repeat=5))
+        per_access = seconds / 20 / (versions * 4) * 1e9
+        memory = sum(_sizeof(pkg) for pkg in packages.itervalues())
+        print(
+            '%6s: %6.1f ns/access, %5d bytes/object' %
+            (label, per_access, memory / versions)
+        )
+
+
+def tarball(concurrency=100, size=10):
+    """Memory of concurrent downloads of a tarball in the tarball view."""
+    import shutil
+    import tempfile
+    from flask import Flask, Response
+    from werkzeug.test import create_environ, run_wsgi_app
+
+    concurrency = int(concurrency)
+    size = int(size)
+    root = tempfile.mkdtemp()
+    path = '/repository/arale/widget/1.0.0/widget-1.0.0.tar.gz'
+    fpath = root + path
+    os.makedirs(os.path.dirname(fpath))
+    with open(fpath, 'wb') as f:
+        for i in range(size):
+            f.write(os.urandom(1024 * 1024))
+
+    def legacy_app():
+        # the view that reads the tarball into memory
+        app = Flask('legacy')
+
+        @app.route(path)
+        def tarball():
+            with open(fpath, 'rb') as f:
+                data = f.read()
+                return Response(data, content_type='application/x-tar')
+        return app
+
+    def yuan_app():
+        from yuan.app import create_app
+        return create_app({
+            'WWW_ROOT': root, 'SQLALCHEMY_DATABASE_URI': 'sqlite://',
+        })
+
+    def measure(create):
+        # every download is started and holds its response
+        app = create()
+        base = _rss()
+        responses = []
+        for i in range(concurrency):
+            app_iter, status, headers = run_wsgi_app(
+                app, create_environ(path), buffered=False
+            )
+            app_iter = iter(app_iter)
+            next(app_iter)
+            responses.append(app_iter)
+        return (_rss() - base) / 1024.0 / 1024
+
+    print('%d concurrent downloads of a %d MB tarball' % (concurrency, size))
+    try:
+        for label, create in (('before', legacy_app), ('after', yuan_app)):
+            # a fresh process for every app
+            r, w = os.pipe()
+            pid = os.fork()
+            if not pid:
+                os.write(w, '%f' % measure(create))
+                os._exit(0)
+            os.waitpid(pid, 0)
+            print('%6s: %8.1f MB' % (label, float(os.read(r, 64))))
+    finally:
+        shutil.rmtree(root)
+
+
+def assets(files=5000, dist=50):
+    """Timings of extracting the assets of a large tarball."""
+    import shutil
+    import tarfile
+    import tempfile
+    from StringIO import StringIO
+    from flask import Flask
+    from yuan.models import Package
+    from yuan.tasks import extract_assets
+
+    files = int(files)
+    dist = int(dist)
+    root = tempfile.mkdtemp()
+    app = Flask('benchmark')
+    app.config.update(
+        WWW_ROOT=root, ASSETS_ROOT=os.path.join(root, 'assets'),
+        METADATA_STORAGE='memory',
+    )
+
+    def legacy(pkg, tarball):
+        # extract everything into the temp directory, move dist out
+        tar = tarfile.open(tarball, mode='r:gz')
+        fpath = os.path.join(tempfile.gettempdir(), 'arale-widget')
+        if os.path.exists(fpath):
+            shutil.rmtree(fpath)
+        tar.extractall(path=fpath)
+        rootdir = os.path.join(fpath, os.listdir(fpath)[0])
+        dest = os.path.join(
+            app.config['ASSETS_ROOT'], pkg.family, pkg.name, pkg.version
+        )
+        if os.path.exists(dest):
+            shutil.rmtree(dest)
+        if not os.path.exists(os.path.dirname(dest)):
+            os.makedirs(os.path.dirname(dest))
+        shutil.move(os.path.join(rootdir, 'dist'), dest)
+        shutil.move(os.path.join(rootdir, 'package.json'), dest)
+        shutil.rmtree(fpath)
+
+    try:
+        with app.test_request_context():
+            pkg = Package(family='arale', name='widget', version='1.0.0')
+            pkg.tag = 'stable'
+            pkg.filename = 'widget-1.0.0.tar.gz'
+            tarball = os.path.join(
+                os.path.dirname(pkg.datafile), pkg.filename
+            )
+            os.makedirs(os.path.dirname(tarball))
+            tar = tarfile.open(tarball, mode='w:gz')
+            content = os.urandom(2048).encode('base64')
+            names = ['package.json']
+            names += ['dist/widget-%d.js' % i for i in range(dist)]
+            names += ['src/widget-%d.js' % i for i in range(files)]
+            for name in names:
+                info = tarfile.TarInfo('widget/%s' % name)
+                info.size = len(content)
+                tar.addfile(info, StringIO(content))
+            tar.close()
+
+            print('%d files, %d in dist, %d KB tarball' % (
+                len(names), dist, os.path.getsize(tarball) // 1024
+            ))
+            for label, func in (
+                    ('before', lambda: legacy(pkg, tarball)),
+                    ('after', lambda: extract_assets(pkg, 'upload'))):
+                seconds = min(timeit.repeat(func, number=1, repeat=5))
+                print('%6s: %7.1f ms' % (label, seconds * 1000))
+    finally:
+        shutil.rmtree(root)
+
+
+def combo(files=20, size=4):
+    """A page of files served one by one, or as a combo of the app."""
+    import shutil
+    import tempfile
+    from flask import Flask
+    from yuan.helpers import send_file
+    from yuan.models import combocache
+    from yuan.views import assets
+
+    files = int(files)
+    size = int(size) * 1024
+    root = tempfile.mkdtemp()
+    app = Flask('benchmark')
+    app.config.update(ASSETS_ROOT=root)
+    app.register_blueprint(assets.bp)
+    combocache.init_app(app)
+
+    @app.route('/assets/<path:filename>')
+    def single(filename):
+        return send_file(os.path.join(root, filename), 'text/css')
+
+    names = ['widget-%d.css' % i for i in range(files)]
+    for name in names:
+        with open(os.path.join(root, name), 'wb') as f:
+            f.write(os.urandom(size // 2).encode('hex'))
+    client = app.test_client()
+    url = '/assets/??%s' % ','.join(names)
+
+    def one_by_one():
+        for name in names:
+            client.get('/assets/%s' % name).data
+
+    def cold():
+        combocache.clear()
+        client.get(url).data
+
+    def warm():
+        client.get(url).data
+
+    try:
+        print('%d files of %d KB per page' % (files, size // 1024))
+        for label, func in (
+                ('one by one', one_by_one), ('combo', cold),
+                ('cached', warm)):
+            seconds = min(timeit.repeat(func, number=20, repeat=5)) / 20
+            print('%10s: %6.2f ms/page' % (label, seconds * 1000))
+    finally:
+        shutil.rmtree(root)
+
+
+def transitive(packages=50000, versions=5, updates=200):
+    """Transitive dependents counts of a synthetic graph, counted in full,
+    or updated by publishing packages one by one.
+    """
+    import random
+    import time
+    from yuan.models import DependentsIndex
+    from yuan.models.storage.graph import count_all, update_transitive
+
+    packages = int(packages)
+    versions = int(versions)
+    updates = int(updates)
+    projects = packages // versions
+    rnd = random.Random(42)
+
+    def dependencies(i):
+        # popular projects have small numbers, deps are older projects
+        deps = set()
+        for _ in range(rnd.randint(0, 4)):
+            j = int(i * rnd.random() ** 3)
+            if j < i:
+                version = '1.%d.0' % rnd.randrange(versions)
+                deps.add(('bench', 'p%d' % j, version))
+        return deps
+
+    index = DependentsIndex()
+    for i in range(projects):
+        for v in range(versions):
+            index.update(('bench', 'p%d' % i, '1.%d.0' % v), dependencies(i))
+    edges = sum(len(o) for o in index.sources.itervalues())
+    print('%d packages, %d projects, %d edges' % (packages, projects, edges))
+
+    started = time.time()
+    index.counts = count_all(index)
+    full = time.time() - started
+    print('%20s: %8.1f ms' % ('full count', full * 1000))
+
+    def publish(keys):
+        started = time.time()
+        for key in keys:
+            counts = update_transitive(
+                index, lambda o: index.counts.get(o, 0),
+                key, dependencies(rnd.randrange(projects))
+            )
+            index.set_counts(counts)
+        return (time.time() - started) / len(keys)
+
+    # new versions of random projects, nothing depends on them yet
+    keys = [
+        ('bench', 'p%d' % rnd.randrange(projects), '2.%d.0' % i)
+        for i in range(updates)
+    ]
+    seconds = publish(keys)
+    print('%20s: %8.3f ms/publish' % ('new versions', seconds * 1000))
+
+    # versions that others depend on are published again
+    keys = [
+        key for key in sorted(index.targets) if key[1] != 'p0'
+    ][:updates // 10]
+    seconds = publish(keys)
+    print('%20s: %8.3f ms/publish' % ('depended versions', seconds * 1000))
+
+    assert index.counts == count_all(index)
+    top = sorted(index.counts.items(), key=lambda o: -o[1])[:3]
+    print('top: %s' % ', '.join('%s/%s %d' % (k + (c,)) for k, c in top))
+
+
+def downloads(size=200, projects=2000):
+    """Downloads counted in a synthetic access log of ``size`` MB, plain
+    and gzipped, against reading the log only.
+    """
+    import gzip
+    import random
+    import shutil
+    import tempfile
+    import time
+    from flask import Flask
+    from yuan.models import create_storage
+    from scripts.downloads import ingest, read_chunks
+
+    size = int(size) * 1024 * 1024
+    projects = int(projects)
+    rnd = random.Random(42)
+    root = tempfile.mkdtemp()
+    fpath = os.path.join(root, 'access.log')
+
+    def line():
+        day = '%02d/Oct/2013:10:%02d:00 +0800' % (
+            rnd.randint(1, 30), rnd.randrange(60)
+        )
+        if rnd.random() < 0.2:
+            name = 'p%d' % int(projects * rnd.random() ** 2)
+            path = '/repository/bench/%s/1.0.%d/%s.tar.gz' % (
+                name, rnd.randrange(5), name
+            )
+        else:
+            path = '/assets/bench/p%d/1.0.0/index.js' % rnd.randrange(9)
+        return (
+            '10.0.%d.%d - - [%s] "GET %s HTTP/1.1" 200 %d "-" '
+            '"Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36"\n' % (
+                rnd.randrange(256), rnd.randrange(256), day, path,
+                rnd.randrange(100000),
+            )
+        )
+
+    # a sample repeated, random lines are slower to make than to count
+    sample = ''.join(line() for _ in range(20000))
+    with open(fpath, 'wb') as f:
+        for _ in range(size // len(sample) + 1):
+            f.write(sample)
+    with open(fpath, 'rb') as f:
+        with gzip.open(fpath + '.1.gz', 'wb') as gz:
+            shutil.copyfileobj(f, gz)
+    size = os.path.getsize(fpath)
+
+    app = Flask('benchmark')
+    app.config.update(
+        WWW_ROOT=root, METADATA_STORAGE=create_storage('memory', root)
+    )
+    rss = _rss()
+    try:
+        print('%d MB of log' % (size // 1024 // 1024))
+        for label, name in (('plain', fpath), ('gzip', fpath + '.1.gz')):
+            started = time.time()
+            for _ in read_chunks(name):
+                pass
+            seconds = time.time() - started
+            print('%12s: %6.1f MB/s' % (
+                'read ' + label, size / seconds / 1024 / 1024
+            ))
+
+            os.rename(name, os.path.join(root, 'single.log'))
+            checkpoint = os.path.join(root, '.downloads.json')
+            started = time.time()
+            with app.app_context():
+                count = ingest(os.path.join(root, 'single.log'), checkpoint)
+            seconds = time.time() - started
+            os.rename(os.path.join(root, 'single.log'), name)
+            os.remove(checkpoint)
+            print('%12s: %6.1f MB/s, %d downloads' % (
+                'count ' + label, size / seconds / 1024 / 1024, count
+            ))
+        print('memory: %.1f MB' % ((_rss() - rss) / 1024.0 / 1024))
+    finally:
+        shutil.rmtree(root)
+
+
+def _rss():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def _package(i):
+    version = '1.%d.%d' % (i // 10, i % 10)
+    return {
+        'family': 'arale', 'name': 'widget', 'version': version,
+        'tag': 'stable', 'md5': '0cc175b9c0f1b6a831c399e269772661',
+        'filename': 'widget-%s.tar.gz' % version,
+        'description': 'UI widget base class',
+        'homepage': 'http://aralejs.org/widget/',
+        'keywords': ['widget', 'ui'],
+        'repository': {'type': 'git', 'url': 'git://github.com/aralejs/w'},
+        'dependencies': ['arale/base@1.0.1', 'arale/class@1.0.0'],
+        'publisher': 'lepture',
+        'created_at': '2013-03-21T00:00:00Z',
+        'updated_at': '2013-03-21T00:00:00Z',
+        'spm': {'alias': {'$': '$'}},
+    }
+
+
+def _sizeof(obj):
+    # size of the object and its own containers, values are shared
+    size = sys.getsizeof(obj)
+    extra = getattr(obj, '__dict__', None)
+    if hasattr(obj, '_extra'):
+        extra = obj._extra
+    if extra:
+        size += sys.getsizeof(extra)
+    return size
+
+
+BENCHMARKS = {
+    'assets': assets,
+    'combo': combo,
+    'downloads': downloads,
+    'records': records,
+    'tarball': tarball,
+    'transitive': transitive,
+}
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS:
+        print('usage: python -m scripts.benchmark [%s]' % '|'.join(
+            sorted(BENCHMARKS)
+        ))
+        sys.exit(1)
+    BENCHMARKS[sys.argv[1]](*sys.argv[2:])
@@ -0,0 +1,68 @@
+"""Rebuild the reverse dependency index with a pool of processes.
+
+The manager is patched by gevent, which a multiprocessing pool does not
+work with, it runs this module in a process of its own::
+
+    python -m scripts.dependents etc/config.py 4
+"""
+
+import os
+import sys
+import multiprocessing
+from flask import Config
+from yuan.models import get_storage, package_dependencies
+
+ROOTDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_storage = None
+
+
+def rebuild(config, processes=4):
+    """Read the dependencies of every package in the pool, and replace
+    the index with them in one batch. Return the count of packages.
+    """
+    storage = get_storage(config)
+    keys = list(storage.walk())
+    dependencies = {}
+    pool = multiprocessing.Pool(processes, _init, (dict(config),))
+    try:
+        for items in pool.imap_unordered(_read, keys, chunksize=64):
+            dependencies.update(items)
+    finally:
+        pool.close()
+        pool.join()
+    storage.rebuild_dependents(dependencies)
+    return len(dependencies)
+
+
+def _init(config):
+    global _storage
+    _storage = get_storage(config)
+
+
+def _read(key):
+    key = tuple(key)
+    project = _storage.read(key) or {}
+    items = []
+    for version in project.get('packages') or {}:
+        pkg = _storage.read(key + (version,)) or {}
+        items.append((key + (version,), package_dependencies(pkg)))
+    return items
+
+
+def load_config(fpath):
+    """The config of ``fpath`` over the base config, as create_app
+    loads it.
+    """
+    config = Config(ROOTDIR)
+    config.from_pyfile(os.path.join(ROOTDIR, 'conf', 'base_config.py'))
+    if 'YUAN_SETTINGS' in os.environ:
+        config.from_envvar('YUAN_SETTINGS')
+    config.from_pyfile(os.path.abspath(fpath))
+    return config
+
+
+if __name__ == '__main__':
+    config = load_config(sys.argv[1])
+    processes = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    print('%d packages indexed' % rebuild(config, processes))
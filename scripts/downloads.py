@@ -0,0 +1,154 @@
+"""Count downloads of tarballs from the access logs of nginx, which
+serves them without the app.
+
+A log is read with the rotated ones, the oldest first, plain or gzipped.
+The offset read of every log is kept in a checkpoint, by the first line
+of the log, which stays the same when a log is rotated or compressed.
+"""
+
+import os
+import re
+import zlib
+import glob
+import hashlib
+from flask import json
+from yuan.models import get_storage, rank_popular
+from yuan.models.fileio import atomic_write
+
+CHUNK_SIZE = 1024 * 1024
+
+#: counters kept in memory before they are flushed to the storage
+BATCH_SIZE = 10000
+
+# a download in the combined log format, the time and the path of the
+# tarball are counted as they are, and parsed once a batch is flushed
+_download = re.compile(
+    r'\[(\d\d/\w{3}/\d{4}):[^\]\n]*\] '
+    r'"GET /repository/([^ ?\n]+)\.tar\.gz(?:\?[^ \n]*)? HTTP/[\d.]+" 200 '
+)
+
+_months = dict(
+    (o, '%02d' % (i + 1)) for i, o in enumerate(
+        'Jan Feb Mar Apr May Jun Jul Aug Sep Oct Nov Dec'.split()
+    )
+)
+
+
+def ingest(path, checkpoint, batch_size=BATCH_SIZE):
+    """Count the downloads in the log ``path`` and its rotated logs since
+    the last run. Counts of ``(family, name, version, day)`` are flushed
+    to the storage every ``batch_size`` of them, then the checkpoint is
+    saved. Return the count of downloads.
+    """
+    offsets = _read_checkpoint(checkpoint)
+    seen = {}
+    counts = {}
+    total = 0
+    for fpath in log_files(path):
+        fingerprint = _fingerprint(fpath)
+        if fingerprint is None:
+            continue
+        offset = seen[fingerprint] = offsets.get(fingerprint, 0)
+        rest = b''
+        for chunk in read_chunks(fpath, offset):
+            chunk = rest + chunk
+            # the last line may be half written
+            end = chunk.rfind(b'\n') + 1
+            rest = chunk[end:]
+            for key in _download.findall(chunk, 0, end):
+                counts[key] = counts.get(key, 0) + 1
+            offset += end
+            seen[fingerprint] = offset
+            if len(counts) >= batch_size:
+                total += _flush(counts)
+                counts = {}
+                _write_checkpoint(checkpoint, dict(offsets, **seen))
+
+    total += _flush(counts)
+    # logs rotated away are forgotten
+    _write_checkpoint(checkpoint, seen)
+    return total
+
+
+def log_files(path):
+    """The log and its rotated logs, the oldest first::
+
+        access.log.3.gz, access.log.2.gz, access.log.1, access.log
+    """
+    rotated = []
+    for fpath in glob.glob(path + '.*'):
+        number = fpath[len(path) + 1:].split('.')[0]
+        if number.isdigit():
+            rotated.append((int(number), fpath))
+    files = [o[1] for o in sorted(rotated, reverse=True)]
+    if os.path.exists(path):
+        files.append(path)
+    return files
+
+
+def read_chunks(fpath, offset=0):
+    """Read the log from the uncompressed ``offset``."""
+    with open(fpath, 'rb') as f:
+        # rotated logs may be compressed without a .gz suffix
+        if f.read(2) != b'\x1f\x8b':
+            f.seek(offset)
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                yield chunk
+            return
+
+        f.seek(0)
+        d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        for raw in iter(lambda: f.read(CHUNK_SIZE), b''):
+            while raw:
+                chunk = d.decompress(raw)
+                raw = b''
+                if d.unused_data:
+                    # the next member of a concatenated gzip file
+                    raw = d.unused_data
+                    d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                if offset >= len(chunk):
+                    offset -= len(chunk)
+                    continue
+                yield chunk[offset:]
+                offset = 0
+
+
+def _fingerprint(fpath):
+    head = b''
+    for chunk in read_chunks(fpath):
+        head += chunk
+        if b'\n' in head or len(head) > CHUNK_SIZE:
+            break
+    if b'\n' not in head:
+        return None
+    return hashlib.sha1(head.split(b'\n', 1)[0]).hexdigest()
+
+
+def _flush(counts):
+    """Write the counts of a batch, and return the count of downloads."""
+    downloads = {}
+    for time, path in counts:
+        names = path.split('/')
+        if len(names) != 4:
+            continue
+        day, month, year = time.split('/')
+        key = tuple(names[:3]) + (
+            '%s-%s-%s' % (year, _months.get(month, '00'), day),
+        )
+        downloads[key] = downloads.get(key, 0) + counts[(time, path)]
+    if not downloads:
+        return 0
+    get_storage().add_downloads(downloads)
+    rank_popular(set(key[:2] for key in downloads))
+    return sum(downloads.values())
+
+
+def _read_checkpoint(fpath):
+    if not os.path.exists(fpath):
+        return {}
+    with open(fpath) as f:
+        return json.load(f)
+
+
+def _write_checkpoint(fpath, offsets):
+    atomic_write(fpath, json.dumps(offsets))
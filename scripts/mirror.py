@@ -1,131 +1,476 @@
-import gevent
-import gevent.monkey
-gevent.monkey.patch_all()
-
 import os
-import urllib
+import sys
+import time
+import hashlib
+import gevent
+import gevent.pool
+import gevent.lock
+import gevent.subprocess
 import requests
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError, ChunkedEncodingError
+from requests.packages.urllib3.util.retry import Retry
 from datetime import datetime
 from urlparse import urlparse
-from flask import Flask
+from collections import OrderedDict
+from flask import Flask, json
 from yuan.models import Package
 from yuan.models import Project
 from yuan.models import index_project
-from yuan.elastic import index_project as index_search
+from yuan.models import store_blob, rank_popular
+from yuan.elastic import elastic, index_project as index_search
 from yuan.tasks import extract_assets
+from yuan.tasks.dependent import calculate_dependents, remove_dependents
+from yuan.models.fileio import atomic_write
 
+CHUNK_SIZE = 64 * 1024
+ROOTDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
-def mirror(url, config):
-    """sync a mirror site."""
+#: config an extractor process needs
+EXTRACT_CONFIG = (
+    'WWW_ROOT', 'ASSETS_ROOT', 'METADATA_STORAGE', 'METADATA_DATABASE',
+    'GZIP_STATIC',
+)
 
-    print('  mirror: %s' % url)
-    rv = requests.get(url)
-    if rv.status_code != 200:
-        raise Exception('%s: %s' % url, rv.status_code)
 
-    data = rv.json()
+class Mirror(object):
+    """Sync mirror sites with a bounded pool of workers.
 
-    rv = urlparse(url)
-    domain = '%s://%s/repository' % (rv.scheme, rv.netloc)
+    Requests share a session, connections to a host are kept alive and
+    limited by ``MIRROR_CONNECTIONS``, a failed request is retried with
+    backoff. A project that fails to sync is reported, it doesn't stop
+    the others.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.pool = gevent.pool.Pool(config.get('MIRROR_WORKERS', 10))
+        self.session = create_session(
+            connections=config.get('MIRROR_CONNECTIONS', 4),
+            retries=config.get('MIRROR_RETRIES', 3),
+            backoff=config.get('MIRROR_BACKOFF', 0.5),
+        )
+        self.timeout = config.get('MIRROR_TIMEOUT', 30)
+        self.retries = config.get('MIRROR_RETRIES', 3)
+        # synced projects are indexed in _bulk requests of elasticsearch
+        self.search = elastic.bulk()
+
+        # extracting assets is cpu bound, it is done by other processes
+        processes = config.get('MIRROR_EXTRACTORS', 2)
+        if processes:
+            self.extractors = gevent.lock.BoundedSemaphore(processes)
+        else:
+            self.extractors = None
+        self.extracting = []
+
+        self.files = 0
+        self.bytes = 0
+        self.failures = []
+        self.started = time.time()
+
+    def run(self, urls, changes=False):
+        """Sync the families of urls concurrently. With ``changes``,
+        follow the changes feed of every site instead.
+        """
+        if changes:
+            jobs = [
+                gevent.spawn(self._call, self.follow, url, families)
+                for url, families in _sites(urls)
+            ]
+        else:
+            jobs = [gevent.spawn(self._call, self.mirror, url) for url in urls]
+        gevent.joinall(jobs)
+        gevent.joinall(self.extracting)
+        self.flush_search()
+        return self
+
+    def mirror(self, url):
+        """sync a family of a mirror site."""
+        print('  mirror: %s' % url)
+        data = self.get(url).json()
+        domain = _domain(url)
 
-    def index_with_ctx(config, project):
+        jobs = []
+        for project in data:
+            if not isinstance(project, dict):
+                raise Exception('Only mirror a selected family')
+
+            me = Project(family=project['family'], name=project['name'])
+            if 'updated_at' not in me or \
+               _strptime(me['updated_at']) < \
+               _strptime(project['updated_at']):
+                jobs.append(self.spawn(self.index, project, domain))
+        gevent.joinall(jobs)
+
+    def follow(self, url, families=None):
+        """sync a mirror site by its changes feed since the last
+        checkpoint.
+        """
+        domain = _domain(url)
+        checkpoint = os.path.join(
+            self.config['WWW_ROOT'], 'mirror', urlparse(url).netloc
+        )
+        since = _read_checkpoint(checkpoint)
+        print('  follow: %s since %d' % (domain, since))
+
+        while True:
+            data = self.get(
+                '%s/_changes' % domain, params={'since': since, 'limit': 500}
+            ).json()
+            if not data['results']:
+                break
+
+            # a project changed many times is synced once
+            projects = OrderedDict()
+            for change in data['results']:
+                if families and change['family'] not in families:
+                    continue
+                key = (change['family'], change['name'])
+                projects[key] = \
+                    change['type'] == 'project' and change['op'] == 'delete'
+
+            jobs = [
+                self.spawn(self.sync, family, name, deleted, domain)
+                for (family, name), deleted in projects.items()
+            ]
+            gevent.joinall(jobs)
+            self.flush_search()
+            if not all(job.value for job in jobs):
+                # sync the failed projects again in the next run
+                break
+
+            since = data['last_seq']
+            _write_checkpoint(checkpoint, since)
+        return since
+
+    def spawn(self, func, *args):
+        """Run a job in the worker pool, a job returns True if it is done.
+        """
+        return self.pool.spawn(self._call, func, *args)
+
+    def _call(self, func, *args):
         app = Flask('mirror')
-        app.config = config
+        app.config = self.config
         with app.test_request_context():
-            _index(project, domain, config)
+            try:
+                func(*args)
+                return True
+            except Exception as e:
+                print('   error: %s' % e)
+                self.failures.append((args, e))
+                return False
+
+    def flush_search(self):
+        app = Flask('mirror')
+        app.config = self.config
+        with app.test_request_context():
+            try:
+                self.search.flush()
+            except Exception:
+                print('    index: search error')
+
+    def get(self, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        rv = self.session.get(url, **kwargs)
+        if rv.status_code != 200:
+            rv.close()
+            raise Exception('%s: %s' % (url, rv.status_code))
+        if not kwargs.get('stream'):
+            self.bytes += len(rv.content)
+        return rv
+
+    def download(self, url, fpath, md5=None):
+        """Download url to fpath. It is streamed to a partial file, that is
+        resumed by the next try or run, and renamed to fpath only when
+        the md5 matches.
+        """
+        if md5 and os.path.exists(fpath):
+            m = hashlib.md5()
+            _md5sum(fpath, m)
+            if m.hexdigest() == md5:
+                return False
+
+        directory = os.path.dirname(fpath)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        partial = '%s.part' % fpath
+        for i in range(self.retries + 1):
+            try:
+                digest = self._download(url, partial)
+                break
+            except (ConnectionError, ChunkedEncodingError):
+                if i == self.retries:
+                    raise
+                print('  resume: %s' % url)
+
+        if md5 and digest != md5:
+            os.remove(partial)
+            raise Exception('%s: md5 mismatch' % url)
+        os.rename(partial, fpath)
+        self.files += 1
+        return True
+
+    def _download(self, url, partial):
+        m = hashlib.md5()
+        offset = 0
+        if os.path.exists(partial):
+            # the downloaded part is hashed again
+            offset = _md5sum(partial, m)
+
+        headers = {}
+        if offset:
+            headers['Range'] = 'bytes=%d-' % offset
+        rv = self.session.get(
+            url, headers=headers, stream=True, timeout=self.timeout
+        )
+        if rv.status_code == 416:
+            # the partial file is complete, or it is not a part of url
+            rv.close()
+            return m.hexdigest()
+        if rv.status_code == 200 and offset:
+            # the server doesn't support range
+            m = hashlib.md5()
+            offset = 0
+        elif rv.status_code not in (200, 206):
+            rv.close()
+            raise Exception('%s: %s' % (url, rv.status_code))
+
+        with open(partial, offset and 'ab' or 'wb') as f:
+            for chunk in rv.iter_content(CHUNK_SIZE):
+                f.write(chunk)
+                m.update(chunk)
+                self.bytes += len(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        return m.hexdigest()
+
+    def extract(self, pkg):
+        if not self.config.get('ASSETS_ROOT'):
+            return
+        if not self.extractors:
+            try:
+                extract_assets(pkg, 'upload')
+            except:
+                print('  extract: assets error')
+            return
+        self.extracting.append(gevent.spawn(self._extract, pkg))
+
+    def _extract(self, pkg):
+        config = dict(
+            (key, self.config[key]) for key in EXTRACT_CONFIG
+            if key in self.config
+        )
+        data = json.dumps({
+            'config': config, 'family': pkg.family,
+            'name': pkg.name, 'version': pkg.version,
+        })
+        with self.extractors:
+            proc = gevent.subprocess.Popen(
+                [sys.executable, '-m', 'scripts.mirror', 'extract'],
+                stdin=gevent.subprocess.PIPE, cwd=ROOTDIR,
+            )
+            proc.communicate(data)
+        if proc.returncode:
+            print('  extract: %s assets error' % pkg)
 
-    jobs = []
-    for project in data:
-        if not isinstance(project, dict):
-            raise Exception('Only mirror a selected family')
+    def fetch(self, pkg, domain):
+        url = '%s/%s/%s/%s/' % (
+            domain, pkg['family'], pkg['name'], pkg['version'])
+        print('   fetch: %s' % url)
+        pkg = Package(**self.get(url).json())
+
+        fpath = os.path.join(
+            self.config['WWW_ROOT'], 'repository',
+            pkg.family, pkg.name, pkg.version,
+            pkg['filename']
+        )
+        print('    save: %s' % fpath)
+        self.download('%s%s' % (url, pkg['filename']), fpath, pkg.md5)
+        store_blob(fpath)
+        # metadata is saved after the tarball is verified
+        pkg.save()
+        rank_popular(calculate_dependents(pkg, 'update'))
+        self.extract(pkg)
+
+    def index(self, project, domain):
+        print('    sync: %(family)s/%(name)s' % project)
+        index_project(project, 'update')
+
+        url = '%s/%s/%s/' % (domain, project['family'], project['name'])
+        data = self.get(url).json()
+        try:
+            # a project in the family listing has no packages
+            index_search(data, 'update', self.search)
+        except:
+            print('    index: search error')
+        if 'packages' not in data:
+            data['packages'] = {}
 
         me = Project(family=project['family'], name=project['name'])
-        if 'updated_at' not in me or \
-           _strptime(me['updated_at']) < _strptime(project['updated_at']):
-            jobs.append(gevent.spawn(index_with_ctx, config, project))
 
-    gevent.joinall(jobs)
+        if 'packages' in me:
+            packages = me['packages'].copy()
+        else:
+            packages = {}
 
+        for v in packages:
+            local = packages[v]
+            server = None
+            if v in data['packages']:
+                server = data['packages'][v]
 
-def _strptime(t):
-    return datetime.strptime(t, '%Y-%m-%dT%H:%M:%SZ')
+            if not server:
+                print('  delete: %s/%s@%s' % (me['family'], me['name'], v))
+                pkg = Package(family=me['family'], name=me['name'], version=v)
+                try:
+                    extract_assets(pkg, 'delete')
+                except:
+                    print('  delete: assets error')
 
+                pkg.delete()
+                rank_popular(calculate_dependents(pkg, 'delete'))
+                # remove this version from project
+                Project(**me).remove(v)
+            elif 'md5' in server and \
+                    ('md5' not in local or local['md5'] != server['md5']):
+                print('  create: %s/%s@%s' % (me['family'], me['name'], v))
+                self.fetch(server, domain)
+                # add this version to project
+                Project(**me).update(server)
 
-def _fetch(pkg, domain, config):
-    url = '%s/%s/%s/%s/' % (
-        domain, pkg['family'], pkg['name'], pkg['version'])
-    rv = requests.get(url)
-    print('   fetch: %s' % url)
-    if rv.status_code != 200:
-        raise Exception('%s: %s' % url, rv.status_code)
-    pkg = Package(**rv.json()).save()
-
-    url = '%s%s' % (url, pkg['filename'])
-    fpath = os.path.join(
-        config['WWW_ROOT'], 'repository',
-        pkg.family, pkg.name, pkg.version,
-        pkg['filename']
-    )
-    print('    save: %s' % fpath)
-    urllib.urlretrieve(url, fpath)
-    try:
-        extract_assets(pkg, 'upload')
-    except:
-        print('  extract: assets error')
-
-
-def _index(project, domain, config):
-    print('    sync: %(family)s/%(name)s' % project)
-    try:
-        index_search(project, 'update')
-    except:
-        print('    index: search error')
-    index_project(project, 'update')
-
-    url = '%s/%s/%s/' % (domain, project['family'], project['name'])
-    rv = requests.get(url)
-    if rv.status_code != 200:
-        raise Exception('%s: %s' % url, rv.status_code)
-    data = rv.json()
-    if 'packages' not in data:
-        data['packages'] = {}
-
-    me = Project(family=project['family'], name=project['name'])
-
-    if 'packages' in me:
-        packages = me['packages'].copy()
-    else:
-        packages = {}
-
-    for v in packages:
-        local = packages[v]
-        server = None
-        if v in data['packages']:
-            server = data['packages'][v]
-
-        if not server:
-            print('  delete: %s/%s@%s' % (me['family'], me['name'], v))
-            pkg = Package(family=me['family'], name=me['name'], version=v)
+        for v in data['packages']:
+            if v not in packages:
+                pkg = data['packages'][v]
+                print('  create: %s/%s@%s' % (pkg['family'], pkg['name'], v))
+                self.fetch(pkg, domain)
+                # add this version to project
+                Project(**me).update(pkg)
+        return True
+
+    def sync(self, family, name, deleted, domain):
+        if not deleted:
+            url = '%s/%s/%s/' % (domain, family, name)
+            rv = self.session.get(url, timeout=self.timeout)
+            if rv.status_code == 200:
+                self.bytes += len(rv.content)
+                return self.index(rv.json(), domain)
+            if rv.status_code != 404:
+                raise Exception('%s: %s' % (url, rv.status_code))
+
+        me = Project(family=family, name=name)
+        if 'created_at' not in me:
+            return False
+        print('  delete: %s/%s' % (family, name))
+        for v in me.packages or {}:
+            pkg = Package(family=family, name=name, version=v)
             try:
                 extract_assets(pkg, 'delete')
             except:
                 print('  delete: assets error')
+        try:
+            index_search(me, 'delete', self.search)
+        except:
+            print('    index: search error')
+        rank_popular(remove_dependents(me))
+        me.delete()
+        index_project(me, 'delete')
+        return True
+
+    def summary(self):
+        return '%d files, %d bytes in %.1fs, %d failures' % (
+            self.files, self.bytes, time.time() - self.started,
+            len(self.failures),
+        )
+
+
+def mirror(urls, config, changes=False):
+    """sync mirror sites."""
+    if not isinstance(urls, (list, tuple)):
+        urls = [urls]
+    rv = Mirror(config).run(urls, changes)
+    print('  mirror: %s' % rv.summary())
+    return rv
+
+
+def extract(data):
+    """Extract assets of a package in an extractor process."""
+    app = Flask('mirror')
+    app.config.update(data['config'])
+    with app.test_request_context():
+        pkg = Package(
+            family=data['family'], name=data['name'], version=data['version']
+        )
+        extract_assets(pkg, 'upload')
+
+
+def _md5sum(fpath, m):
+    """Update the md5 object m with the file, return the size of it."""
+    size = 0
+    with open(fpath, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            m.update(chunk)
+            size += len(chunk)
+    return size
+
+
+def create_session(connections=4, retries=3, backoff=0.5):
+    session = requests.Session()
+    retry = Retry(
+        total=retries, backoff_factor=backoff,
+        status_forcelist=(500, 502, 503, 504),
+        raise_on_status=False,
+    )
+    # greenlets wait for a free connection of the host
+    adapter = HTTPAdapter(
+        pool_connections=connections, pool_maxsize=connections,
+        max_retries=retry, pool_block=True,
+    )
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def _domain(url):
+    rv = urlparse(url)
+    return '%s://%s/repository' % (rv.scheme, rv.netloc)
+
+
+def _sites(urls):
+    # one feed a site, filtered by the mirrored families
+    sites = OrderedDict()
+    for url in urls:
+        rv = urlparse(url)
+        family = rv.path.rstrip('/').split('/')[-1]
+        if family == 'repository':
+            # the whole site is mirrored
+            sites[rv.netloc] = (url, None)
+            continue
+        site = sites.setdefault(rv.netloc, (url, set()))
+        if site[1] is not None:
+            site[1].add(family)
+    return sites.values()
+
+
+def _read_checkpoint(fpath):
+    if not os.path.exists(fpath):
+        return 0
+    with open(fpath) as f:
+        return json.load(f).get('since', 0)
+
+
+def _write_checkpoint(fpath, since):
+    directory = os.path.dirname(fpath)
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    atomic_write(fpath, json.dumps({'since': since}))
+
+
+def _strptime(t):
+    return datetime.strptime(t, '%Y-%m-%dT%H:%M:%SZ')
+
 
-            pkg.delete()
-            # remove this version from project
-            Project(**me).remove(v)
-        elif 'md5' in server and \
-                ('md5' not in local or local['md5'] != server['md5']):
-            print('  create: %s/%s@%s' % (me['family'], me['name'], v))
-            _fetch(server, domain, config)
-            # add this version to project
-            Project(**me).update(server)
-
-    for v in data['packages']:
-        if v not in packages:
-            pkg = data['packages'][v]
-            print('  create: %s/%s@%s' % (pkg['family'], pkg['name'], v))
-            _fetch(pkg, domain, config)
-            # add this version to project
-            Project(**me).update(pkg)
-    return True
+if __name__ == '__main__':
+    # python -m scripts.mirror extract, the extractor process
+    if sys.argv[1:] == ['extract']:
+        extract(json.load(sys.stdin))
@@ -0,0 +1,211 @@
+# coding: utf-8
+
+import os
+import time
+import hashlib
+import tarfile
+import tempfile
+from StringIO import StringIO
+from yuan.models import Package, assetcache
+from yuan.tasks import extract_assets
+
+from .suite import BaseSuite
+
+
+def create_tarball(fpath, files):
+    directory = os.path.dirname(fpath)
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    tar = tarfile.open(fpath, mode='w:gz')
+    for name, content in files:
+        info = tarfile.TarInfo(name)
+        info.size = len(content)
+        tar.addfile(info, StringIO(content))
+    tar.close()
+
+
+class TestAssetsCase(BaseSuite):
+    def prehook(self):
+        self.assets = os.path.join('tests', 'data', 'assets')
+        self.app.config['ASSETS_ROOT'] = self.assets
+        self.tempfiles = set(os.listdir(tempfile.gettempdir()))
+
+    def extract(self, files, tag='stable', version='1.0.0', corrupt=False):
+        with self.app.test_request_context():
+            pkg = Package(family='lepture', name='assets', version=version)
+            pkg.tag = tag
+            pkg.filename = 'assets-%s.tar.gz' % version
+            fpath = os.path.join(os.path.dirname(pkg.datafile), pkg.filename)
+            create_tarball(fpath, files)
+            if corrupt:
+                with open(fpath, 'r+b') as f:
+                    f.seek(40)
+                    f.write('corrupt')
+            extract_assets(pkg, 'upload')
+        return os.path.join(self.assets, 'lepture', 'assets', version)
+
+    def leftovers(self):
+        rv = []
+        parent = os.path.join(self.assets, 'lepture', 'assets')
+        if os.path.exists(parent):
+            rv.extend(o for o in os.listdir(parent) if o.startswith('.'))
+        tempfiles = set(os.listdir(tempfile.gettempdir())) - self.tempfiles
+        rv.extend(o for o in tempfiles if o.startswith('lepture-'))
+        return rv
+
+    def test_extract(self):
+        dest = self.extract([
+            ('assets/package.json', '{}'),
+            ('assets/dist/assets.js', 'define()'),
+            ('assets/dist/css/assets.css', 'body {}'),
+            ('assets/dist/.hidden', ''),
+            ('assets/dist/shell.php', ''),
+            ('assets/src/assets.js', 'src'),
+            ('assets/../escape.js', ''),
+        ])
+        files = []
+        for root, dirs, names in os.walk(dest):
+            files.extend(
+                os.path.relpath(os.path.join(root, o), dest) for o in names
+            )
+        assert sorted(files) == [
+            'assets.js', 'css/assets.css', 'package.json'
+        ]
+        with open(os.path.join(dest, 'assets.js')) as f:
+            assert f.read() == 'define()'
+        assert self.leftovers() == []
+
+        # extracted again, the old assets are replaced
+        dest = self.extract([
+            ('package.json', '{}'), ('dist/other.js', ''),
+        ])
+        assert sorted(os.listdir(dest)) == ['other.js', 'package.json']
+        assert self.leftovers() == []
+
+    def test_stray_dotfiles(self):
+        dest = self.extract([
+            ('.DS_Store', ''),
+            ('._package', ''),
+            ('.git/config', ''),
+            ('package/package.json', '{}'),
+            ('package/dist/stray.js', 'define()'),
+        ], version='5.0.0')
+        assert sorted(os.listdir(dest)) == ['package.json', 'stray.js']
+
+    def test_gzip(self):
+        import gzip
+        from yuan.tasks.assets import gzip_tree
+        self.app.config['GZIP_STATIC'] = True
+        content = 'define(function() { return "gzip"; });\n' * 50
+        dest = self.extract([
+            ('package.json', '{}'), ('dist/gzip.js', content),
+            ('dist/image.png', content),
+        ], version='4.0.0')
+        assert sorted(os.listdir(dest)) == [
+            'gzip.js', 'gzip.js.gz', 'image.png', 'package.json'
+        ]
+        with gzip.open(os.path.join(dest, 'gzip.js.gz')) as f:
+            assert f.read() == content
+
+        # the backfill of the existing tree
+        for name in ('gzip.js.gz', 'package.json'):
+            os.remove(os.path.join(dest, name))
+        assert gzip_tree(dest, workers=2) == 1
+        assert os.path.exists(os.path.join(dest, 'gzip.js.gz'))
+
+    def test_dedupe(self):
+        files = [('package.json', '{}'), ('dist/same.js', 'same')]
+        a = self.extract(files, version='3.0.0')
+        b = self.extract(files + [('dist/new.js', 'new')], version='3.1.0')
+        assert os.path.samefile(
+            os.path.join(a, 'same.js'), os.path.join(b, 'same.js')
+        )
+        assert os.stat(os.path.join(b, 'same.js')).st_nlink == 3
+
+    def test_no_leftovers(self):
+        cases = [
+            dict(files=[('assets/package.json', '{}')]),
+            dict(files=[('assets/dist/assets.js', '')]),
+            dict(files=[('package.json', '{}'), ('dist/a.js', '')],
+                 tag='unstable'),
+            dict(files=[('package.json', '{}'), ('dist/a.js', '')],
+                 corrupt=True),
+        ]
+        for i, kwargs in enumerate(cases):
+            dest = self.extract(version='2.0.%d' % i, **kwargs)
+            assert not os.path.exists(dest)
+            assert self.leftovers() == []
+
+
+class TestAssetsCacheCase(BaseSuite):
+    def prehook(self):
+        self.cache = os.path.join('tests', 'data', 'cache')
+        self.app.config['ASSETS_CACHE_ROOT'] = self.cache
+
+    def create_package(self, version, files, tag='unstable'):
+        with self.app.test_request_context():
+            pkg = Package(family='lepture', name='lazy', version=version)
+            pkg['tag'] = tag
+            pkg['filename'] = 'lazy-%s.tar.gz' % version
+            fpath = os.path.join(os.path.dirname(pkg.datafile), pkg.filename)
+            create_tarball(fpath, files)
+            with open(fpath, 'rb') as f:
+                pkg['md5'] = hashlib.md5(f.read()).hexdigest()
+            pkg.save()
+        self.directory = os.path.join(
+            self.cache, 'lepture', 'lazy', version, pkg['md5']
+        )
+        return '/repository/lepture/lazy/%s/dist/' % version
+
+    def test_get(self):
+        url = self.create_package('1.0.0', [
+            ('lazy/package.json', '{}'),
+            ('lazy/dist/lazy.js', 'define()'),
+            ('lazy/dist/css/lazy.css', 'body {}'),
+            ('lazy/dist/shell.php', ''),
+            ('lazy/src/lazy.js', 'src'),
+        ])
+        rv = self.client.get(url + 'lazy.js')
+        assert rv.status_code == 200
+        assert rv.data == 'define()'
+        assert rv.mimetype.endswith('javascript')
+        assert os.path.isfile(os.path.join(self.directory, 'lazy.js'))
+
+        # served from the cache
+        rv = self.client.get(url + 'lazy.js')
+        assert rv.data == 'define()'
+        rv = self.client.get(url + 'css/lazy.css')
+        assert rv.data == 'body {}'
+
+        for name in ('missing.js', 'shell.php', '../src/lazy.js'):
+            rv = self.client.get(url + name)
+            assert rv.status_code == 404
+        rv = self.client.get('/repository/lepture/lazy/9.0.0/dist/lazy.js')
+        assert rv.status_code == 404
+        assert not os.path.exists(os.path.join(self.directory, 'missing.js'))
+
+    def test_evict(self):
+        self.app.config['ASSETS_CACHE_SIZE'] = 3500
+        url = self.create_package('2.0.0', [
+            ('dist/%d.js' % i, str(i) * 1000) for i in range(4)
+        ])
+        directory = self.directory
+        for i in range(3):
+            assert self.client.get(url + '%d.js' % i).status_code == 200
+            # access time is older than the touch interval
+            past = time.time() - 3600 * (10 - i)
+            os.utime(os.path.join(directory, '%d.js' % i), (past, past))
+
+        # 0.js is used recently, 1.js is the least recently used one
+        assert self.client.get(url + '0.js').status_code == 200
+        assert self.client.get(url + '3.js').status_code == 200
+        assert sorted(os.listdir(directory)) == ['0.js', '2.js', '3.js']
+        with self.app.test_request_context():
+            assert assetcache.evict() == 3000
+
+    def test_upload_again(self):
+        url = self.create_package('3.0.0', [('dist/a.js', 'old')])
+        assert self.client.get(url + 'a.js').data == 'old'
+        # uploaded again with force
+        url = self.create_package('3.0.0', [('dist/a.js', 'new')])
+        assert self.client.get(url + 'a.js').data == 'new'
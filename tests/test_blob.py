@@ -0,0 +1,134 @@
+# coding: utf-8
+
+import os
+import hashlib
+from flask import json
+from yuan.models import store_blob, store_tree, remove_tree
+from yuan.models import collect_blobs, blob_report
+
+from .suite import BaseSuite
+
+ROOT = os.path.join('tests', 'data', 'blobs')
+
+
+def write(fpath, content):
+    directory = os.path.dirname(fpath)
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    with open(fpath, 'wb') as f:
+        f.write(content)
+    return fpath
+
+
+class TestBlobCase(BaseSuite):
+    def prehook(self):
+        self.app.config['WWW_ROOT'] = ROOT
+        self.ctx = self.app.test_request_context()
+        self.ctx.push()
+
+    def posthook(self):
+        self.ctx.pop()
+
+    def test_store(self):
+        a = write(os.path.join(ROOT, 'a', '1.0.0', 'a.js'), 'same' * 100)
+        b = write(os.path.join(ROOT, 'a', '1.1.0', 'a.js'), 'same' * 100)
+        c = write(os.path.join(ROOT, 'a', '1.1.0', 'b.js'), 'other')
+        assert store_tree(os.path.join(ROOT, 'a')) == 3
+        assert os.path.samefile(a, b)
+        assert not os.path.samefile(a, c)
+        with open(b) as f:
+            assert f.read() == 'same' * 100
+
+        # stored again, nothing changes
+        assert store_blob(a) == store_blob(b)
+        report = blob_report()
+        assert report['blobs'] == 2
+        assert report['links'] == 3
+        assert report['saved'] == 400
+
+        remove_tree(os.path.join(ROOT, 'a', '1.1.0'))
+        report = blob_report()
+        assert report['blobs'] == 1
+        assert report['saved'] == 0
+
+        remove_tree(os.path.join(ROOT, 'a'))
+        assert blob_report()['blobs'] == 0
+
+    def test_collect(self):
+        fpath = write(os.path.join(ROOT, 'c', 'c.js'), 'collect')
+        store_blob(fpath)
+        os.remove(fpath)
+        assert blob_report()['unused'] == 1
+        assert collect_blobs() == 1
+        assert blob_report()['blobs'] == 0
+
+    def test_disabled(self):
+        self.app.config['BLOB_STORE'] = False
+        fpath = write(os.path.join(ROOT, 'd', 'd.js'), 'disabled')
+        assert store_blob(fpath) is None
+        assert blob_report()['blobs'] == 0
+
+
+class TestUploadBlobCase(BaseSuite):
+    def prehook(self):
+        self.create_account()
+
+    def upload(self, version, tarball='tarball'):
+        url = '/repository/lepture/blob/%s/' % version
+        headers = self.login_account()
+        headers['X-Yuan-Force'] = 'true'
+        self.client.post(
+            url, headers=headers, content_type='application/json',
+            data=json.dumps(dict())
+        )
+        headers['Content-Encoding'] = 'gzip'
+        rv = self.client.put(
+            url, headers=headers, content_type='application/x-tar',
+            data=tarball
+        )
+        data = json.loads(rv.data)
+        return os.path.join(
+            'tests/data/repository/lepture/blob', version, data['filename']
+        )
+
+    def test_upload(self):
+        a = self.upload('1.0.0')
+        b = self.upload('2.0.0')
+        assert os.path.samefile(a, b)
+        assert os.stat(a).st_nlink == 3
+
+        headers = self.login_account()
+        rv = self.client.delete(
+            '/repository/lepture/blob/2.0.0/', headers=headers
+        )
+        assert rv.status_code == 200
+        assert os.stat(a).st_nlink == 2
+
+    def blob(self, content):
+        sha256 = hashlib.sha256(content).hexdigest()
+        return os.path.join('tests/data/.blobs', sha256[:2], sha256[2:])
+
+    def test_upload_again(self):
+        blob = self.blob
+
+        fpath = self.upload('3.0.0', 'first upload')
+        assert os.path.samefile(fpath, blob('first upload'))
+        # the blob of the replaced tarball is released
+        fpath = self.upload('3.0.0', 'forced upload')
+        assert os.path.samefile(fpath, blob('forced upload'))
+        assert not os.path.exists(blob('first upload'))
+
+    def test_delete(self):
+        headers = self.login_account()
+        fpath = self.upload('4.0.0', 'only version')
+        assert os.path.samefile(fpath, self.blob('only version'))
+        rv = self.client.delete(
+            '/repository/lepture/blob/4.0.0/', headers=headers
+        )
+        assert rv.status_code == 200
+        assert not os.path.exists(self.blob('only version'))
+
+        self.upload('5.0.0', 'deleted project')
+        rv = self.client.delete('/repository/lepture/blob/', headers=headers)
+        assert rv.status_code == 200
+        assert not os.path.exists(self.blob('deleted project'))
@@ -0,0 +1,54 @@
+# coding: utf-8
+
+import os
+from flask import json
+from yuan.models import Project, metacache
+
+from .suite import BaseSuite
+
+
+class TestMetadataCache(BaseSuite):
+    def prehook(self):
+        metacache.clear()
+        with self.app.test_request_context():
+            project = Project(family='lepture', name='cached')
+            project.save()
+
+    def test_hit_and_copy(self):
+        with self.app.test_request_context():
+            project = Project(family='lepture', name='cached')
+            assert 'created_at' in project
+            misses = metacache.misses
+
+            project['description'] = 'changed'
+            project = Project(family='lepture', name='cached')
+            assert metacache.misses == misses
+            assert metacache.hits > 0
+            assert 'description' not in project
+
+    def test_invalidate(self):
+        with self.app.test_request_context():
+            project = Project(family='lepture', name='cached')
+            project['description'] = 'saved'
+            project.save()
+            project = Project(family='lepture', name='cached')
+            assert project.description == 'saved'
+
+    def test_external_change(self):
+        with self.app.test_request_context():
+            project = Project(family='lepture', name='cached')
+            fpath = project.datafile
+            with open(fpath, 'w') as f:
+                json.dump({'created_at': 'now', 'homepage': 'changed!'}, f)
+            os.utime(fpath, (0, 0))
+            project = Project(family='lepture', name='cached')
+            assert project.homepage == 'changed!'
+
+    def test_eviction(self):
+        cache = metacache.__class__(capacity=2)
+        for name in ('a', 'b', 'c'):
+            fpath = os.path.join('tests', 'data', '%s.json' % name)
+            with open(fpath, 'w') as f:
+                json.dump({'name': name}, f)
+            cache.get(fpath, lambda p: json.load(open(p)))
+        assert cache.stats()['size'] == 2
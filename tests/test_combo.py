@@ -0,0 +1,75 @@
+# coding: utf-8
+
+import os
+import time
+from yuan.models import combocache
+
+from .suite import BaseSuite
+
+ROOT = os.path.join('tests', 'data', 'combo')
+
+
+def write(fpath, content):
+    directory = os.path.dirname(fpath)
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    with open(fpath, 'wb') as f:
+        f.write(content)
+
+
+class TestComboCase(BaseSuite):
+    def prehook(self):
+        self.app.config['ASSETS_ROOT'] = ROOT
+        combocache.clear()
+        write(os.path.join(ROOT, 'seajs/1.0.0/a.js'), 'a();')
+        write(os.path.join(ROOT, 'seajs/1.0.0/lib/b.js'), 'b();')
+        write(os.path.join(ROOT, 'seajs/1.0.0/c.css'), 'body {}')
+
+    def test_combo(self):
+        url = '/assets/seajs/1.0.0/??a.js,lib/b.js?v=1'
+        rv = self.client.get(url)
+        assert rv.status_code == 200
+        assert rv.data == 'a();b();'
+        assert rv.mimetype.endswith('javascript')
+        assert rv.content_length == 8
+        assert 'max-age=31536000' in rv.headers['Cache-Control']
+        etag = rv.headers['ETag']
+        assert not etag.startswith('W/')
+        assert combocache.size == 8
+
+        rv = self.client.get(url, headers={'If-None-Match': etag})
+        assert rv.status_code == 304
+
+        rv = self.client.get('/assets/??seajs/1.0.0/a.js,seajs/1.0.0/a.js')
+        assert rv.data == 'a();a();'
+
+    def test_changed(self):
+        url = '/assets/seajs/1.0.0/??a.js,lib/b.js'
+        etag = self.client.get(url).headers['ETag']
+
+        time.sleep(0.01)
+        write(os.path.join(ROOT, 'seajs/1.0.0/a.js'), 'changed();')
+        rv = self.client.get(url, headers={'If-None-Match': etag})
+        assert rv.status_code == 200
+        assert rv.data == 'changed();b();'
+        assert rv.headers['ETag'] != etag
+
+    def test_invalid(self):
+        for url in (
+                '/assets/seajs/1.0.0/??a.js,missing.js',
+                '/assets/seajs/1.0.0/??a.js,../../seajs/1.0.0/a.js',
+                '/assets/seajs/1.0.0/?a.js',
+                '/assets/seajs/1.0.0/'):
+            assert self.client.get(url).status_code == 404
+        rv = self.client.get('/assets/seajs/1.0.0/??a.js,c.css')
+        assert rv.status_code == 400
+
+    def test_static(self):
+        rv = self.client.get('/_static/css/??fn.css,forms.css')
+        assert rv.status_code == 200
+        static = self.app.static_folder
+        content = ''
+        for name in ('fn.css', 'forms.css'):
+            with open(os.path.join(static, 'css', name)) as f:
+                content += f.read()
+        assert rv.data == content
@@ -0,0 +1,48 @@
+# coding: utf-8
+
+import multiprocessing
+from yuan.models import Project, index_project
+
+from .suite import BaseSuite
+
+PUBLISHERS = 8
+VERSIONS = 10
+
+
+def _publish(app, index):
+    with app.test_request_context():
+        for i in range(VERSIONS):
+            version = '%d.%d.0' % (index, i)
+            for name in ('stress', 'stress-%d' % index):
+                project = Project(family='lepture', name=name)
+                project.update({'version': version, 'tag': 'stable'})
+                index_project(project, 'update')
+
+
+class TestConcurrentPublish(BaseSuite):
+    def test_publish(self):
+        jobs = []
+        for index in range(PUBLISHERS):
+            job = multiprocessing.Process(
+                target=_publish, args=(self.app, index)
+            )
+            job.start()
+            jobs.append(job)
+
+        for job in jobs:
+            job.join()
+            assert job.exitcode == 0
+
+        with self.app.test_request_context():
+            project = Project(family='lepture', name='stress')
+            assert len(project.packages) == PUBLISHERS * VERSIONS
+
+            names = [o['name'] for o in Project.list('lepture')]
+            for index in range(PUBLISHERS):
+                assert 'stress-%d' % index in names
+                project = Project(family='lepture', name='stress-%d' % index)
+                assert len(project.packages) == VERSIONS
+
+            manifest = Project.manifest()
+            assert 'lepture/stress' in manifest
+            assert len(set(names)) == len(names)
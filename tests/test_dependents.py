@@ -0,0 +1,106 @@
+# coding: utf-8
+
+import os
+import sys
+import subprocess
+import tempfile
+from flask import json
+from yuan.models import Project, Package, get_storage
+from yuan.models import project_signal, package_signal
+from scripts.dependents import rebuild, ROOTDIR
+
+from .suite import BaseSuite
+
+
+class TestDependentsCase(BaseSuite):
+    def publish(self, name, version, dependencies, operation='update'):
+        with self.app.test_request_context():
+            project = Project(family='dependents', name=name)
+            project.update({'version': version, 'dependencies': [
+                'dependents/%s' % o for o in dependencies
+            ]})
+            pkg = Package(family='dependents', name=name, version=version)
+            package_signal.send(self.app, changes=(pkg, operation))
+
+    def dependents(self, pkg, **kwargs):
+        url = '/repository/dependents/%s/-/dependents' % pkg
+        rv = self.client.get(url, query_string=kwargs)
+        return json.loads(rv.data)
+
+    def test_dependents(self):
+        self.publish('a', '1.0.0', ['base@1.0.0'])
+        for name in ('b', 'c', 'd'):
+            self.publish(name, '1.0.0', ['base@1.0.0'])
+
+        data = self.dependents('base/1.0.0')
+        assert data['total'] == 4
+        assert data['dependents'][0] == 'dependents/a@1.0.0'
+
+        data = self.dependents('base/1.0.0', page=2, limit=3)
+        assert data['dependents'] == ['dependents/d@1.0.0']
+        assert data['pages'] == 2
+
+        # dependencies are replaced, not appended
+        self.publish('a', '1.0.0', [])
+        self.publish('b', '1.0.0', [], operation='delete')
+        data = self.dependents('base/1.0.0')
+        assert data['dependents'] == [
+            'dependents/c@1.0.0', 'dependents/d@1.0.0'
+        ]
+
+        with self.app.test_request_context():
+            project = Project(family='dependents', name='c')
+            project.delete()
+            project_signal.send(self.app, changes=(project, 'delete'))
+        data = self.dependents('base/1.0.0')
+        assert data['dependents'] == ['dependents/d@1.0.0']
+
+        # package documents are not changed
+        with self.app.test_request_context():
+            pkg = Package(family='dependents', name='base', version='1.0.0')
+            assert 'created_at' not in pkg
+
+    def test_transitive(self):
+        self.publish('core', '1.0.0', [])
+        self.publish('widget', '1.0.0', ['core@1.0.0'])
+        self.publish('page', '1.0.0', ['widget@1.0.0'])
+        self.publish('page', '1.1.0', ['widget@1.0.0'])
+
+        rv = self.client.get('/repository/dependents/core/')
+        data = json.loads(rv.data)
+        assert data['transitive_dependents'] == 3
+
+    def test_rebuild(self):
+        self.publish('x', '1.0.0', ['y@1.0.0'])
+        with self.app.test_request_context():
+            storage = get_storage()
+            storage.rebuild_dependents({})
+            assert not storage.dependents('dependents', 'y', '1.0.0')
+
+            assert rebuild(self.app.config, 2) > 0
+            assert storage.dependents('dependents', 'y', '1.0.0') == [
+                'dependents/x@1.0.0'
+            ]
+
+    def test_rebuild_command(self):
+        self.publish('m', '1.0.0', ['n@1.0.0'])
+        with self.app.test_request_context():
+            storage = get_storage()
+            storage.rebuild_dependents({})
+
+        # the way manager.py runs it, with an override of the base config
+        fd, fpath = tempfile.mkstemp(suffix='.py')
+        os.write(fd, 'WWW_ROOT = %r\n' % os.path.abspath('tests/data'))
+        os.close(fd)
+        try:
+            subprocess.check_call(
+                [sys.executable, '-m', 'scripts.dependents', fpath, '2'],
+                cwd=ROOTDIR,
+            )
+        finally:
+            os.remove(fpath)
+
+        with self.app.test_request_context():
+            assert get_storage().dependents('dependents', 'n', '1.0.0') == [
+                'dependents/m@1.0.0'
+            ]
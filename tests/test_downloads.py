@@ -0,0 +1,99 @@
+# coding: utf-8
+
+import os
+import gzip
+import shutil
+from flask import json
+from yuan.models import Project, create_storage, popular, rank_project
+from scripts.downloads import ingest, log_files
+
+from .suite import BaseSuite
+
+ROOT = os.path.join('tests', 'data', 'downloads')
+LOG = os.path.join(ROOT, 'access.log')
+CHECKPOINT = os.path.join(ROOT, '.downloads.json')
+
+
+def _line(path, day=10, status=200):
+    return (
+        '127.0.0.1 - - [%02d/Oct/2013:10:00:00 +0800] "GET %s HTTP/1.1" '
+        '%d 1024 "-" "spm"\n' % (day, path, status)
+    )
+
+
+def _download(name, version, day=10, status=200):
+    path = '/repository/down/%s/%s/%s-%s.tar.gz' % (
+        name, version, name, version
+    )
+    return _line(path, day, status)
+
+
+class TestDownloadsCase(BaseSuite):
+    def prehook(self):
+        if os.path.exists(ROOT):
+            shutil.rmtree(ROOT)
+        self.storage = create_storage('memory', ROOT)
+        self.app.config['WWW_ROOT'] = ROOT
+        self.app.config['METADATA_STORAGE'] = self.storage
+        self.ctx = self.app.test_request_context()
+        self.ctx.push()
+        for name in ('arale', 'class'):
+            project = Project(family='down', name=name)
+            project.update({'version': '1.0.0', 'tag': 'stable'})
+            rank_project(project, 'update')
+
+    def posthook(self):
+        self.ctx.pop()
+
+    def test_ingest(self):
+        with gzip.open(LOG + '.2.gz', 'wb') as f:
+            f.write(_download('arale', '1.0.0', day=8) * 3)
+        # concatenated gzip files are read to the end
+        with gzip.open(LOG + '.2.gz', 'ab') as f:
+            f.write(_download('class', '1.0.0', day=8))
+        with open(LOG + '.1', 'w') as f:
+            f.write(_download('arale', '1.0.0', day=9))
+            f.write(_download('arale', '1.0.0', status=304))
+            f.write(_line('/repository/down/arale/'))
+            f.write(_line('/repository/down/arale/1.0.0/index.json'))
+        with open(LOG, 'w') as f:
+            f.write(_download('class', '1.0.0'))
+            f.write(_download('class', '1.0.0'))
+            # half written
+            f.write(_download('arale', '1.0.0')[:30])
+
+        assert log_files(LOG) == [LOG + '.2.gz', LOG + '.1', LOG]
+        assert ingest(LOG, CHECKPOINT, batch_size=1) == 7
+        data = self.storage.downloads('down', 'arale')
+        assert data['total'] == 4
+        assert data['versions']['1.0.0']['days'] == {
+            '2013-10-08': 3, '2013-10-09': 1
+        }
+        assert self.storage.downloads('down', 'class')['total'] == 3
+
+        # nothing is counted twice
+        assert ingest(LOG, CHECKPOINT) == 0
+        with open(LOG, 'a') as f:
+            f.write(_download('arale', '1.0.0')[30:])
+
+        # the log is rotated and compressed
+        os.rename(LOG + '.2.gz', LOG + '.3.gz')
+        with open(LOG + '.1') as f:
+            with gzip.open(LOG + '.2.gz', 'wb') as gz:
+                gz.write(f.read())
+        os.rename(LOG, LOG + '.1')
+        with open(LOG, 'w') as f:
+            f.write(_download('arale', '1.0.0', day=11))
+
+        assert ingest(LOG, CHECKPOINT) == 2
+        data = self.storage.downloads('down', 'arale')
+        assert data['total'] == 6
+        with open(CHECKPOINT) as f:
+            assert len(json.load(f)) == 4
+
+        assert popular.items()[0]['name'] == 'arale'
+        assert popular.items()[0]['downloads'] == 6
+
+        rv = self.client.get('/repository/down/arale/')
+        data = json.loads(rv.data)
+        assert data['downloads'] == {'total': 6, 'versions': {'1.0.0': 6}}
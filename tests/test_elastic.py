@@ -0,0 +1,127 @@
+# coding: utf-8
+
+import time
+import threading
+from flask import Flask, json, request, abort, Response
+from requests.exceptions import ConnectionError
+from werkzeug.serving import make_server
+from yuan.elastic import elastic, index_project
+
+
+def create_elastic():
+    """A stand-in of elasticsearch."""
+    app = Flask('elastic')
+    app.requests = []
+    app.errors = 0
+    app.delay = 0
+
+    @app.before_request
+    def fail():
+        if app.errors:
+            app.errors -= 1
+            abort(503)
+        time.sleep(app.delay)
+
+    @app.route('/yuan/_bulk', methods=['POST'])
+    def bulk():
+        lines = [json.loads(o) for o in request.data.splitlines()]
+        app.requests.append(list(lines))
+        items = []
+        while lines:
+            action = lines.pop(0)
+            (op, meta), = action.items()
+            item = {'_id': meta['_id'], 'status': 200}
+            if op == 'index' and 'name' not in lines.pop(0):
+                item['error'] = 'MapperParsingException'
+            items.append({op: item})
+        return Response(json.dumps({'took': 1, 'items': items}))
+
+    @app.route('/yuan/project/<id>', methods=['POST'])
+    def project(id):
+        app.requests.append([json.loads(request.data)])
+        return Response(json.dumps({'_id': id, 'ok': True}))
+
+    return app
+
+
+class TestElastic(object):
+    def setUp(self):
+        self.upstream = create_elastic()
+        self.server = make_server(
+            '127.0.0.1', 0, self.upstream, threaded=True
+        )
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        self.app = Flask('downstream')
+        self.app.config.update({
+            'ELASTICSEARCH_HOST': 'http://127.0.0.1:%d' % (
+                self.server.server_port
+            ),
+            'ELASTICSEARCH_INDEX': 'yuan',
+            'ELASTICSEARCH_BACKOFF': 0,
+        })
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+
+    def tearDown(self):
+        self.ctx.pop()
+        self.server.shutdown()
+
+    def project(self, name):
+        return {
+            'family': 'lepture', 'name': name, 'version': '1.0.0',
+            'packages': {'1.0.0': {'description': name, 'keywords': []}},
+        }
+
+    def test_bulk_size(self):
+        with elastic.bulk(size=2) as bulk:
+            for name in 'abcde':
+                index_project(self.project(name), 'update', bulk)
+            index_project(self.project('f'), 'delete', bulk)
+            # nothing to index without packages
+            index_project({'family': 'lepture', 'name': 'g'}, 'update', bulk)
+        assert [len(o) for o in self.upstream.requests] == [4, 4, 3]
+        assert self.upstream.requests[0][0] == {
+            'index': {'_type': 'project', '_id': 'lepture.a'}
+        }
+        assert self.upstream.requests[-1][-1] == {
+            'delete': {'_type': 'project', '_id': 'lepture.f'}
+        }
+        assert bulk.count == 6
+        assert bulk.failures == []
+
+    def test_bulk_bytes(self):
+        bulk = elastic.bulk()
+        index_project(self.project('a'), 'update', bulk)
+        with elastic.bulk(bytes=bulk.length * 2 + 1) as bulk:
+            for name in 'abcde':
+                index_project(self.project(name), 'update', bulk)
+        assert [len(o) for o in self.upstream.requests] == [4, 4, 2]
+
+    def test_failures(self):
+        self.upstream.errors = 2
+        with elastic.bulk() as bulk:
+            bulk.index('project', 'lepture.a', {'family': 'lepture'})
+            index_project(self.project('b'), 'update', bulk)
+        assert len(self.upstream.requests) == 1
+        assert bulk.failures == [
+            ('index', 'lepture.a', 'MapperParsingException')
+        ]
+
+    def test_timeout(self):
+        self.app.config['ELASTICSEARCH_TIMEOUT'] = 0.2
+        self.app.config['ELASTICSEARCH_RETRIES'] = 0
+        self.upstream.delay = 1
+        started = time.time()
+        try:
+            index_project(self.project('a'), 'update')
+            assert False, 'timeout is expected'
+        except ConnectionError:
+            pass
+        assert time.time() - started < 1
+
+        self.upstream.delay = 0
+        index_project(self.project('a'), 'update')
+        assert self.upstream.requests[-1][0]['name'] == 'a'
@@ -0,0 +1,316 @@
+# coding: utf-8
+
+import os
+import shutil
+import hashlib
+import tarfile
+import threading
+from StringIO import StringIO
+from flask import Flask, json, abort, Response
+from werkzeug.serving import make_server
+from yuan.models import Project, get_storage
+from scripts.mirror import mirror
+
+ROOT = os.path.join('tests', 'data', 'mirror')
+
+
+def _tarball(name, files):
+    buf = StringIO()
+    tar = tarfile.open(fileobj=buf, mode='w:gz')
+    for filename, content in files:
+        info = tarfile.TarInfo('%s/%s' % (name, filename))
+        info.size = len(content)
+        tar.addfile(info, StringIO(content))
+    tar.close()
+    return buf.getvalue()
+
+
+def _package(family, name, version):
+    if family == 'seajs':
+        tarball = _tarball(name, [
+            ('package.json', '{}'), ('dist/sea.js', 'define()'),
+            ('dist/sea-debug.js', 'define();\n' * 500),
+        ])
+    else:
+        tarball = ('%s/%s@%s\n' % (family, name, version)) * 5000
+    pkg = {
+        'family': family, 'name': name, 'version': version,
+        'tag': 'stable', 'filename': '%s-%s.tar.gz' % (name, version),
+        'md5': hashlib.md5(tarball).hexdigest(),
+        'created_at': '2013-01-01T00:00:00Z',
+        'updated_at': '2013-01-02T00:00:00Z',
+    }
+    if name == 'arale':
+        pkg['dependencies'] = ['lepture/class@1.0.0']
+    return pkg, tarball
+
+
+def create_upstream():
+    """A stand-in of the upstream site."""
+    app = Flask('upstream')
+    app.projects = {}
+    app.tarballs = {}
+    app.changes = []
+    app.errors = {}
+    app.ranges = []
+    app.search = []
+
+    for family, name, version in (
+            ('lepture', 'arale', '1.0.0'), ('lepture', 'arale', '1.1.0'),
+            ('lepture', 'class', '1.0.0'), ('seajs', 'seajs', '2.0.0')):
+        pkg, tarball = _package(family, name, version)
+        project = app.projects.setdefault((family, name), {
+            'family': family, 'name': name, 'packages': {},
+            'created_at': pkg['created_at'],
+            'updated_at': pkg['updated_at'],
+        })
+        project['version'] = version
+        project['packages'][version] = pkg
+        app.tarballs[pkg['filename']] = tarball
+        app.changes.append({
+            'seq': len(app.changes) + 1, 'type': 'package', 'op': 'upload',
+            'family': family, 'name': name, 'version': version,
+        })
+
+    def respond(data):
+        return Response(json.dumps(data), content_type='application/json')
+
+    @app.before_request
+    def fail():
+        from flask import request
+        count = app.errors.get(request.path)
+        if count:
+            app.errors[request.path] = count - 1
+            abort(503)
+
+    @app.route('/repository/_changes')
+    def changes():
+        from flask import request
+        since = request.args.get('since', 0, type=int)
+        results = app.changes[since:]
+        last_seq = results and results[-1]['seq'] or since
+        return respond({'results': results, 'last_seq': last_seq})
+
+    @app.route('/repository/<family>/')
+    def family(family):
+        return respond([
+            dict((k, v) for k, v in o.items() if k != 'packages')
+            for key, o in app.projects.items() if key[0] == family
+        ])
+
+    @app.route('/repository/<family>/<name>/')
+    def project(family, name):
+        if (family, name) not in app.projects:
+            abort(404)
+        return respond(app.projects[(family, name)])
+
+    @app.route('/repository/<family>/<name>/<version>/')
+    def package(family, name, version):
+        return respond(app.projects[(family, name)]['packages'][version])
+
+    @app.route('/repository/<family>/<name>/<version>/<filename>')
+    def tarball(family, name, version, filename):
+        from flask import request
+        data = app.tarballs[filename]
+        if 'Range' not in request.headers:
+            return data
+        offset = int(request.headers['Range'][6:-1])
+        app.ranges.append(offset)
+        if offset >= len(data):
+            abort(416)
+        rv = Response(data[offset:], status=206)
+        rv.headers['Content-Range'] = 'bytes %d-%d/%d' % (
+            offset, len(data) - 1, len(data)
+        )
+        return rv
+
+    @app.route('/search/_bulk', methods=['POST'])
+    def bulk():
+        # a stand-in of elasticsearch
+        from flask import request
+        lines = [json.loads(o) for o in request.data.splitlines()]
+        items = []
+        while lines:
+            action = lines.pop(0)
+            if 'index' in action:
+                lines.pop(0)
+            (op, meta), = action.items()
+            app.search.append((op, meta['_id']))
+            items.append({op: {'_id': meta['_id'], 'status': 200}})
+        return respond({'took': 1, 'items': items})
+
+    return app
+
+
+class TestMirror(object):
+    def setUp(self):
+        if os.path.exists(ROOT):
+            shutil.rmtree(ROOT)
+        self.upstream = create_upstream()
+        self.server = make_server(
+            '127.0.0.1', 0, self.upstream, threaded=True
+        )
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.url = 'http://127.0.0.1:%d/repository/' % (
+            self.server.server_port
+        )
+
+        self.config = Flask('downstream').config
+        self.config.update({
+            'WWW_ROOT': ROOT,
+            'ELASTICSEARCH_HOST': 'http://127.0.0.1:%d' % (
+                self.server.server_port
+            ),
+            'ELASTICSEARCH_INDEX': 'search',
+            'MIRROR_WORKERS': 2,
+            'MIRROR_CONNECTIONS': 2,
+            'MIRROR_BACKOFF': 0,
+        })
+
+    def tearDown(self):
+        self.server.shutdown()
+
+    def read(self, family, name):
+        app = Flask('downstream')
+        app.config = self.config
+        with app.test_request_context():
+            return Project(family=family, name=name)
+
+    def dependents(self, family, name, version):
+        app = Flask('downstream')
+        app.config = self.config
+        with app.test_request_context():
+            return get_storage().dependents(family, name, version)
+
+    def check_tarballs(self, families=('lepture', 'seajs')):
+        for filename, tarball in self.upstream.tarballs.items():
+            name, version = filename[:-7].split('-')
+            family = 'seajs' if name == 'seajs' else 'lepture'
+            if family not in families:
+                continue
+            fpath = os.path.join(
+                ROOT, 'repository', family, name, version, filename
+            )
+            with open(fpath, 'rb') as f:
+                assert f.read() == tarball
+
+    def test_mirror(self):
+        # flaky requests are retried
+        self.upstream.errors['/repository/lepture/arale/'] = 2
+        self.upstream.errors['/repository/seajs/'] = 1
+
+        rv = mirror(
+            [self.url + 'lepture/', self.url + 'seajs/'], self.config
+        )
+        assert rv.failures == []
+        assert not any(self.upstream.errors.values())
+        assert rv.files == 4
+        assert rv.bytes > sum(len(o) for o in self.upstream.tarballs.values())
+        self.check_tarballs()
+        project = self.read('lepture', 'arale')
+        assert sorted(project.packages) == ['1.0.0', '1.1.0']
+        assert sorted(self.upstream.search) == [
+            ('index', 'lepture.arale'), ('index', 'lepture.class'),
+            ('index', 'seajs.seajs'),
+        ]
+
+    def test_failures(self):
+        self.upstream.errors['/repository/lepture/class/'] = 10
+
+        rv = mirror(self.url + 'lepture/', self.config)
+        assert len(rv.failures) == 1
+        assert rv.files == 2
+        assert self.read('lepture', 'arale').version == '1.1.0'
+
+    def test_follow(self):
+        rv = mirror(self.url, self.config, changes=True)
+        assert rv.failures == []
+        assert rv.files == 4
+        self.check_tarballs()
+
+        with open(os.path.join(ROOT, 'mirror', '127.0.0.1:%d' %
+                               self.server.server_port)) as f:
+            assert json.load(f)['since'] == 4
+
+        del self.upstream.projects[('lepture', 'class')]
+        self.upstream.changes.append({
+            'seq': 5, 'type': 'project', 'op': 'delete',
+            'family': 'lepture', 'name': 'class',
+        })
+        rv = mirror(self.url + 'lepture/', self.config, changes=True)
+        assert rv.files == 0
+        assert 'created_at' not in self.read('lepture', 'class')
+        assert 'created_at' in self.read('lepture', 'arale')
+        assert self.upstream.search[-1] == ('delete', 'lepture.class')
+
+    def test_resume(self):
+        filename = 'class-1.0.0.tar.gz'
+        tarball = self.upstream.tarballs[filename]
+        fpath = os.path.join(
+            ROOT, 'repository', 'lepture', 'class', '1.0.0', filename
+        )
+        os.makedirs(os.path.dirname(fpath))
+        with open(fpath + '.part', 'wb') as f:
+            f.write(tarball[:1000])
+
+        rv = mirror(self.url + 'lepture/', self.config)
+        assert rv.failures == []
+        assert self.upstream.ranges == [1000]
+        assert not os.path.exists(fpath + '.part')
+        self.check_tarballs(['lepture'])
+
+    def test_md5_mismatch(self):
+        filename = 'class-1.0.0.tar.gz'
+        self.upstream.tarballs[filename] = 'corrupt'
+        rv = mirror(self.url + 'lepture/', self.config)
+        assert len(rv.failures) == 1
+
+        fpath = os.path.join(
+            ROOT, 'repository', 'lepture', 'class', '1.0.0', filename
+        )
+        assert not os.path.exists(fpath)
+        assert not os.path.exists(fpath + '.part')
+        assert 'created_at' not in self.read('lepture', 'class')
+
+    def test_extract(self):
+        assets = os.path.join(ROOT, 'assets')
+        self.config['ASSETS_ROOT'] = assets
+        self.config['GZIP_STATIC'] = True
+        rv = mirror(self.url + 'seajs/', self.config)
+        assert rv.failures == []
+        fpath = os.path.join(assets, 'seajs', 'seajs', '2.0.0', 'sea.js')
+        with open(fpath) as f:
+            assert f.read() == 'define()'
+        # extractor processes get the config of gzip_static
+        assert os.path.exists(
+            os.path.join(os.path.dirname(fpath), 'sea-debug.js.gz')
+        )
+
+    def test_dependents(self):
+        mirror(self.url, self.config, changes=True)
+        assert self.dependents('lepture', 'class', '1.0.0') == [
+            'lepture/arale@1.0.0', 'lepture/arale@1.1.0',
+        ]
+
+        # a version removed upstream
+        project = self.upstream.projects[('lepture', 'arale')]
+        del project['packages']['1.0.0']
+        self.upstream.changes.append({
+            'seq': 5, 'type': 'package', 'op': 'delete',
+            'family': 'lepture', 'name': 'arale', 'version': '1.0.0',
+        })
+        mirror(self.url + 'lepture/', self.config, changes=True)
+        assert self.dependents('lepture', 'class', '1.0.0') == [
+            'lepture/arale@1.1.0',
+        ]
+
+        # a project deleted upstream
+        del self.upstream.projects[('lepture', 'arale')]
+        self.upstream.changes.append({
+            'seq': 6, 'type': 'project', 'op': 'delete',
+            'family': 'lepture', 'name': 'arale',
+        })
+        mirror(self.url + 'lepture/', self.config, changes=True)
+        assert self.dependents('lepture', 'class', '1.0.0') == []
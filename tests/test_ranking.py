@@ -0,0 +1,114 @@
+# coding: utf-8
+
+import os
+from flask import json
+from yuan.models import Project, create_storage
+from yuan.models import popular, latest, rank_project, rank_popular
+from yuan.models import rebuild_rankings
+from yuan.models import project_signal, package_signal
+
+from .suite import BaseSuite
+
+ROOT = os.path.join('tests', 'data', 'ranking')
+
+
+class TestRankingCase(BaseSuite):
+    def prehook(self):
+        self.storage = create_storage('memory', ROOT)
+        self.app.config['WWW_ROOT'] = ROOT
+        self.app.config['METADATA_STORAGE'] = self.storage
+        self.app.config['RANKING_SIZE'] = 2
+        self.ctx = self.app.test_request_context()
+        self.ctx.push()
+
+    def posthook(self):
+        self.ctx.pop()
+
+    def publish(self, name, day, dependencies=(), tag='stable'):
+        key = ('rank', name)
+        pkg = {'family': 'rank', 'name': name, 'version': '1.0.0', 'tag': tag}
+        self.storage.write(key + ('1.0.0',), pkg)
+        self.storage.write(key, {
+            'family': 'rank', 'name': name, 'version': '1.0.0',
+            'created_at': '2013-01-01T00:00:00Z',
+            'updated_at': '2013-01-%02dT00:00:00Z' % day,
+            'packages': {'1.0.0': pkg},
+        })
+        rank_project({'family': 'rank', 'name': name}, 'update')
+        rank_popular(self.storage.set_dependencies(
+            key + ('1.0.0',), [('rank', o, '1.0.0') for o in dependencies]
+        ))
+
+    def delete(self, name):
+        self.storage.delete(('rank', name))
+        rank_project({'family': 'rank', 'name': name}, 'delete')
+
+    def names(self, ranking):
+        return [o['name'] for o in ranking.items()]
+
+    def test_latest(self):
+        for day, name in enumerate('abcdef'):
+            self.publish(name, day + 1)
+        assert self.names(latest) == ['f', 'e']
+        with open(latest.poolfile) as f:
+            pool = json.load(f)
+        assert sorted(pool['items']) == [
+            'rank/c', 'rank/d', 'rank/e', 'rank/f'
+        ]
+
+        # unstable projects are not ranked
+        self.publish('g', 10, tag='unstable')
+        assert self.names(latest) == ['f', 'e']
+
+        self.delete('f')
+        self.delete('e')
+        assert self.names(latest) == ['d', 'c']
+        # the pool is not enough, it is ranked again
+        self.delete('d')
+        assert self.names(latest) == ['c', 'b']
+
+        self.publish('a', 11)
+        assert self.names(latest) == ['a', 'c']
+        ranked = latest.items()
+        rebuild_rankings()
+        assert latest.items() == ranked
+
+    def test_popular(self):
+        self.publish('base', 1)
+        self.publish('util', 2, ['base'])
+        self.publish('widget', 3, ['util'])
+        self.publish('page', 4, ['widget', 'base'])
+        items = popular.items()
+        assert [o['name'] for o in items] == ['base', 'util']
+        assert items[0]['transitive_dependents'] == 3
+
+        self.publish('page', 4, [])
+        self.publish('widget', 3, [])
+        assert popular.items()[0]['transitive_dependents'] == 1
+        ranked = popular.items()
+        rebuild_rankings()
+        assert popular.items() == ranked
+
+
+class TestRankingSignalCase(BaseSuite):
+    def test_signals(self):
+        with self.app.test_request_context():
+            for name, deps in (('core', []), ('shell', ['core'])):
+                project = Project(family='ranking', name=name)
+                project.update({
+                    'version': '1.0.0', 'tag': 'stable',
+                    'dependencies': ['ranking/%s@1.0.0' % o for o in deps],
+                })
+                pkg = project.packages['1.0.0']
+                project_signal.send(self.app, changes=(project, 'update'))
+                package_signal.send(self.app, changes=(pkg, 'update'))
+
+        rv = self.client.get('/repository/popular.json')
+        data = json.loads(rv.data)
+        core = [o for o in data if o['name'] == 'core'][0]
+        assert core['transitive_dependents'] == 1
+        assert 'packages' not in core
+
+        rv = self.client.get('/repository/latest.json')
+        names = [o['name'] for o in json.loads(rv.data)]
+        assert 'shell' in names
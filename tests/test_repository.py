@@ -1,6 +1,9 @@
 # coding: utf-8
 
+import os
+import shutil
 from flask import json
+from yuan.models import create_storage
 from .suite import BaseSuite
 
 
@@ -73,3 +76,357 @@ class TestUploadCase(BaseSuite):
         assert rv.status_code is 200
         assert 'filename' in rv.data
         assert 'md5' in rv.data
+
+    def test_verify(self):
+        import hashlib
+        headers = self.login_account()
+        headers['X-Yuan-Force'] = 'true'
+        self.client.post(
+            '/repository/lepture/verify/1.0.0/', headers=headers,
+            content_type='application/json',
+            data=json.dumps(dict())
+        )
+
+        url = '/repository/lepture/verify/1.0.0/'
+        headers['Content-Encoding'] = 'gzip'
+        rv = self.client.put(
+            url, headers=headers, content_type='application/x-tar',
+            data='tarball'
+        )
+        data = json.loads(rv.data)
+        assert data['sha256'] == hashlib.sha256('tarball').hexdigest()
+        tarball = url + data['filename']
+
+        headers['X-Package-MD5'] = hashlib.md5('other').hexdigest()
+        rv = self.client.put(
+            url, headers=headers, content_type='application/x-tar',
+            data='corrupt'
+        )
+        assert rv.status_code == 400
+        assert self.client.get(tarball).data == 'tarball'
+
+        del headers['X-Package-MD5']
+        self.app.config['MAX_PACKAGE_SIZE'] = 4
+        rv = self.client.put(
+            url, headers=headers, content_type='application/x-tar',
+            data='too large'
+        )
+        assert rv.status_code == 413
+        assert self.client.get(tarball).data == 'tarball'
+        directory = 'tests/data/repository/lepture/verify/1.0.0'
+        assert sorted(os.listdir(directory)) == [
+            'index.json', data['filename']
+        ]
+
+
+class TestManifestCase(BaseSuite):
+    def prehook(self):
+        self.create_account()
+
+    def test_manifest(self):
+        from yuan.models import Project, check_manifest
+        headers = self.login_account()
+        headers['X-Yuan-Force'] = 'true'
+        rv = self.client.post(
+            '/repository/lepture/manifest/1.0.0/', headers=headers,
+            content_type='application/json',
+            data=json.dumps(dict())
+        )
+        assert rv.status_code == 200
+
+        rv = self.client.get('/repository/')
+        assert 'lepture/manifest' in json.loads(rv.data)
+
+        with self.app.test_request_context():
+            item = Project.manifest()['lepture/manifest']
+            assert item['version'] == '1.0.0'
+            assert 'updated_at' in item
+            drift = dict(check_manifest())
+            assert 'lepture/manifest' not in drift
+
+        rv = self.client.delete(
+            '/repository/lepture/manifest/', headers=headers
+        )
+        rv = self.client.get('/repository/')
+        assert 'lepture/manifest' not in json.loads(rv.data)
+
+
+class TestVersionCase(BaseSuite):
+    def prehook(self):
+        self.create_account()
+
+    def test_versions(self):
+        from yuan.models import Project
+        headers = self.login_account()
+        headers['X-Yuan-Force'] = 'true'
+        for version in ('1.0.0', '1.1.0-beta.1', '0.9.0', '1.1.0'):
+            rv = self.client.post(
+                '/repository/lepture/ordered/%s/' % version,
+                headers=headers,
+                content_type='application/json',
+                data=json.dumps(dict())
+            )
+            assert rv.status_code == 200
+        assert json.loads(rv.data)['tag'] == 'stable'
+
+        with self.app.test_request_context():
+            project = Project(family='lepture', name='ordered')
+            assert project.version == '1.1.0'
+            assert project['versions'] == [
+                '1.1.0', '1.1.0-beta.1', '1.0.0', '0.9.0'
+            ]
+            pkg = project['packages']['1.1.0-beta.1']
+            assert pkg['tag'] == 'unstable'
+            assert pkg.tag == 'unstable'
+
+        rv = self.client.get('/repository/lepture/ordered/')
+        data = json.loads(rv.data)
+        assert data['packages']['1.0.0']['tag'] == 'stable'
+
+        rv = self.client.get('/repository/lepture/')
+        assert 'ordered' in rv.data
+
+        rv = self.client.get('/lepture/')
+        assert rv.status_code == 200
+
+        rv = self.client.get('/lepture/ordered/')
+        assert rv.status_code == 200
+        assert '1.1.0, 1.1.0-beta.1, 1.0.0, 0.9.0' in rv.data
+
+
+class TestChangesCase(BaseSuite):
+    def prehook(self):
+        self.create_account()
+
+    def test_changes(self):
+        rv = self.client.get('/repository/_changes')
+        since = json.loads(rv.data)['last_seq']
+        rv = self.client.get('/repository/_changes?since=%d' % since)
+        since = json.loads(rv.data)['last_seq']
+
+        headers = self.login_account()
+        headers['X-Yuan-Force'] = 'true'
+        rv = self.client.post(
+            '/repository/lepture/changes/1.0.0/', headers=headers,
+            content_type='application/json',
+            data=json.dumps(dict())
+        )
+        assert rv.status_code == 200
+        self.client.delete('/repository/lepture/changes/', headers=headers)
+
+        rv = self.client.get('/repository/_changes?since=%d' % since)
+        data = json.loads(rv.data)
+        changes = [(o['type'], o['op']) for o in data['results']]
+        assert changes == [
+            ('project', 'create'), ('package', 'update'),
+            ('project', 'update'), ('project', 'delete'),
+        ]
+        assert data['results'][1]['version'] == '1.0.0'
+        assert data['last_seq'] == data['results'][-1]['seq']
+
+        url = '/repository/_changes?since=%d&limit=1' % since
+        data = json.loads(self.client.get(url).data)
+        assert len(data['results']) == 1
+
+        last_seq = json.loads(rv.data)['last_seq']
+        url = '/repository/_changes?since=%d&feed=longpoll&timeout=0.2'
+        data = json.loads(self.client.get(url % last_seq).data)
+        assert data['results'] == []
+        assert data['last_seq'] == last_seq
+
+    def test_clamp(self):
+        # sqlite reads LIMIT -1 as no limit
+        root = os.path.join('tests', 'data', 'changes')
+        if os.path.exists(root):
+            shutil.rmtree(root)
+        os.makedirs(root)
+        storage = create_storage('sqlite', root)
+        self.app.config['METADATA_STORAGE'] = storage
+        for i in range(3):
+            storage.record_change({'type': 'project', 'op': 'update'})
+
+        for limit in (0, -1):
+            url = '/repository/_changes?limit=%d' % limit
+            data = json.loads(self.client.get(url).data)
+            assert [o['seq'] for o in data['results']] == [1]
+        url = '/repository/_changes?since=-5&limit=2&feed=longpoll'
+        data = json.loads(self.client.get(url).data)
+        assert [o['seq'] for o in data['results']] == [1, 2]
+
+
+class TestTarballCase(BaseSuite):
+    def prehook(self):
+        directory = 'tests/data/repository/lepture/tarball/1.0.0'
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        with open(os.path.join(directory, 'tarball-1.0.0.tar.gz'), 'wb') as f:
+            f.write('0123456789' * 1000)
+        self.url = '/repository/lepture/tarball/1.0.0/tarball-1.0.0.tar.gz'
+
+    def test_get(self):
+        rv = self.client.get(self.url)
+        assert rv.status_code == 200
+        assert rv.data == '0123456789' * 1000
+        assert rv.headers['Accept-Ranges'] == 'bytes'
+        assert rv.content_encoding == 'gzip'
+
+        rv = self.client.head(self.url)
+        assert rv.status_code == 200
+        assert rv.content_length == 10000
+        assert rv.data == ''
+
+    def test_range(self):
+        rv = self.client.get(self.url, headers={'Range': 'bytes=5-14'})
+        assert rv.status_code == 206
+        assert rv.data == '5678901234'
+        assert rv.headers['Content-Range'] == 'bytes 5-14/10000'
+
+        etag = self.client.get(self.url).headers['ETag']
+        headers = {'Range': 'bytes=9990-', 'If-Range': etag}
+        rv = self.client.get(self.url, headers=headers)
+        assert rv.status_code == 206
+        assert rv.data == '0123456789'
+
+        headers['If-Range'] = '"changed"'
+        rv = self.client.get(self.url, headers=headers)
+        assert rv.status_code == 200
+        assert len(rv.data) == 10000
+
+        rv = self.client.get(self.url, headers={'Range': 'bytes=10000-'})
+        assert rv.status_code == 416
+
+    def test_sendfile(self):
+        self.app.config['SENDFILE'] = 'X-Accel-Redirect'
+        rv = self.client.get(self.url)
+        assert rv.headers['X-Accel-Redirect'] == (
+            '/_sendfile/repository/lepture/tarball/1.0.0/tarball-1.0.0.tar.gz'
+        )
+        assert rv.data == ''
+
+        # out of WWW_ROOT, the file is sent by the app
+        from yuan.helpers import send_file
+        with self.app.test_request_context():
+            resp = send_file(os.path.join('tests', '__init__.py'))
+            assert 'X-Accel-Redirect' not in resp.headers
+            assert resp.content_length == os.path.getsize(
+                os.path.join('tests', '__init__.py')
+            )
+            resp.close()
+
+
+class TestUploadSessionCase(BaseSuite):
+    def prehook(self):
+        self.create_account()
+
+    def put_chunk(self, url, number, offset, data, headers):
+        return self.client.put(
+            '%s/%d?offset=%d' % (url, number, offset),
+            headers=headers, data=data,
+        )
+
+    def test_upload(self):
+        import hashlib
+        headers = self.login_account()
+        headers['X-Yuan-Force'] = 'true'
+        self.client.post(
+            '/repository/lepture/resume/1.0.0/', headers=headers,
+            content_type='application/json',
+            data=json.dumps(dict())
+        )
+
+        rv = self.client.post(
+            '/repository/_uploads', headers=headers,
+            content_type='application/json',
+            data=json.dumps({
+                'family': 'lepture', 'name': 'resume', 'version': '1.0.0',
+                'size': 10, 'md5': hashlib.md5('0123456789').hexdigest(),
+            })
+        )
+        assert rv.status_code == 201
+        url = '/repository/_uploads/%s' % json.loads(rv.data)['id']
+
+        rv = self.put_chunk(url, 1, 5, '56789', headers)
+        assert json.loads(rv.data)['missing'] == [[0, 5]]
+        rv = self.client.post(url + '/commit', headers=headers)
+        assert rv.status_code == 400
+
+        chunk_headers = dict(headers)
+        chunk_headers['X-Chunk-MD5'] = hashlib.md5('other').hexdigest()
+        rv = self.put_chunk(url, 0, 0, '01234', chunk_headers)
+        assert rv.status_code == 400
+        rv = self.client.get(url, headers=headers)
+        assert json.loads(rv.data)['received'] == 5
+
+        rv = self.put_chunk(url, 0, 0, '01234', headers)
+        assert json.loads(rv.data)['received'] == 10
+        rv = self.client.post(url + '/commit', headers=headers)
+        assert rv.status_code == 200
+        data = json.loads(rv.data)
+        assert data['md5'] == hashlib.md5('0123456789').hexdigest()
+
+        rv = self.client.get(
+            '/repository/lepture/resume/1.0.0/%s' % data['filename']
+        )
+        assert rv.data == '0123456789'
+        assert self.client.get(url, headers=headers).status_code == 404
+
+    def test_write_after_commit(self):
+        import hashlib
+        from StringIO import StringIO
+        from yuan.models import UploadSession
+        headers = self.login_account()
+        self.client.post(
+            '/repository/lepture/race/1.0.0/', headers=headers,
+            content_type='application/json',
+            data=json.dumps(dict())
+        )
+        rv = self.client.post(
+            '/repository/_uploads', headers=headers,
+            content_type='application/json',
+            data=json.dumps({
+                'family': 'lepture', 'name': 'race', 'version': '1.0.0',
+                'size': 10, 'md5': hashlib.md5('0123456789').hexdigest(),
+            })
+        )
+        id = json.loads(rv.data)['id']
+        url = '/repository/_uploads/%s' % id
+        self.put_chunk(url, 0, 0, '0123456789', headers)
+        with self.app.test_request_context():
+            session = UploadSession.load(id)
+
+        rv = self.client.post(url + '/commit', headers=headers)
+        assert rv.status_code == 200
+        tarball = '/repository/lepture/race/1.0.0/%s' % (
+            json.loads(rv.data)['filename']
+        )
+
+        # a chunk loaded the session before it is committed
+        with self.app.test_request_context():
+            try:
+                session.write(1, 0, StringIO('abcde'), 5)
+                assert False, 'write is refused'
+            except ValueError:
+                pass
+        assert self.client.get(tarball).data == '0123456789'
+        rv = self.put_chunk(url, 1, 0, 'abcde', headers)
+        assert rv.status_code == 404
+
+    def test_collect(self):
+        from yuan.models import UploadSession, collect_uploads
+        headers = self.login_account()
+        rv = self.client.post(
+            '/repository/_uploads', headers=headers,
+            content_type='application/json',
+            data=json.dumps({
+                'family': 'lepture', 'name': 'docs', 'target': 'docs',
+                'size': 10,
+            })
+        )
+        assert rv.status_code == 201
+        id = json.loads(rv.data)['id']
+
+        with self.app.test_request_context():
+            assert collect_uploads() == 0
+            assert UploadSession.load(id)
+            assert collect_uploads(-1) >= 1
+            assert UploadSession.load(id) is None
@@ -0,0 +1,81 @@
+# coding: utf-8
+
+from flask import json
+from yuan.models import Package, package_signal, record_change, resolver
+
+from .suite import BaseSuite
+
+
+class TestResolveCase(BaseSuite):
+    def publish(self, name, version, dependencies, signal=True):
+        with self.app.test_request_context():
+            pkg = Package(family='resolve', name=name, version=version)
+            pkg['filename'] = '%s-%s.tar.gz' % (name, version)
+            pkg['md5'] = 'md5-%s' % name
+            pkg['dependencies'] = [
+                'resolve/%s' % o for o in dependencies
+            ]
+            pkg.save()
+            if signal:
+                package_signal.send(self.app, changes=(pkg, 'update'))
+            else:
+                # published by another worker
+                record_change('package', pkg, 'update')
+
+    def resolve(self, pkg):
+        rv = self.client.get('/repository/_resolve?pkg=resolve/%s' % pkg)
+        return rv.status_code, json.loads(rv.data)
+
+    def test_resolve(self):
+        self.publish('a', '1.0.0', ['b@1.0.0', 'c@1.0.0'])
+        self.publish('b', '1.0.0', ['c@1.0.0', 'missing@1.0.0'])
+        self.publish('c', '1.0.0', [])
+
+        status, data = self.resolve('a@1.0.0')
+        assert status == 200
+        assert sorted(data['packages']) == [
+            'resolve/a@1.0.0', 'resolve/b@1.0.0', 'resolve/c@1.0.0'
+        ]
+        assert data['missing'] == ['resolve/missing@1.0.0']
+        assert data['cycles'] == []
+        b = data['packages']['resolve/b@1.0.0']
+        assert b['md5'] == 'md5-b'
+        assert b['path'] == '/repository/resolve/b/1.0.0/b-1.0.0.tar.gz'
+
+        # the subtree of b is resolved already
+        assert ('resolve', 'b', '1.0.0') in resolver._closures
+        status, data = self.resolve('b@1.0.0')
+        assert len(data['packages']) == 2
+
+        assert self.resolve('a@9.0.0')[0] == 404
+        rv = self.client.get('/repository/_resolve?pkg=invalid')
+        assert rv.status_code == 400
+
+    def test_cycles(self):
+        self.publish('x', '1.0.0', ['y@1.0.0'])
+        self.publish('y', '1.0.0', ['z@1.0.0'])
+        self.publish('z', '1.0.0', ['y@1.0.0', 'z@1.0.0', 'w@1.0.0'])
+        self.publish('w', '1.0.0', ['w@1.0.0'])
+
+        status, data = self.resolve('x@1.0.0')
+        assert status == 200
+        assert len(data['packages']) == 4
+        assert data['cycles'] == [
+            ['resolve/w@1.0.0'], ['resolve/y@1.0.0', 'resolve/z@1.0.0'],
+        ]
+
+    def test_invalidate(self):
+        self.publish('p', '1.0.0', ['q@1.0.0'])
+        self.publish('q', '1.0.0', [])
+        assert len(self.resolve('p@1.0.0')[1]['packages']) == 2
+
+        self.publish('q', '1.0.0', ['r@1.0.0'])
+        data = self.resolve('p@1.0.0')[1]
+        assert data['missing'] == ['resolve/r@1.0.0']
+
+        # changes of other workers are read from the changes feed
+        self.publish('r', '1.0.0', [], signal=False)
+        resolver.synced_at = 0
+        data = self.resolve('p@1.0.0')[1]
+        assert data['missing'] == []
+        assert len(data['packages']) == 3
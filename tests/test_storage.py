@@ -0,0 +1,276 @@
+# coding: utf-8
+
+import os
+import random
+import shutil
+from yuan.models import create_storage, copy_storage
+
+ROOT = os.path.join('tests', 'data', 'storage')
+
+
+class StorageMixin(object):
+    def setUp(self):
+        if os.path.exists(ROOT):
+            shutil.rmtree(ROOT)
+        self.storage = self.create_storage()
+
+    def create_storage(self, backend=None):
+        return create_storage(backend or self.backend, ROOT)
+
+    def publish(self, storage, name, version, **kwargs):
+        pkg = dict(family='lepture', name=name, version=version, **kwargs)
+        storage.write(('lepture', name, version), pkg)
+        project = storage.read(('lepture', name)) or {
+            'family': 'lepture', 'name': name,
+            'created_at': '2013-01-01T00:00:00Z',
+        }
+        packages = project.get('packages') or {}
+        packages[version] = pkg
+        project['packages'] = packages
+        project['version'] = version
+        project['updated_at'] = '2013-01-0%sT00:00:00Z' % version[0]
+        storage.write(('lepture', name), project)
+        storage.index(project, 'update')
+
+    def test_documents(self):
+        storage = self.storage
+        self.publish(storage, 'arale', '1.0.0', tag='stable')
+        self.publish(storage, 'arale', '2.0.0', tag='stable')
+
+        project = storage.read(('lepture', 'arale'))
+        assert sorted(project['packages']) == ['1.0.0', '2.0.0']
+        assert storage.read(('lepture', 'arale', '1.0.0'))['tag'] == 'stable'
+        assert storage.latest('lepture', 'arale') == '2.0.0'
+        assert storage.read(('lepture', 'missing')) is None
+
+        storage.delete(('lepture', 'arale', '1.0.0'))
+        assert storage.read(('lepture', 'arale', '1.0.0')) is None
+
+    def test_listing(self):
+        storage = self.storage
+        self.publish(storage, 'arale', '1.0.0')
+        self.publish(storage, 'class', '2.0.0')
+
+        assert storage.families() == ['lepture']
+        assert sorted(storage.walk()) == [
+            ('lepture', 'arale'), ('lepture', 'class')
+        ]
+        names = [o['name'] for o in storage.projects('lepture')]
+        assert names == ['class', 'arale']
+        assert 'packages' not in storage.projects('lepture')[0]
+        assert storage.manifest()['lepture/class']['version'] == '2.0.0'
+        assert sorted(storage.names()) == ['lepture/arale', 'lepture/class']
+
+        storage.index({'family': 'lepture', 'name': 'class'}, 'delete')
+        assert storage.names() == ['lepture/arale']
+
+    def test_changes(self):
+        storage = self.storage
+        assert storage.last_seq() == 0
+        assert storage.changes() == []
+        for i in range(500):
+            seq = storage.record_change({
+                'type': 'package', 'op': 'update',
+                'family': 'lepture', 'name': 'arale', 'version': '1.0.%d' % i,
+            })
+            assert seq == i + 1
+        assert storage.last_seq() == 500
+
+        changes = storage.changes(since=357, limit=5)
+        assert [o['seq'] for o in changes] == [358, 359, 360, 361, 362]
+        assert changes[0]['version'] == '1.0.357'
+        assert len(storage.changes(limit=1000)) == 500
+        assert storage.changes(since=500) == []
+
+    def test_copy(self):
+        self.publish(self.storage, 'arale', '1.0.0', dependencies=[
+            'lepture/class@1.0.0'
+        ])
+        target = create_storage('memory', ROOT)
+        assert copy_storage(self.storage, target) == 1
+        assert target.read(('lepture', 'arale', '1.0.0'))['dependencies']
+        assert target.manifest() == self.storage.manifest()
+
+    def test_downloads(self):
+        storage = self.storage
+        self.publish(storage, 'arale', '1.0.0')
+        assert storage.downloads('lepture', 'arale')['total'] == 0
+
+        storage.add_downloads({
+            ('lepture', 'arale', '1.0.0', '2013-10-10'): 2,
+            ('lepture', 'arale', '1.0.0', '2013-10-11'): 1,
+        })
+        storage.add_downloads({
+            ('lepture', 'arale', '1.0.0', '2013-10-11'): 3,
+            ('lepture', 'arale', '2.0.0', '2013-10-11'): 1,
+        })
+        data = storage.downloads('lepture', 'arale')
+        assert data['total'] == 7
+        assert data['versions']['1.0.0'] == {
+            'total': 6, 'days': {'2013-10-10': 2, '2013-10-11': 4}
+        }
+
+        storage.delete(('lepture', 'arale'))
+        assert storage.downloads('lepture', 'arale')['total'] == 0
+
+
+class TestFileStorage(StorageMixin):
+    backend = 'file'
+
+    def test_dependents_log(self):
+        storage = self.storage
+        other = self.create_storage()
+        target = ('lepture', 'class', '1.0.0')
+        a = ('lepture', 'a', '1.0.0')
+        storage.set_dependencies(a, [target])
+        other.set_dependencies(('lepture', 'b', '1.0.0'), [target])
+        assert storage.count_dependents(*target) == 2
+
+        # nothing is changed, nothing is appended
+        size = os.path.getsize(storage.dependentsfile)
+        storage.set_dependencies(a, [target])
+        assert os.path.getsize(storage.dependentsfile) == size
+
+        for i in range(1100):
+            storage.set_dependencies(a, [target] if i % 2 else [])
+        with open(storage.dependentsfile) as f:
+            assert len(f.readlines()) < 100
+        assert other.dependents(*target) == [
+            'lepture/a@1.0.0', 'lepture/b@1.0.0'
+        ]
+        assert other.transitive_dependents('lepture', 'class') == 2
+
+    def test_compact(self):
+        storage = self.storage
+        storage.log_size = 4
+        for name, version in (('a', '1.0.0'), ('b', '2.0.0'), ('c', '3.0.0')):
+            self.publish(storage, name, version)
+        assert len(storage._read(storage.logfile('lepture'), [])) == 3
+        assert not storage._read(storage.datafile(('lepture',)), [])
+        assert len(storage.projects('lepture')) == 3
+
+        storage.index({'family': 'lepture', 'name': 'b'}, 'delete')
+        assert not storage._read(storage.logfile('lepture'), [])
+        names = [o['name'] for o in storage.projects('lepture')]
+        assert names == ['c', 'a']
+
+        self.publish(storage, 'a', '4.0.0')
+        names = [o['name'] for o in storage.projects('lepture')]
+        assert names == ['a', 'c']
+
+    def test_gzip(self):
+        import gzip
+        storage = create_storage('file', ROOT, gzip=True)
+        description = 'a long description of the project ' * 20
+        self.publish(storage, 'gzip', '1.0.0', description=description)
+        fpath = storage.datafile(('lepture', 'gzip', '1.0.0'))
+        with open(fpath) as f:
+            content = f.read()
+        with gzip.open(fpath + '.gz') as f:
+            assert f.read() == content
+
+        # compressing the small one does not pay off
+        storage.write(('lepture', 'gzip', '1.0.0'), {'name': 'gzip'})
+        assert not os.path.exists(fpath + '.gz')
+
+
+    def test_dependents(self):
+        storage = self.storage
+        target = ('lepture', 'class', '1.0.0')
+        for name in ('c', 'a', 'b'):
+            storage.set_dependencies(('lepture', name, '1.0.0'), [target])
+        assert storage.count_dependents(*target) == 3
+        assert storage.dependents(*target) == [
+            'lepture/a@1.0.0', 'lepture/b@1.0.0', 'lepture/c@1.0.0',
+        ]
+        assert storage.dependents(*target, offset=1, limit=1) == [
+            'lepture/b@1.0.0'
+        ]
+
+        storage.set_dependencies(('lepture', 'a', '1.0.0'), [])
+        assert storage.dependents(*target, limit=1) == ['lepture/b@1.0.0']
+
+        storage.rebuild_dependents({('lepture', 'd', '1.0.0'): [target]})
+        assert storage.dependents(*target) == ['lepture/d@1.0.0']
+
+    def test_transitive(self):
+        storage = self.storage
+
+        def key(name, version='1.0.0'):
+            return ('lepture', name, version)
+
+        def counts():
+            return storage.transitive_counts()
+
+        # a -> b -> c, d -> c, b@2 -> c
+        storage.set_dependencies(key('b'), [key('c')])
+        storage.set_dependencies(key('a'), [key('b')])
+        storage.set_dependencies(key('d'), [key('c'), key('b')])
+        storage.set_dependencies(key('b', '2.0.0'), [key('c', '2.0.0')])
+        assert counts() == {'lepture/b': 2, 'lepture/c': 4}
+        assert storage.transitive_dependents('lepture', 'c') == 4
+
+        # b has dependents, the changed projects are counted again
+        storage.set_dependencies(key('b'), [key('e')])
+        assert counts() == {
+            'lepture/b': 2, 'lepture/c': 2, 'lepture/e': 3,
+        }
+        storage.set_dependencies(key('d'), [])
+        storage.set_dependencies(key('a'), [key('a', '0.1.0')])
+        assert counts() == {'lepture/c': 1, 'lepture/e': 1}
+        assert storage.transitive_dependents('lepture', 'a') == 0
+
+        # a cycle
+        storage.set_dependencies(key('e'), [key('b')])
+        assert counts() == {'lepture/b': 1, 'lepture/c': 1, 'lepture/e': 1}
+
+        expected = counts()
+        storage.rebuild_dependents({
+            key('b'): [key('e')], key('e'): [key('b')],
+            key('a'): [key('a', '0.1.0')],
+            key('b', '2.0.0'): [key('c', '2.0.0')],
+        })
+        assert counts() == expected
+
+    def test_migrate_dependents(self):
+        self.publish(self.storage, 'arale', '1.0.0', dependencies=[
+            'lepture/class@1.0.0', 'invalid'
+        ])
+        target = create_storage('memory', ROOT)
+        copy_storage(self.storage, target)
+        dependents = target.dependents('lepture', 'class', '1.0.0')
+        assert dependents == ['lepture/arale@1.0.0']
+
+
+class TestMemoryStorage(StorageMixin):
+    backend = 'memory'
+
+    def test_transitive_random(self):
+        rnd = random.Random(7)
+        storage = self.storage
+        keys = [('lepture', 'p%d' % (i % 12), '%d' % i) for i in range(60)]
+        dependencies = {}
+        for i in range(300):
+            key = rnd.choice(keys)
+            deps = rnd.sample(keys, rnd.randint(0, 3))
+            storage.set_dependencies(key, deps)
+            dependencies[key] = deps
+
+        counts = storage.transitive_counts()
+        storage.rebuild_dependents(dependencies)
+        assert counts == storage.transitive_counts()
+
+
+class TestSQLiteStorage(StorageMixin):
+    backend = 'sqlite'
+
+    def test_migrate(self):
+        self.publish(self.storage, 'arale', '1.0.0')
+        target = self.create_storage('file')
+        copy_storage(self.storage, target)
+        assert target.projects('lepture')[0]['name'] == 'arale'
+
+        source = self.create_storage('file')
+        target = create_storage('sqlite', ROOT, ROOT + '/copy.sqlite')
+        copy_storage(source, target)
+        assert target.read(('lepture', 'arale'))['packages']
@@ -0,0 +1,143 @@
+# coding: utf-8
+
+import os
+import random
+import hashlib
+import tarfile
+from StringIO import StringIO
+from flask import json
+from yuan.models import TarballIndex
+from yuan.models import tarball as _tarball
+
+from .suite import BaseSuite
+
+
+def create_tarball(files, format=tarfile.DEFAULT_FORMAT):
+    buf = StringIO()
+    tar = tarfile.open(fileobj=buf, mode='w:gz', format=format)
+    for name, content in files:
+        info = tarfile.TarInfo(name)
+        if content is None:
+            info.type = tarfile.DIRTYPE
+            tar.addfile(info)
+            continue
+        info.size = len(content)
+        info.mode = 0755 if name.endswith('.sh') else 0644
+        tar.addfile(info, StringIO(content))
+    tar.close()
+    return buf.getvalue()
+
+
+def random_content(size, seed=0):
+    r = random.Random(seed)
+    return ''.join(chr(r.randint(0, 255)) for i in range(size))
+
+
+FILES = [
+    ('package', None),
+    ('package/package.json', '{}'),
+    ('package/empty.txt', ''),
+    ('package/bin/run.sh', '#!/bin/sh'),
+    ('package/%s.js' % ('long' * 40), 'long name'),
+    ('package/dist/a.bin', random_content(100000, 1)),
+    ('package/dist/b.bin', random_content(50000, 2)),
+]
+
+
+class TestTarballIndex(object):
+    def index(self, data, chunk):
+        index = TarballIndex(interval=20000)
+        for i in range(0, len(data), chunk):
+            index.update(data[i:i + chunk])
+        return index.result()
+
+    def check(self, data, index):
+        tar = tarfile.open(fileobj=StringIO(data), mode='r:gz')
+        members = [o for o in tar.getmembers() if o.isfile()]
+        assert len(index['files']) == len(members)
+        for entry, info in zip(index['files'], members):
+            content = tar.extractfile(info).read()
+            assert entry['path'] == info.name
+            assert entry['size'] == info.size
+            assert entry['mode'] == info.mode
+            assert entry['offset'] == info.offset_data
+            assert entry['sha256'] == hashlib.sha256(content).hexdigest()
+        assert index['md5'] == hashlib.md5(data).hexdigest()
+
+    def test_index(self):
+        for format in (tarfile.GNU_FORMAT, tarfile.PAX_FORMAT):
+            data = create_tarball(FILES, format)
+            for chunk in (100, 997, 64 * 1024):
+                index = self.index(data, chunk)
+                self.check(data, index)
+                assert len(index['checkpoints']) > 3
+
+    def test_invalid(self):
+        data = create_tarball(FILES)
+        assert self.index('not a tarball', 10) is None
+        assert self.index(data[:len(data) / 2], 100) is None
+        corrupt = data[:100] + 'corrupt' + data[107:]
+        assert self.index(corrupt, 100) is None
+
+
+class TestFilesCase(BaseSuite):
+    def prehook(self):
+        self.create_account()
+        self.app.config['TARBALL_CHECKPOINT_INTERVAL'] = 20000
+        self.url = '/repository/lepture/files/1.0.0/'
+        self.data = create_tarball(FILES)
+
+        headers = self.login_account()
+        headers['X-Yuan-Force'] = 'true'
+        self.client.post(
+            self.url, headers=headers, content_type='application/json',
+            data=json.dumps(dict())
+        )
+        headers['Content-Encoding'] = 'gzip'
+        rv = self.client.put(
+            self.url, headers=headers, content_type='application/x-tar',
+            data=self.data
+        )
+        assert rv.status_code == 200
+
+    def test_files(self):
+        rv = self.client.get(self.url + '-/files')
+        files = json.loads(rv.data)['files']
+        assert [o['path'] for o in files] == [
+            o[0] for o in FILES if o[1] is not None
+        ]
+
+        rv = self.client.get('/repository/lepture/files/2.0.0/-/files')
+        assert rv.status_code == 404
+
+    def test_file(self):
+        _tarball._snapshot_cache.clear()
+        for name, content in reversed(FILES):
+            if content is None:
+                continue
+            rv = self.client.get(self.url + '-/files/' + name)
+            assert rv.status_code == 200
+            assert rv.data == content
+            assert rv.content_length == len(content)
+            etag = rv.headers['ETag']
+
+        # checkpoints passed by the first read are kept
+        snapshots = list(_tarball._snapshot_cache.values())[0]
+        assert snapshots
+
+        rv = self.client.get(
+            self.url + '-/files/package/package.json',
+            headers={'If-None-Match': etag}
+        )
+        assert rv.status_code == 304
+
+        rv = self.client.get(self.url + '-/files/package/missing.js')
+        assert rv.status_code == 404
+
+    def test_rebuild(self):
+        # the index is built again when it is missing
+        fpath = 'tests/data/repository/lepture/files/1.0.0/files.json'
+        os.remove(fpath)
+        rv = self.client.get(self.url + '-/files/package/bin/run.sh')
+        assert rv.data == '#!/bin/sh'
+        assert os.path.exists(fpath)
@@ -0,0 +1,42 @@
+# coding: utf-8
+
+from yuan.models import parse_version, is_prerelease
+from yuan.models import sort_versions, insert_version
+
+
+def test_parse_version():
+    assert parse_version('1.0') == parse_version('1.0.0')
+    assert parse_version('1.0.0-rc.1+build.5') == parse_version('1.0.0-rc.1')
+    for version in ('1', '1.0.0.0', 'a.b.c', '1.0.0-', '1.0a'):
+        try:
+            parse_version(version)
+        except ValueError:
+            continue
+        assert False, version
+
+
+def test_prerelease():
+    assert is_prerelease('1.0.0a1')
+    assert is_prerelease('1.0.0-beta.2')
+    assert not is_prerelease('1.0.0')
+
+
+def test_sort_versions():
+    versions = [
+        '1.0.0', '1.0.0-alpha', '1.0.0-alpha.1', '1.0.0-alpha.beta',
+        '1.0.0-beta', '1.0.0-beta.2', '1.0.0-beta.11', '1.0.0-rc.1',
+        '0.9.9', '1.10.0', '1.2.0',
+    ]
+    assert sort_versions(versions) == [
+        '1.10.0', '1.2.0', '1.0.0', '1.0.0-rc.1', '1.0.0-beta.11',
+        '1.0.0-beta.2', '1.0.0-beta', '1.0.0-alpha.beta', '1.0.0-alpha.1',
+        '1.0.0-alpha', '0.9.9',
+    ]
+
+
+def test_insert_version():
+    versions = []
+    for version in ('1.0.0', '0.1.0', '2.0.0-rc.1', '1.2.0', '2.0.0'):
+        insert_version(versions, version)
+    assert versions == ['2.0.0', '2.0.0-rc.1', '1.2.0', '1.0.0', '0.1.0']
+    assert insert_version(versions, '1.0.0') == versions
@@ -13,6 +13,7 @@ from pygments.formatters import HtmlFormatter
 
 from flask import Flask
 from flask import request, g, escape
+from flask.json import JSONEncoder
 from flask.ext.babel import Babel
 from flask.ext.principal import Principal, Identity, identity_loaded, UserNeed
 from flask import Markup
@@ -27,9 +28,17 @@ class HighlightRender(m.HtmlRenderer, m.SmartyPants):
         return highlight(text, lexer, formatter)
 
 
+class RecordEncoder(JSONEncoder):
+    def default(self, o):
+        from .models import Record
+        if isinstance(o, Record):
+            return o.to_dict()
+        return JSONEncoder.default(self, o)
+
+
 def create_app(config=None):
-    from .models import db
-    from .views import front, account, repository, admin
+    from .models import db, metacache, combocache
+    from .views import front, account, repository, admin, assets
     from .helpers import get_current_user
     from .elastic import elastic
     from .tasks import connect
@@ -39,6 +48,7 @@ def create_app(config=None):
         static_folder='_static',
         template_folder='templates',
     )
+    app.json_encoder = RecordEncoder
     app.config.from_pyfile(os.path.join(ROOTDIR, 'conf', 'base_config.py'))
     if 'YUAN_SETTINGS' in os.environ:
         app.config.from_envvar('YUAN_SETTINGS')
@@ -54,11 +64,14 @@ def create_app(config=None):
     db.app = app
 
     elastic.init_app(app)
+    metacache.init_app(app)
+    combocache.init_app(app)
     admin.admin.init_app(app)
 
     # register blueprints
     app.register_blueprint(account.bp, url_prefix='/account')
     app.register_blueprint(repository.bp, url_prefix='/repository')
+    app.register_blueprint(assets.bp, url_prefix='')
     app.register_blueprint(front.bp, url_prefix='')
 
     @app.template_filter('markdown')
@@ -2,87 +2,214 @@
 
 import json
 import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
 from flask import _app_ctx_stack
 
-__all__ = ['ElasticSearch', 'elastic', 'search_project', 'index_project']
+__all__ = [
+    'ElasticSearch', 'Bulk', 'elastic', 'search_project', 'index_project',
+]
+
+#: requests share a pool of connections, a request waits ``TIMEOUT``
+#: seconds for a response, and is retried when elasticsearch is busy
+DEFAULTS = {
+    'ELASTICSEARCH_CONNECTIONS': 10,
+    'ELASTICSEARCH_CONNECT_TIMEOUT': 3,
+    'ELASTICSEARCH_TIMEOUT': 10,
+    'ELASTICSEARCH_RETRIES': 2,
+    'ELASTICSEARCH_BACKOFF': 0.2,
+    # a _bulk request is sent with so many actions or bytes of them
+    'ELASTICSEARCH_BULK_SIZE': 500,
+    'ELASTICSEARCH_BULK_BYTES': 5 * 1024 * 1024,
+}
 
 
 class ElasticSearch(object):
     def __init__(self, app=None):
+        self.app = None
+        self._sessions = {}
         if app is not None:
             self.init_app(app)
 
     def init_app(self, app):
         app.config.setdefault('ELASTICSEARCH_HOST', 'http://localhost:9200')
         app.config.setdefault('ELASTICSEARCH_INDEX', app.name)
+        for key in DEFAULTS:
+            app.config.setdefault(key, DEFAULTS[key])
 
         self.app = app
         app.extensions = getattr(app, 'extensions', {})
         app.extensions['elasticsearch'] = self
 
     def get_app(self):
-        if self.app is not None:
-            return self.app
+        # tasks and mirror workers run in apps of their own config
         ctx = _app_ctx_stack.top
         if ctx is not None:
             return ctx.app
+        if self.app is not None:
+            return self.app
         raise RuntimeError(
             'application not registered on ElasticSearch '
             'instance and no application bound to current context'
         )
 
+    def option(self, key):
+        return self.get_app().config.get(key, DEFAULTS.get(key))
+
+    @property
+    def session(self):
+        """A session of pooled connections, shared by the requests to the
+        same host.
+        """
+        key = tuple(self.option(k) for k in (
+            'ELASTICSEARCH_HOST', 'ELASTICSEARCH_CONNECTIONS',
+            'ELASTICSEARCH_RETRIES', 'ELASTICSEARCH_BACKOFF',
+        ))
+        if key not in self._sessions:
+            self._sessions[key] = _create_session(*key[1:])
+        return self._sessions[key]
+
     def request_base(self):
         app = self.get_app()
         host = app.config.get('ELASTICSEARCH_HOST')
         index = app.config.get('ELASTICSEARCH_INDEX')
         return '%s/%s' % (host, index)
 
-    def get(self, path):
+    def request(self, method, path, body=None, codes=(200, 201)):
         url = '%s/%s' % (self.request_base(), path)
-        req = requests.get(url)
-        if req.status_code == 200 or req.status_code == 201:
+        timeout = (
+            self.option('ELASTICSEARCH_CONNECT_TIMEOUT'),
+            self.option('ELASTICSEARCH_TIMEOUT'),
+        )
+        req = self.session.request(method, url, data=body, timeout=timeout)
+        if req.status_code in codes:
             return json.loads(req.text)
         raise ValueError('response error %d:%s' % (req.status_code, req.text))
 
+    def get(self, path):
+        return self.request('GET', path)
+
     def post(self, path, data=None):
-        url = '%s/%s' % (self.request_base(), path)
-        req = requests.post(url, data=json.dumps(data))
-        if req.status_code == 200 or req.status_code == 201:
-            return json.loads(req.text)
-        raise ValueError('response error %d:%s' % (req.status_code, req.text))
+        return self.request('POST', path, json.dumps(data))
 
     def put(self, path, data=None):
-        url = '%s/%s' % (self.request_base(), path)
-        req = requests.put(url, data=json.dumps(data))
-        if req.status_code == 200 or req.status_code == 201:
-            return json.loads(req.text)
-        raise ValueError('response error %d:%s' % (req.status_code, req.text))
+        return self.request('PUT', path, json.dumps(data))
 
     def delete(self, path):
-        url = '%s/%s' % (self.request_base(), path)
-        req = requests.delete(url)
-        if req.status_code == 200:
-            return json.loads(req.text)
-        raise ValueError('response error %d:%s' % (req.status_code, req.text))
+        return self.request('DELETE', path, codes=(200,))
+
+    def bulk(self, size=None, bytes=None):
+        return Bulk(self, size, bytes)
+
+
+class Bulk(object):
+    """Actions of the ``_bulk`` API, sent in a request once there are
+    ``size`` of them, or ``bytes`` of them. The rest is sent at the end
+    of a with statement::
+
+        with elastic.bulk() as bulk:
+            for project in projects:
+                index_project(project, 'update', bulk)
+
+    Failed actions are kept in ``failures`` as ``(action, id, error)``.
+    """
+
+    def __init__(self, elastic, size=None, bytes=None):
+        self.elastic = elastic
+        self.size = size
+        self.bytes = bytes
+        self.actions = []
+        self.length = 0
+        #: count of the actions sent
+        self.count = 0
+        self.failures = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            self.flush()
+
+    def index(self, doc_type, id, doc):
+        self.add({'index': {'_type': doc_type, '_id': id}}, doc)
+
+    def delete(self, doc_type, id):
+        self.add({'delete': {'_type': doc_type, '_id': id}})
+
+    def add(self, action, doc=None):
+        lines = json.dumps(action) + '\n'
+        if doc is not None:
+            lines += json.dumps(doc) + '\n'
+
+        limit = self.bytes or self.elastic.option('ELASTICSEARCH_BULK_BYTES')
+        if self.actions and self.length + len(lines) > limit:
+            self.flush()
+        self.actions.append(lines)
+        self.length += len(lines)
+        size = self.size or self.elastic.option('ELASTICSEARCH_BULK_SIZE')
+        if len(self.actions) >= size:
+            self.flush()
+
+    def flush(self):
+        """Send the pending actions in a ``_bulk`` request."""
+        if not self.actions:
+            return
+        # actions added by other greenlets meanwhile are sent next time
+        actions = self.actions
+        self.actions = []
+        self.length = 0
+        rv = self.elastic.request('POST', '_bulk', ''.join(actions))
+        self.count += len(actions)
+        for item in rv.get('items', []):
+            action, result = item.items()[0]
+            if 'error' in result:
+                self.failures.append(
+                    (action, result.get('_id'), result['error'])
+                )
+        return rv
 
 
 elastic = ElasticSearch()
 
 
-def index_project(project, operation):
+def _create_session(connections, retries, backoff):
+    session = requests.Session()
+    # documents are indexed by id, every request is safe to retry
+    retry = Retry(
+        total=retries, backoff_factor=backoff,
+        status_forcelist=(429, 502, 503, 504),
+        allowed_methods=False, raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=1, pool_maxsize=connections,
+        max_retries=retry, pool_block=True,
+    )
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def index_project(project, operation, bulk=None):
+    """Index a project in the search engine, or add it to a ``bulk``."""
+    id = '%s.%s' % (project['family'], project['name'])
     if operation == 'delete':
-        elastic.delete('project/%s.%s' % (project.family, project.name))
+        if bulk is None:
+            elastic.delete('project/%s' % id)
+        else:
+            bulk.delete('project', id)
         return
 
-    if 'packages' not in project:
+    packages = project.get('packages')
+    if not packages or project.get('version') not in packages:
         return
 
-    package = project.packages[project.version]
+    package = packages[project['version']]
     dct = dict(
-        family=project.family,
-        name=project.name,
-        created_at=project.created_at,
-        updated_at=project.updated_at,
+        family=project['family'],
+        name=project['name'],
+        created_at=project.get('created_at'),
+        updated_at=project.get('updated_at'),
     )
     if 'keywords' in package and isinstance(package['keywords'], list):
         dct['keywords'] = package['keywords']
@@ -90,7 +217,10 @@ def index_project(project, operation):
     if 'description' in package:
         dct['description'] = package['description']
 
-    elastic.post('project/%s.%s' % (project.family, project.name), dct)
+    if bulk is None:
+        elastic.post('project/%s' % id, dct)
+    else:
+        bulk.index('project', id, dct)
 
 
 def search_project(query):
@@ -1,9 +1,12 @@
+import os
 import functools
 import time
+import calendar
 import hashlib
 import base64
 from flask import g, request, session, current_app
-from flask import flash, url_for, redirect, abort
+from flask import flash, url_for, redirect, abort, Response
+from werkzeug.wsgi import wrap_file
 from flask.ext.babel import lazy_gettext as _
 from .models import Account
 
@@ -108,3 +111,85 @@ def verify_auth_token(token, expires=30):
     if hsh == _hsh.hexdigest():
         return user
     return None
+
+
+def send_file(fpath, mimetype=None, encoding=None):
+    """Send a file without reading it into memory. It supports HEAD, a
+    single Range and If-Range. With ``SENDFILE`` of ``X-Accel-Redirect``
+    or ``X-Sendfile``, the proxy sends the file, ``X-Accel-Redirect`` is
+    only used for the files in ``WWW_ROOT``.
+    """
+    resp = Response(mimetype=mimetype, direct_passthrough=True)
+    if encoding:
+        resp.content_encoding = encoding
+
+    mode = current_app.config.get('SENDFILE')
+    if mode == 'X-Accel-Redirect':
+        root = os.path.abspath(current_app.config['WWW_ROOT'])
+        path = os.path.relpath(os.path.abspath(fpath), root)
+        # the internal location is aliased to WWW_ROOT, files out of it
+        # (assets roots may be elsewhere) are sent by the app
+        if path != os.pardir and not path.startswith(os.pardir + os.sep):
+            prefix = current_app.config.get('SENDFILE_PREFIX', '/_sendfile/')
+            resp.headers['X-Accel-Redirect'] = prefix + path
+            return resp
+    if mode == 'X-Sendfile':
+        resp.headers['X-Sendfile'] = os.path.abspath(fpath)
+        return resp
+
+    stat = os.stat(fpath)
+    size = stat.st_size
+    etag = '%d-%d' % (stat.st_mtime, size)
+    resp.set_etag(etag)
+    resp.last_modified = int(stat.st_mtime)
+    resp.accept_ranges = 'bytes'
+    resp.make_conditional(request)
+    if resp.status_code == 304:
+        return resp
+
+    start, stop = 0, size
+    if request.range and _if_range(etag, int(stat.st_mtime)):
+        rng = request.range.range_for_length(size)
+        if rng is None:
+            resp.status_code = 416
+            resp.headers['Content-Range'] = 'bytes */%d' % size
+            return resp
+        start, stop = rng
+        resp.status_code = 206
+        resp.headers['Content-Range'] = 'bytes %d-%d/%d' % (
+            start, stop - 1, size
+        )
+
+    resp.content_length = stop - start
+    if request.method == 'HEAD':
+        return resp
+
+    f = open(fpath, 'rb')
+    if stop - start == size:
+        # the server may send it with sendfile by wsgi.file_wrapper
+        resp.response = wrap_file(request.environ, f, 64 * 1024)
+    else:
+        f.seek(start)
+        resp.response = _read_range(f, stop - start)
+    return resp
+
+
+def _if_range(etag, mtime):
+    if_range = request.if_range
+    if if_range.etag:
+        return if_range.etag == etag
+    if if_range.date:
+        return calendar.timegm(if_range.date.utctimetuple()) == mtime
+    return True
+
+
+def _read_range(f, length):
+    try:
+        while length > 0:
+            chunk = f.read(min(length, 64 * 1024))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
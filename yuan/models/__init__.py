@@ -4,3 +4,12 @@
 from ._base import *
 from .account import *
 from .project import *
+from .cache import *
+from .storage import *
+from .version import *
+from .record import *
+from .upload import *
+from .tarball import *
+from .blob import *
+from .resolve import *
+from .ranking import *
@@ -0,0 +1,168 @@
+# coding: utf-8
+
+import os
+import errno
+import shutil
+import hashlib
+from flask import current_app
+
+__all__ = [
+    'store_blob', 'release_blob', 'store_tree', 'remove_tree',
+    'collect_blobs', 'blob_report',
+]
+
+CHUNK_SIZE = 64 * 1024
+
+
+def store_blob(fpath, sha256=None):
+    """Store the file of ``fpath`` in the blob store by its sha256.
+
+    The blob and the file are hard links of the same inode, the link
+    count of a blob is its reference count. If the blob exists, the file
+    is replaced by a link of it. Return the sha256, or None when the file
+    can not be linked, it is kept as a copy then.
+    """
+    if not current_app.config.get('BLOB_STORE', True):
+        return None
+    if sha256 is None:
+        sha256 = _sha256(fpath)
+    blob = _blob_path(sha256)
+    directory = os.path.dirname(blob)
+    try:
+        os.makedirs(directory)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+    try:
+        # the first copy becomes the blob
+        os.link(fpath, blob)
+        return sha256
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            # on another device, or too many links
+            return None
+
+    if os.path.samefile(fpath, blob):
+        return sha256
+
+    # replace the file with a link of the blob
+    tmp = os.path.join(
+        os.path.dirname(fpath),
+        '.%s.%s' % (os.path.basename(fpath), sha256[:8])
+    )
+    try:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        os.link(blob, tmp)
+    except OSError:
+        # the blob may be collected meanwhile
+        return None
+    os.rename(tmp, fpath)
+    return sha256
+
+
+def release_blob(sha256):
+    """Remove the blob of ``sha256`` if no file links to it anymore, as
+    after the file of it is replaced.
+    """
+    if sha256:
+        _release(_blob_path(sha256))
+
+
+def store_tree(directory):
+    """Store every file in ``directory``, return the count of them."""
+    count = 0
+    for root, dirs, files in os.walk(directory):
+        # the blob store, upload sessions and staging directories
+        dirs[:] = [o for o in dirs if not o.startswith('.')]
+        for name in files:
+            if name.startswith('.'):
+                continue
+            if store_blob(os.path.join(root, name)):
+                count += 1
+    return count
+
+
+def remove_tree(directory):
+    """Remove ``directory``, and release the blobs of its files. A blob
+    no other file links to is removed.
+    """
+    if not os.path.exists(directory):
+        return None
+
+    blobs = []
+    for root, dirs, files in os.walk(directory):
+        for name in files:
+            fpath = os.path.join(root, name)
+            if os.stat(fpath).st_nlink > 1:
+                blobs.append(_blob_path(_sha256(fpath)))
+
+    shutil.rmtree(directory)
+    for blob in blobs:
+        _release(blob)
+    return directory
+
+
+def collect_blobs():
+    """Remove the blobs that are not linked by any file."""
+    count = 0
+    for blob, st in _blobs():
+        if st.st_nlink == 1:
+            _release(blob)
+            count += 1
+    return count
+
+
+def blob_report():
+    """Count the blobs, the bytes stored and the bytes saved by linking."""
+    rv = {'blobs': 0, 'links': 0, 'unused': 0, 'stored': 0, 'saved': 0}
+    for blob, st in _blobs():
+        links = st.st_nlink - 1
+        rv['blobs'] += 1
+        rv['links'] += links
+        if not links:
+            rv['unused'] += 1
+        rv['stored'] += st.st_size
+        rv['saved'] += st.st_size * max(links - 1, 0)
+    return rv
+
+
+def _root():
+    return os.path.abspath(
+        os.path.join(current_app.config['WWW_ROOT'], '.blobs')
+    )
+
+
+def _blob_path(sha256):
+    return os.path.join(_root(), sha256[:2], sha256[2:])
+
+
+def _blobs():
+    root = _root()
+    if not os.path.exists(root):
+        return
+    for prefix in os.listdir(root):
+        directory = os.path.join(root, prefix)
+        for name in os.listdir(directory):
+            blob = os.path.join(directory, name)
+            try:
+                yield blob, os.stat(blob)
+            except OSError:
+                continue
+
+
+def _release(blob):
+    try:
+        if os.stat(blob).st_nlink == 1:
+            os.remove(blob)
+    except OSError:
+        pass
+
+
+def _sha256(fpath):
+    m = hashlib.sha256()
+    with open(fpath, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            m.update(chunk)
+    return m.hexdigest()
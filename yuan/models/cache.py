@@ -0,0 +1,248 @@
+# coding: utf-8
+
+import os
+import time
+import threading
+from collections import OrderedDict
+from flask import current_app
+from .fileio import file_lock, atomic_file
+
+__all__ = [
+    'MetadataCache', 'metacache', 'AssetsCache', 'assetcache',
+    'ComboCache', 'combocache',
+]
+
+
+class MetadataCache(object):
+    """In-process LRU cache for parsed metadata files.
+
+    Every entry remembers the ``(mtime, size, inode)`` of the file it was
+    parsed from, a changed file on disk is parsed again on the next read.
+    Readers always get a copy of the cached data, so that they can modify
+    it freely.
+    """
+
+    def __init__(self, capacity=1024):
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        app.config.setdefault('METADATA_CACHE_SIZE', 1024)
+        self.capacity = app.config['METADATA_CACHE_SIZE']
+
+    def get(self, fpath, loader):
+        """Get the parsed data of ``fpath``, ``loader`` is called with
+        the path to parse the file when it is not cached. Return None
+        if the file does not exist.
+        """
+        try:
+            st = os.stat(fpath)
+        except OSError:
+            self.invalidate(fpath)
+            return None
+
+        signature = (st.st_mtime, st.st_size, st.st_ino)
+        with self._lock:
+            item = self._data.pop(fpath, None)
+            if item and item[0] == signature:
+                # move it to the end, it is the most recently used one
+                self._data[fpath] = item
+                self.hits += 1
+                return _copy(item[1])
+            self.misses += 1
+
+        data = loader(fpath)
+        if not self.capacity:
+            return data
+
+        with self._lock:
+            self._data[fpath] = (signature, data)
+            while len(self._data) > self.capacity:
+                self._data.popitem(last=False)
+        return _copy(data)
+
+    def invalidate(self, fpath):
+        with self._lock:
+            self._data.pop(fpath, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._data),
+            'capacity': self.capacity,
+        }
+
+
+metacache = MetadataCache()
+
+
+class _Missing(Exception):
+    pass
+
+
+class AssetsCache(object):
+    """Files extracted on demand, kept in ``ASSETS_CACHE_ROOT``.
+
+    The cache is bounded by ``ASSETS_CACHE_SIZE`` bytes, the least
+    recently accessed files are evicted first. Access time is set by
+    the cache, as the file system may be mounted with noatime.
+    """
+
+    #: access time is updated at most once in so many seconds
+    touch_interval = 60
+
+    def __init__(self):
+        # estimated size of the cache, it is counted when it is evicted
+        self.size = None
+        self._lock = threading.Lock()
+
+    @property
+    def root(self):
+        root = current_app.config.get('ASSETS_CACHE_ROOT')
+        if not root:
+            root = os.path.join(current_app.config['WWW_ROOT'], 'cache')
+        return root
+
+    @property
+    def quota(self):
+        return current_app.config.get('ASSETS_CACHE_SIZE', 1024 ** 3)
+
+    def get(self, path, loader):
+        """Get the file of ``path`` in the cache. ``loader`` is called with
+        a file object to write the file when it is not cached, it returns
+        False when there is no such file. Return None in that case.
+        """
+        fpath = os.path.join(self.root, path)
+        try:
+            st = os.stat(fpath)
+        except OSError:
+            st = None
+        if st:
+            now = time.time()
+            if now - st.st_atime > self.touch_interval:
+                os.utime(fpath, (now, st.st_mtime))
+            return fpath
+
+        try:
+            with atomic_file(fpath) as f:
+                if loader(f) is False:
+                    raise _Missing()
+                size = f.tell()
+        except _Missing:
+            return None
+
+        with self._lock:
+            if self.size is not None:
+                self.size += size
+        if self.size is None or self.size > self.quota:
+            self.evict()
+        return fpath
+
+    def evict(self):
+        """Count the cache, remove the least recently accessed files until
+        it is in 90% of the quota.
+        """
+        root = self.root
+        if not os.path.exists(root):
+            os.makedirs(root)
+        with file_lock(os.path.join(root, '.lock')):
+            files = []
+            total = 0
+            for dirpath, dirnames, filenames in os.walk(root):
+                for name in filenames:
+                    if name.startswith('.'):
+                        continue
+                    fpath = os.path.join(dirpath, name)
+                    try:
+                        st = os.stat(fpath)
+                    except OSError:
+                        continue
+                    files.append((st.st_atime, st.st_size, fpath))
+                    total += st.st_size
+
+            if total > self.quota:
+                files.sort()
+                for atime, size, fpath in files:
+                    if total <= self.quota * 0.9:
+                        break
+                    try:
+                        os.remove(fpath)
+                    except OSError:
+                        continue
+                    total -= size
+        with self._lock:
+            self.size = total
+        return total
+
+
+assetcache = AssetsCache()
+
+
+def _copy(value):
+    # the cached data is parsed from json, only dict and list are mutable
+    if isinstance(value, dict):
+        return dict((k, _copy(value[k])) for k in value)
+    if isinstance(value, list):
+        return [_copy(v) for v in value]
+    return value
+
+
+class ComboCache(object):
+    """In-process LRU cache for concatenated files, bounded by the bytes
+    of the cached data. Every entry remembers the signature of the files
+    it was built from.
+    """
+
+    def __init__(self, capacity=16 * 1024 * 1024):
+        self.capacity = capacity
+        self.size = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        app.config.setdefault('COMBO_CACHE_SIZE', 16 * 1024 * 1024)
+        self.capacity = app.config['COMBO_CACHE_SIZE']
+
+    def get(self, key, signature):
+        with self._lock:
+            item = self._data.pop(key, None)
+            if item is None:
+                return None
+            if item[0] != signature:
+                self.size -= len(item[1])
+                return None
+            self._data[key] = item
+            return item[1]
+
+    def set(self, key, signature, data):
+        # a combination larger than a quarter of the cache is not cached
+        if len(data) > self.capacity / 4:
+            return False
+        with self._lock:
+            item = self._data.pop(key, None)
+            if item:
+                self.size -= len(item[1])
+            self._data[key] = (signature, data)
+            self.size += len(data)
+            while self.size > self.capacity:
+                _, item = self._data.popitem(last=False)
+                self.size -= len(item[1])
+        return True
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+
+
+combocache = ComboCache()
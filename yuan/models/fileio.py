@@ -0,0 +1,168 @@
+# coding: utf-8
+
+import os
+import time
+import gzip
+import errno
+import fcntl
+import tempfile
+import threading
+from StringIO import StringIO
+from contextlib import contextmanager
+
+__all__ = [
+    'LockTimeout', 'file_lock', 'atomic_file', 'atomic_write',
+    'remove_file', 'gzip_file',
+]
+
+# a .gz sibling is kept only when it is smaller than so much of the file
+GZIP_RATIO = 0.9
+
+_umask = os.umask(0)
+os.umask(_umask)
+
+_local = threading.local()
+
+
+class LockTimeout(Exception):
+    pass
+
+
+@contextmanager
+def file_lock(fpath, timeout=30):
+    """Hold an exclusive lock on ``fpath`` across processes.
+
+    The lock is reentrant in the same thread (or greenlet when gevent
+    patched threading). It polls instead of blocking on ``flock``, so
+    that a waiting greenlet will not block the whole worker.
+    """
+    held = getattr(_local, 'locks', None)
+    if held is None:
+        held = _local.locks = {}
+
+    if fpath in held:
+        held[fpath] += 1
+        try:
+            yield
+        finally:
+            held[fpath] -= 1
+        return
+
+    directory = os.path.dirname(fpath)
+    if not os.path.exists(directory):
+        try:
+            os.makedirs(directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    fd = os.open(fpath, os.O_RDWR | os.O_CREAT, 0o644)
+    deadline = time.time() + timeout
+    delay = 0.001
+    while True:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            break
+        except IOError as e:
+            if e.errno not in (errno.EAGAIN, errno.EACCES):
+                os.close(fd)
+                raise
+        if time.time() > deadline:
+            os.close(fd)
+            raise LockTimeout('timeout on waiting %s' % fpath)
+        time.sleep(delay)
+        delay = min(delay * 2, 0.05)
+
+    held[fpath] = 1
+    try:
+        yield
+    finally:
+        del held[fpath]
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+
+@contextmanager
+def atomic_file(fpath):
+    """Write ``fpath`` through a temp file in the same directory. It is
+    fsynced and renamed to ``fpath`` when the block exits, and removed
+    when the block raises.
+
+    Readers will see either the old file or the new one, never a
+    truncated file.
+    """
+    directory = os.path.dirname(fpath)
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+
+    prefix = '.%s.' % os.path.basename(fpath)
+    fd, tmp = tempfile.mkstemp(prefix=prefix, dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        # mkstemp creates the file with 0600
+        os.chmod(tmp, 0o666 & ~_umask)
+        os.rename(tmp, fpath)
+    except:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+    dirfd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(dirfd)
+    finally:
+        os.close(dirfd)
+
+
+def atomic_write(fpath, content):
+    """Write ``content`` into ``fpath`` with :func:`atomic_file`."""
+    with atomic_file(fpath) as f:
+        f.write(content)
+    return fpath
+
+
+def remove_file(fpath):
+    try:
+        os.remove(fpath)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+
+
+def gzip_file(fpath):
+    """Write ``fpath.gz`` at the maximum compression, for ``gzip_static``
+    of nginx. It is not kept when compressing does not pay off, or the
+    file is replaced meanwhile. Return True if it is written.
+    """
+    try:
+        f = open(fpath, 'rb')
+    except IOError:
+        return False
+    with f:
+        inode = os.fstat(f.fileno()).st_ino
+        content = f.read()
+
+    buf = StringIO()
+    # no name and time in the header, the same file is compressed the same
+    f = gzip.GzipFile('', 'wb', 9, buf, mtime=0)
+    f.write(content)
+    f.close()
+    data = buf.getvalue()
+
+    gzpath = fpath + '.gz'
+    if len(data) > len(content) * GZIP_RATIO:
+        remove_file(gzpath)
+        return False
+    atomic_write(gzpath, data)
+    try:
+        replaced = os.stat(fpath).st_ino != inode
+    except OSError:
+        replaced = True
+    if replaced:
+        # the one of the new file may be overwritten by this one
+        remove_file(gzpath)
+        return False
+    return True
@@ -1,20 +1,21 @@
 # coding: utf-8
 
 import os
-import shutil
 import copy
-try:
-    import ujson as json
-except ImportError:
-    from flask import json
 from flask import current_app
 from datetime import datetime
 from werkzeug import cached_property
 from collections import OrderedDict
-from distutils.version import StrictVersion
+from .storage import get_storage
+from .record import PackageRecord, ProjectRecord, to_unicode
+from .version import sort_versions, insert_version
+from .blob import remove_tree
 
 
-__all__ = ['Project', 'Package', 'index_project']
+__all__ = [
+    'Project', 'Package', 'index_project', 'record_change',
+    'build_manifest', 'rebuild_manifest', 'check_manifest',
+]
 
 
 class Model(dict):
@@ -22,55 +23,61 @@ class Model(dict):
         for key in kwargs:
             setattr(self, key, kwargs[key])
 
+    # values are normalized when they are set, not when they are read
+
     def __getattr__(self, key):
         try:
-            return to_unicode(self[key])
+            return self[key]
         except KeyError:
             return None
 
     def __setattr__(self, key, value):
-        self[key] = to_unicode(value)
-
-    def __getitem__(self, key):
-        return to_unicode(super(Model, self).__getitem__(key))
+        self[key] = value
 
     def __setitem__(self, key, value):
         return super(Model, self).__setitem__(key, to_unicode(value))
 
+    def update(self, dct):
+        for key in dct.keys():
+            self[key] = dct[key]
+
+    @property
+    def key(self):
+        raise NotImplementedError
+
     @cached_property
     def datafile(self):
         raise NotImplementedError
 
     def read(self):
-        fpath = self.datafile
-        if not os.path.exists(fpath):
+        data = get_storage().read(self.key)
+        if data is None:
             return None
-        data = _read_json(fpath)
         for key in data:
             self[key] = data[key]
         return self
 
     def save(self):
-        fpath = self.datafile
-
-        directory = os.path.dirname(fpath)
-        if not os.path.exists(directory):
-            os.makedirs(directory)
-
         now = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
         if 'created_at' not in self:
             self['created_at'] = now
 
-        with open(fpath, 'w') as f:
-            self['updated_at'] = now
-            json.dump(self, f)
+        self['updated_at'] = now
+        storage = get_storage()
+        # packages share the lock of the project
+        with storage.lock(self.family, self.name):
+            storage.write(self.key, self)
             return self
 
     def delete(self):
-        directory = os.path.dirname(self.datafile)
-        if os.path.exists(directory):
-            return shutil.rmtree(directory)
-        return None
+        storage = get_storage()
+        with storage.lock(self.family, self.name):
+            # tarballs are always stored in the file system, they are
+            # removed first for the blobs to be released, the file storage
+            # removes the directory as well
+            directory = remove_tree(os.path.dirname(self.datafile))
+            storage.delete(self.key)
+        return directory
 
 
 class Project(Model):
@@ -84,19 +91,32 @@ class Project(Model):
     def __str__(self):
         return '%s/%s' % (self.family, self.name)
 
+    def read(self):
+        if super(Project, self).read() is None:
+            return None
+        if self.packages:
+            self['packages'] = _records(self.packages)
+        return self
+
     def __repr__(self):
         return '<Project: %s>' % self
 
     @classmethod
-    def sort(cls, packages=None):
+    def sort(cls, packages=None, versions=None):
         if not packages:
             return {}
+        if versions is None:
+            versions = sort_versions(packages.keys())
         o = OrderedDict()
-        for v in sorted(packages.keys(),
-                        key=lambda i: StrictVersion(i), reverse=True):
-            o[v] = packages[v]
+        for v in versions:
+            if v in packages:
+                o[v] = packages[v]
         return o
 
+    @property
+    def key(self):
+        return (self.family, self.name)
+
     @cached_property
     def datafile(self):
         root = current_app.config['WWW_ROOT']
@@ -108,24 +128,19 @@ class Project(Model):
 
     @staticmethod
     def all():
-        repo = os.path.join(
-            current_app.config['WWW_ROOT'],
-            'repository',
-        )
+        return get_storage().families()
 
-        def isdir(name):
-            return os.path.isdir(os.path.join(repo, name))
-        return filter(isdir, os.listdir(repo))
+    @staticmethod
+    def manifest():
+        return get_storage().manifest()
+
+    @staticmethod
+    def names():
+        return get_storage().names()
 
     @staticmethod
     def list(family):
-        fpath = os.path.join(
-            current_app.config['WWW_ROOT'],
-            'repository',
-            family,
-            'index.json'
-        )
-        return _read_json(fpath)
+        return map(ProjectRecord, get_storage().projects(family))
 
     def update(self, dct):
         now = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
@@ -137,57 +152,64 @@ class Project(Model):
         if 'name' in dct and dct['name'] != self.name:
             return False
 
-        # save package
-        dct['family'] = self.family
-        dct['name'] = self.name
-        pkg = Package(**dct)
-        pkg.save()
+        with get_storage().lock(self.family, self.name):
+            # save package
+            dct['family'] = self.family
+            dct['name'] = self.name
+            pkg = Package(**dct)
+            pkg.save()
 
-        for key in ['homepage', 'description', 'keywords', 'repository']:
-            if key in dct:
-                self[key] = dct[key]
+            for key in ['homepage', 'description', 'keywords', 'repository']:
+                if key in dct:
+                    self[key] = dct[key]
 
-        packages = self.packages or {}
-        if 'readme' in pkg:
-            del pkg['readme']
+            packages, versions = self._latest_packages()
+            if 'readme' in pkg:
+                del pkg['readme']
 
-        packages[pkg.version] = pkg
-        packages = self.sort(packages)
-        if packages:
-            self['version'] = packages.keys()[0]
+            packages[pkg.version] = PackageRecord(pkg)
+            self['versions'] = insert_version(versions, pkg.version)
+            self['version'] = versions[0]
 
-        if 'created_at' not in self:
-            self['created_at'] = now
+            if 'created_at' not in self:
+                self['created_at'] = now
 
-        self.packages = packages
-        self['updated_at'] = now
-        self.write()
-        return self
+            self.packages = packages
+            self['updated_at'] = now
+            self.write()
+            return self
 
     def remove(self, version):
-        if 'packages' not in self:
+        with get_storage().lock(self.family, self.name):
+            packages, versions = self._latest_packages()
+            if version in packages:
+                del packages[version]
+                self['packages'] = packages
+                if version in versions:
+                    versions.remove(version)
+                self['versions'] = versions
+                self.write()
             return self
-        packages = self['packages'] or {}
-        if version in packages:
-            del packages[version]
-            self['packages'] = packages
-            self.write()
-        return self
+
+    def _latest_packages(self):
+        # other processes may have changed the packages since we read it
+        data = get_storage().read(self.key)
+        if data is None:
+            data = self
+        packages = _records(data.get('packages') or {})
+
+        # versions are stored in order, greatest first
+        versions = data.get('versions')
+        if versions is None or len(versions) != len(packages):
+            versions = sort_versions(packages.keys())
+        return packages, list(versions)
 
     def write(self, data=None):
         if not data:
             data = self
-        storage = current_app.config['WWW_ROOT']
-        directory = os.path.join(
-            storage, 'repository', self.family, self.name
-        )
-        if not os.path.exists(directory):
-            os.makedirs(directory)
-
-        fpath = os.path.join(directory, 'index.json')
-        with open(fpath, 'w') as f:
-            json.dump(data, f)
-            return data
+        storage = get_storage()
+        with storage.lock(self.family, self.name):
+            return storage.write(self.key, data)
 
 
 class Package(Model):
@@ -205,6 +227,10 @@ class Package(Model):
     def __repr__(self):
         return '<Package: %s>' % self
 
+    @property
+    def key(self):
+        return (self.family, self.name, self.version)
+
     @cached_property
     def datafile(self):
         storage = current_app.config['WWW_ROOT']
@@ -216,79 +242,56 @@ class Package(Model):
 
 
 def index_project(project, operation):
-    # project = copy.copy(project)
-
-    repo = os.path.join(current_app.config['WWW_ROOT'], 'repository')
-    if operation == 'create' or operation == 'delete':
-        fullname = '%(family)s/%(name)s' % project
-        repofile = os.path.join(repo, 'index.json')
-        if os.path.exists(repofile):
-            repoindex = _read_json(repofile)
-        else:
-            repoindex = []
-
-        if fullname not in repoindex and operation == 'create':
-            repoindex.insert(0, fullname)
-        elif fullname in repoindex and operation == 'delete':
-            repoindex.remove(fullname)
-
-        with open(repofile, 'w') as f:
-            json.dump(repoindex, f)
-
-    directory = os.path.join(repo, project['family'])
-    fpath = os.path.join(directory, 'index.json')
-    data = _read_json(fpath)
-    data = filter(lambda o: o['name'] != project['name'], data)
-
-    if operation == 'delete':
-        directory = os.path.join(directory, project['name'])
-        if os.path.exists(directory):
-            shutil.rmtree(directory)
-        with open(fpath, 'w') as f:
-            json.dump(data, f)
-        return data
-
-    if not os.path.exists(directory):
-        os.makedirs(directory)
-
-    if 'packages' in project:
-        del project['packages']
-
-    def __sort(item):
-        if 'update_at' in item:
-            return datetime.strptime(
-                item['updated_at'], '%Y-%m-%dT%H:%M:%SZ'
-            )
-        return None
-
-    data.append(project)
-    data = sorted(
-        data,
-        key=__sort,
-        reverse=True
-    )
-    with open(fpath, 'w') as f:
-        json.dump(data, f)
-        return data
-
-
-def to_unicode(value):
-    if isinstance(value, unicode):
-        return value
-    if isinstance(value, basestring):
-        return value.decode('utf-8')
-    if isinstance(value, int):
-        return str(value)
-    if isinstance(value, bytes):
-        return value.decode('utf-8')
-    return value
-
-
-def _read_json(fpath):
-    if not os.path.exists(fpath):
-        return {}
-    with open(fpath, 'r') as f:
-        try:
-            return json.load(f)
-        except:
-            return {}
+    return get_storage().index(project, operation)
+
+
+def record_change(kind, obj, operation):
+    """Append a change of a project or package to the changes feed."""
+    change = {
+        'type': kind,
+        'op': operation,
+        'family': obj['family'],
+        'name': obj['name'],
+        'time': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+    }
+    if kind == 'package':
+        change['version'] = obj['version']
+    return get_storage().record_change(change)
+
+
+def build_manifest():
+    """Build the repository manifest from the project documents."""
+    return get_storage().build_manifest()
+
+
+def rebuild_manifest():
+    storage = get_storage()
+    storage.rebuild()
+    return storage.manifest()
+
+
+def check_manifest():
+    """Compare the manifest with the project documents. Return a list of
+    ``(fullname, reason)``, reason is one of missing, extra and stale.
+    """
+    current = Project.manifest()
+    actual = build_manifest()
+    drift = []
+    for fullname in sorted(set(current) | set(actual)):
+        if fullname not in current:
+            drift.append((fullname, 'missing'))
+        elif fullname not in actual:
+            drift.append((fullname, 'extra'))
+        elif current[fullname] != actual[fullname]:
+            drift.append((fullname, 'stale'))
+    return drift
+
+
+def _records(packages):
+    rv = {}
+    for version in packages:
+        pkg = packages[version]
+        if not isinstance(pkg, PackageRecord):
+            pkg = PackageRecord(pkg)
+        rv[version] = pkg
+    return rv
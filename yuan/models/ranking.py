@@ -0,0 +1,200 @@
+# coding: utf-8
+
+import os
+import heapq
+from flask import current_app, json
+from .fileio import atomic_write
+from .storage import get_storage
+
+__all__ = [
+    'Ranking', 'popular', 'latest', 'rank_project', 'rank_popular',
+    'rebuild_rankings',
+]
+
+
+class Ranking(object):
+    """The top projects by a score, written to ``repository/{name}.json``.
+
+    A pool of twice as many candidates is kept in ``WWW_ROOT/.rankings``,
+    with a bound that no project out of the pool scores above. Changes
+    are applied to the pool, the ranking is right as long as the last of
+    the top projects is above the bound. When it is not, every project is
+    ranked again.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    @property
+    def size(self):
+        return current_app.config.get('RANKING_SIZE', 50)
+
+    @property
+    def fpath(self):
+        root = current_app.config['WWW_ROOT']
+        return os.path.join(root, 'repository', '%s.json' % self.name)
+
+    @property
+    def poolfile(self):
+        root = current_app.config['WWW_ROOT']
+        return os.path.join(root, '.rankings', '%s.json' % self.name)
+
+    def items(self):
+        if not os.path.exists(self.fpath):
+            return []
+        with open(self.fpath) as f:
+            return json.load(f)
+
+    def update(self, changes):
+        """Apply changes of ``{fullname: (score, item)}``, a None score
+        removes the project. Return False if the ranking can not be told
+        from the pool, it must be rebuilt then.
+        """
+        if not os.path.exists(self.poolfile):
+            return False
+        with open(self.poolfile) as f:
+            pool = json.load(f)
+
+        items = pool['items']
+        bound = pool['bound']
+        for fullname in changes:
+            score, item = changes[fullname]
+            if score is None:
+                items.pop(fullname, None)
+            elif fullname in items or _above([score, fullname], bound):
+                items[fullname] = [score, item]
+        return self.save(items, bound)
+
+    def pool(self):
+        return _Pool(self.size * 2)
+
+    def save(self, items, bound):
+        """Write the pool and the ranking of it atomically."""
+        capacity = self.size * 2
+        if len(items) > capacity:
+            keys = sorted([items[k][0], k] for k in items)
+            for key in keys[:len(items) - capacity]:
+                del items[key[1]]
+                if _above(key, bound):
+                    bound = key
+
+        top = heapq.nlargest(self.size, ([items[k][0], k] for k in items))
+        if bound is not None:
+            if len(top) < self.size or not _above(top[-1], bound):
+                return False
+
+        pool = {'items': items, 'bound': bound}
+        atomic_write(self.poolfile, json.dumps(pool))
+        atomic_write(self.fpath, json.dumps([items[k][1] for _, k in top]))
+        return True
+
+
+class _Pool(object):
+    """A bounded heap of the top candidates, for a full ranking."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.heap = []
+        self.bound = None
+
+    def push(self, fullname, score, item):
+        entry = ([score, fullname], item)
+        if len(self.heap) < self.capacity:
+            heapq.heappush(self.heap, entry)
+            return
+        key = heapq.heappushpop(self.heap, entry)[0]
+        if _above(key, self.bound):
+            self.bound = key
+
+    def items(self):
+        return dict((key[1], [key[0], item]) for key, item in self.heap)
+
+
+popular = Ranking('popular')
+latest = Ranking('latest')
+
+
+def rank_project(project, operation):
+    """Rank a project again after it is changed."""
+    storage = get_storage()
+    key = (project['family'], project['name'])
+    entries = []
+    if operation != 'delete':
+        entries = filter(None, [_entry(storage, key)])
+    _update((popular, latest), [key], entries)
+
+
+def rank_popular(keys):
+    """Rank the projects of changed transitive dependents or downloads
+    counts again.
+    """
+    if not keys:
+        return
+    storage = get_storage()
+    entries = filter(None, [_entry(storage, key) for key in keys])
+    _update((popular,), keys, entries)
+
+
+def rebuild_rankings():
+    """Rank every project, in one pass over the storage that keeps the
+    top candidates only.
+    """
+    storage = get_storage()
+    rankings = (popular, latest)
+    pools = [o.pool() for o in rankings]
+    for key in storage.walk():
+        entry = _entry(storage, key)
+        if entry is None:
+            continue
+        for ranking, pool in zip(rankings, pools):
+            pool.push(entry[0], *_score(ranking, entry))
+
+    with storage.lock('rankings'):
+        for ranking, pool in zip(rankings, pools):
+            ranking.save(pool.items(), pool.bound)
+    return {'popular': popular.items(), 'latest': latest.items()}
+
+
+def _update(rankings, keys, entries):
+    changes = dict((o, {}) for o in rankings)
+    for ranking in rankings:
+        for key in keys:
+            changes[ranking]['%s/%s' % tuple(key)] = (None, None)
+        for entry in entries:
+            changes[ranking][entry[0]] = _score(ranking, entry)
+
+    with get_storage().lock('rankings'):
+        for ranking in rankings:
+            if not ranking.update(changes[ranking]):
+                rebuild_rankings()
+                return
+
+
+def _entry(storage, key):
+    """A project is ranked when it has a stable package."""
+    project = storage.read(key)
+    if not project or 'created_at' not in project:
+        return None
+    packages = project.pop('packages', None) or {}
+    if not any(o.get('tag') == 'stable' for o in packages.values()):
+        return None
+    counts = (
+        storage.transitive_dependents(*key),
+        storage.downloads(*key)['total'],
+    )
+    fullname = '%s/%s' % key
+    return fullname, counts, project.get('updated_at', ''), project
+
+
+def _score(ranking, entry):
+    fullname, counts, updated_at, item = entry
+    if ranking is popular:
+        # by dependents, then by downloads
+        item = dict(item, transitive_dependents=counts[0], downloads=counts[1])
+        return list(counts), item
+    # ISO 8601 time strings sort in the order of time
+    return updated_at, item
+
+
+def _above(key, bound):
+    return bound is None or key > bound
@@ -0,0 +1,193 @@
+# coding: utf-8
+
+__all__ = ['Record', 'PackageRecord', 'ProjectRecord', 'serialize']
+
+PACKAGE_FIELDS = (
+    'family', 'name', 'version', 'tag', 'md5', 'sha256', 'filename',
+    'description', 'homepage', 'keywords', 'repository',
+    'dependencies', 'dependents', 'publisher',
+    'created_at', 'updated_at',
+)
+
+PROJECT_FIELDS = (
+    'family', 'name', 'version', 'versions',
+    'description', 'homepage', 'keywords', 'repository',
+    'created_at', 'updated_at',
+)
+
+
+class Record(object):
+    """A compact mapping for metadata that has many instances.
+
+    Known fields are stored in ``__slots__``, others are kept in an
+    overflow dict. Strings are normalized when they are set, reading
+    a field costs nothing more than an attribute lookup. A missing
+    field is None when it is accessed as an attribute.
+    """
+
+    __slots__ = ('_extra',)
+    fields = ()
+    _fieldset = frozenset()
+
+    def __init__(self, data=None, **kwargs):
+        object.__setattr__(self, '_extra', None)
+        if data:
+            for key in data.keys():
+                self[key] = data[key]
+        for key in kwargs:
+            self[key] = kwargs[key]
+
+    def __getitem__(self, key):
+        if key in self._fieldset:
+            try:
+                return object.__getattribute__(self, key)
+            except AttributeError:
+                raise KeyError(key)
+        if self._extra is None:
+            raise KeyError(key)
+        return self._extra[key]
+
+    def __setitem__(self, key, value):
+        value = to_unicode(value)
+        if key in self._fieldset:
+            object.__setattr__(self, key, value)
+        elif self._extra is None:
+            object.__setattr__(self, '_extra', {key: value})
+        else:
+            self._extra[key] = value
+
+    def __delitem__(self, key):
+        if key in self._fieldset:
+            try:
+                object.__delattr__(self, key)
+            except AttributeError:
+                raise KeyError(key)
+        elif self._extra is None:
+            raise KeyError(key)
+        else:
+            del self._extra[key]
+
+    def __getattr__(self, key):
+        # only called when the slot is empty or key is not a field
+        if key.startswith('__'):
+            raise AttributeError(key)
+        extra = object.__getattribute__(self, '_extra')
+        if extra and key in extra:
+            return extra[key]
+        return None
+
+    def __setattr__(self, key, value):
+        self[key] = value
+
+    def __contains__(self, key):
+        try:
+            self[key]
+            return True
+        except KeyError:
+            return False
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __eq__(self, other):
+        if isinstance(other, Record):
+            other = other.to_dict()
+        return self.to_dict() == other
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __reduce__(self):
+        return (self.__class__, (self.to_dict(),))
+
+    def __repr__(self):
+        return '<%s: %r>' % (self.__class__.__name__, self.to_dict())
+
+    def keys(self):
+        keys = []
+        for key in self.fields:
+            try:
+                object.__getattribute__(self, key)
+                keys.append(key)
+            except AttributeError:
+                pass
+        if self._extra:
+            keys.extend(self._extra.keys())
+        return keys
+
+    def values(self):
+        return [self[key] for key in self.keys()]
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def pop(self, key, *default):
+        try:
+            value = self[key]
+        except KeyError:
+            if default:
+                return default[0]
+            raise
+        del self[key]
+        return value
+
+    def update(self, data):
+        for key in data.keys():
+            self[key] = data[key]
+
+    def to_dict(self):
+        dct = {}
+        for key in self.fields:
+            try:
+                dct[key] = object.__getattribute__(self, key)
+            except AttributeError:
+                pass
+        if self._extra:
+            dct.update(self._extra)
+        return dct
+
+    copy = to_dict
+
+
+class PackageRecord(Record):
+    """Summary of a package in ``Project.packages``."""
+    __slots__ = fields = PACKAGE_FIELDS
+    _fieldset = frozenset(PACKAGE_FIELDS)
+
+
+class ProjectRecord(Record):
+    """Summary of a project in a family listing."""
+    __slots__ = fields = PROJECT_FIELDS
+    _fieldset = frozenset(PROJECT_FIELDS)
+
+
+def serialize(value):
+    """Convert records in the value to dicts for json."""
+    if isinstance(value, Record):
+        return value.to_dict()
+    if isinstance(value, dict):
+        return dict((k, serialize(value[k])) for k in value)
+    if isinstance(value, list):
+        return [serialize(v) for v in value]
+    return value
+
+
+def to_unicode(value):
+    if isinstance(value, unicode):
+        return value
+    if isinstance(value, basestring):
+        return value.decode('utf-8')
+    if isinstance(value, int):
+        return str(value)
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    return value
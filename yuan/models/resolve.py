@@ -0,0 +1,211 @@
+# coding: utf-8
+
+import time
+import threading
+from .storage import get_storage
+
+__all__ = ['Resolver', 'resolver', 'parse_dependency']
+
+
+class Resolver(object):
+    """Resolve the transitive dependencies of packages.
+
+    The closure of every resolved package is cached, packages in a cycle
+    share the closure of their strongly connected component. A cached
+    closure is dropped when a package in it is changed, changes of other
+    workers are read from the changes feed of the storage.
+    """
+
+    #: the whole cache is dropped when it is behind so many changes
+    max_changes = 1000
+    #: the changes feed is read at most once in so many seconds
+    sync_interval = 1
+
+    def __init__(self):
+        self.storage = None
+        self.seq = None
+        self.synced_at = 0
+        self._nodes = {}
+        self._closures = {}
+        self._results = {}
+        self._lock = threading.RLock()
+
+    def resolve(self, key):
+        """The packages ``key`` depends on, directly or not. Return None
+        if the package does not exist.
+        """
+        with self._lock:
+            self.sync()
+            if key in self._results:
+                return self._results[key]
+            if self._node(key) is None:
+                return None
+            closure, cycles = self._closure(key)
+
+            packages = {}
+            missing = []
+            for k in closure:
+                info = self._node(k)
+                if info is None:
+                    missing.append(_format(k))
+                    continue
+                item = dict((n, v) for n, v in info.items() if n != 'deps')
+                item['dependencies'] = [_format(o) for o in info['deps']]
+                packages[_format(k)] = item
+            rv = {
+                'package': _format(key),
+                'packages': packages,
+                'missing': sorted(missing),
+                'cycles': [list(o) for o in cycles],
+            }
+            self._results[key] = rv
+            return rv
+
+    def sync(self):
+        """Drop the cache of packages changed since the last sync."""
+        storage = get_storage()
+        now = time.time()
+        if storage is not self.storage:
+            self.storage = storage
+            self.seq = storage.last_seq()
+            self.synced_at = now
+            self.clear()
+            return
+        if now - self.synced_at < self.sync_interval:
+            return
+
+        self.synced_at = now
+        seq = storage.last_seq()
+        if seq == self.seq:
+            return
+        changes = storage.changes(self.seq, self.max_changes)
+        if not changes or changes[-1]['seq'] < seq:
+            self.clear()
+        else:
+            for change in changes:
+                if change['type'] == 'package':
+                    self.invalidate((
+                        change['family'], change['name'], change['version']
+                    ))
+                elif change['op'] == 'delete':
+                    self.invalidate_project(change['family'], change['name'])
+        self.seq = seq
+
+    def invalidate(self, key):
+        with self._lock:
+            self._nodes.pop(key, None)
+            for k in [k for k, o in self._closures.items() if key in o[0]]:
+                del self._closures[k]
+                self._results.pop(k, None)
+
+    def invalidate_project(self, family, name):
+        with self._lock:
+            for key in list(self._nodes):
+                if key[:2] == (family, name):
+                    self.invalidate(key)
+
+    def clear(self):
+        with self._lock:
+            self._nodes.clear()
+            self._closures.clear()
+            self._results.clear()
+
+    def _node(self, key):
+        if key in self._nodes:
+            return self._nodes[key]
+        data = self.storage.read(key)
+        info = None
+        # a package without a tarball can not be installed
+        if data and data.get('filename'):
+            filename = data['filename']
+            path = '/repository/%s/%s/%s/%s' % (key + (filename,))
+            deps = []
+            for dep in data.get('dependencies') or []:
+                dep = parse_dependency(dep)
+                if dep and dep not in deps:
+                    deps.append(dep)
+            info = {
+                'family': key[0], 'name': key[1], 'version': key[2],
+                'filename': filename, 'path': path, 'md5': data.get('md5'),
+                'deps': deps,
+            }
+        self._nodes[key] = info
+        return info
+
+    def _deps(self, key):
+        info = self._node(key)
+        if info is None:
+            return []
+        return info['deps']
+
+    def _closure(self, root):
+        # Tarjan's algorithm, components are finished children first, so
+        # the closures of the dependencies are known when one is finished
+        if root in self._closures:
+            return self._closures[root]
+
+        index = {root: 0}
+        low = {root: 0}
+        stack = [root]
+        onstack = set([root])
+        work = [(root, iter(self._deps(root)))]
+        while work:
+            v, deps = work[-1]
+            for w in deps:
+                if w in self._closures:
+                    continue
+                if w not in index:
+                    index[w] = low[w] = len(index)
+                    stack.append(w)
+                    onstack.add(w)
+                    work.append((w, iter(self._deps(w))))
+                    break
+                if w in onstack:
+                    low[v] = min(low[v], index[w])
+            else:
+                work.pop()
+                if work:
+                    u = work[-1][0]
+                    low[u] = min(low[u], low[v])
+                if low[v] == index[v]:
+                    component = []
+                    while True:
+                        w = stack.pop()
+                        onstack.discard(w)
+                        component.append(w)
+                        if w == v:
+                            break
+                    self._finish(component)
+        return self._closures[root]
+
+    def _finish(self, component):
+        members = set(component)
+        closure = set(members)
+        cycles = set()
+        if len(component) > 1 or component[0] in self._deps(component[0]):
+            cycles.add(tuple(sorted(_format(o) for o in component)))
+        for key in component:
+            for dep in self._deps(key):
+                if dep not in members:
+                    c, cy = self._closures[dep]
+                    closure |= c
+                    cycles.update(cy)
+        rv = (frozenset(closure), tuple(sorted(cycles)))
+        for key in component:
+            self._closures[key] = rv
+
+
+resolver = Resolver()
+
+
+def parse_dependency(dep):
+    """Parse ``family/name@version`` into a key."""
+    if '@' not in dep or '/' not in dep:
+        return None
+    value, version = dep.split('@', 1)
+    family, name = value.split('/', 1)
+    return (family, name, version)
+
+
+def _format(key):
+    return '%s/%s@%s' % key
@@ -0,0 +1,252 @@
+# coding: utf-8
+
+import os
+from flask import current_app
+from ..fileio import file_lock
+from .graph import DependentsIndex
+
+__all__ = [
+    'Storage', 'DependentsIndex', 'get_storage', 'create_storage',
+    'copy_storage', 'package_dependencies',
+]
+
+#: summary fields of a project that are kept in the repository manifest
+MANIFEST_FIELDS = ('family', 'name', 'version', 'created_at', 'updated_at')
+
+
+class Storage(object):
+    """Interface of a metadata storage.
+
+    A key is ``(family, name)`` for a project, and ``(family, name,
+    version)`` for a package.
+    """
+
+    #: directory of the lock files
+    lockdir = None
+
+    def read(self, key):
+        """Read the document of a project or package, None if missing."""
+        raise NotImplementedError
+
+    def write(self, key, data):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def walk(self):
+        """Iterate the keys of all projects in the storage."""
+        raise NotImplementedError
+
+    def families(self):
+        raise NotImplementedError
+
+    def projects(self, family):
+        """List the summary of projects in a family, the latest updated
+        project comes first.
+        """
+        raise NotImplementedError
+
+    def manifest(self):
+        """A mapping of ``family/name`` to the summary of the project."""
+        raise NotImplementedError
+
+    def names(self):
+        """Names of all projects, the latest created project comes first."""
+        manifest = self.manifest()
+        return sorted(
+            manifest,
+            key=lambda o: manifest[o].get('created_at', ''),
+            reverse=True
+        )
+
+    def index(self, project, operation):
+        """Maintain the listings after a project is changed."""
+        pass
+
+    def rebuild(self):
+        """Rebuild the listings from the documents."""
+        pass
+
+    def compact(self, family=None):
+        """Compact the pending changes of the listings."""
+        pass
+
+    def record_change(self, change):
+        """Append a change to the changes feed, return its sequence."""
+        raise NotImplementedError
+
+    def changes(self, since=0, limit=100):
+        """List changes after the sequence ``since``, oldest first."""
+        raise NotImplementedError
+
+    def last_seq(self):
+        raise NotImplementedError
+
+    def latest(self, family, name):
+        data = self.read((family, name)) or {}
+        return data.get('version')
+
+    def dependents(self, family, name, version, offset=0, limit=None):
+        """Packages depend on the package, sorted ``family/name@version``
+        strings from the reverse dependency index.
+        """
+        raise NotImplementedError
+
+    def count_dependents(self, family, name, version):
+        raise NotImplementedError
+
+    def set_dependencies(self, key, dependencies):
+        """Replace the dependencies of the package ``key`` in the reverse
+        dependency index, and the transitive dependents counts changed by
+        them, in one batch. Return the changed counts of projects.
+        """
+        raise NotImplementedError
+
+    def rebuild_dependents(self, dependencies):
+        """Replace the reverse dependency index with a mapping of package
+        keys to their dependencies, and count the transitive dependents of
+        every project again.
+        """
+        raise NotImplementedError
+
+    def transitive_dependents(self, family, name):
+        """Count the packages depend on the project, directly or not. It is
+        maintained with the reverse dependency index.
+        """
+        raise NotImplementedError
+
+    def transitive_counts(self):
+        """A mapping of ``family/name`` to the transitive dependents count
+        of projects that have dependents.
+        """
+        raise NotImplementedError
+
+    def add_downloads(self, counts):
+        """Add a batch of download counts, a mapping of ``(family, name,
+        version, day)`` to the count.
+        """
+        raise NotImplementedError
+
+    def downloads(self, family, name):
+        """Download counts of a project, per version and day::
+
+            {"total": 3, "versions": {"1.0.0": {
+                "total": 3, "days": {"2013-10-10": 3}}}}
+        """
+        raise NotImplementedError
+
+    def lock(self, *names):
+        return file_lock('%s.lock' % os.path.join(self.lockdir, *names))
+
+    def build_manifest(self):
+        manifest = {}
+        for key in self.walk():
+            project = self.read(key)
+            if project and 'created_at' in project:
+                manifest['%s/%s' % key] = summarize(project)
+        return manifest
+
+
+_storages = {}
+
+
+def get_storage(config=None):
+    """Get the metadata storage configured by ``METADATA_STORAGE``."""
+    if config is None:
+        config = current_app.config
+
+    backend = config.get('METADATA_STORAGE', 'file')
+    if isinstance(backend, Storage):
+        return backend
+
+    root = config['WWW_ROOT']
+    database = config.get('METADATA_DATABASE')
+    gzip = config.get('GZIP_STATIC', False)
+    key = (backend, root, database, gzip)
+    if key not in _storages:
+        _storages[key] = create_storage(
+            backend, root, database,
+            log_size=config.get('FAMILY_LOG_SIZE', 32), gzip=gzip,
+        )
+    return _storages[key]
+
+
+def create_storage(backend, root, database=None, log_size=32, gzip=False):
+    if backend == 'file':
+        from .filesystem import FileStorage
+        return FileStorage(root, log_size, gzip)
+    if backend == 'sqlite':
+        from .sqlite import SQLiteStorage
+        if not database:
+            database = os.path.join(root, 'metadata.sqlite')
+        return SQLiteStorage(database, root)
+    if backend == 'memory':
+        from .memory import MemoryStorage
+        return MemoryStorage()
+    raise ValueError('unknown metadata storage: %s' % backend)
+
+
+def copy_storage(source, target):
+    """Copy every project and package from source to target."""
+    count = 0
+    dependencies = {}
+    for key in source.walk():
+        project = source.read(key)
+        if not project:
+            continue
+        packages = project.get('packages') or {}
+        for version in packages:
+            pkg = source.read(key + (version,)) or packages[version]
+            target.write(key + (version,), pkg)
+            dependencies[key + (version,)] = package_dependencies(pkg)
+        target.write(key, project)
+        count += 1
+    target.rebuild()
+    target.rebuild_dependents(dependencies)
+    return count
+
+
+def group_downloads(counts):
+    """Group download counts by project."""
+    projects = {}
+    for key in counts:
+        dct = projects.setdefault(tuple(key[:2]), {})
+        dct[tuple(key[2:])] = dct.get(tuple(key[2:]), 0) + counts[key]
+    return projects
+
+
+def add_downloads(data, counts):
+    """Add ``{(version, day): count}`` to the download counts of a
+    project.
+    """
+    data = data or {'total': 0, 'versions': {}}
+    for version, day in counts:
+        count = counts[(version, day)]
+        item = data['versions'].setdefault(version, {'total': 0, 'days': {}})
+        item['days'][day] = item['days'].get(day, 0) + count
+        item['total'] += count
+        data['total'] += count
+    return data
+
+
+def package_dependencies(pkg):
+    """Keys of the ``family/name@version`` dependencies of a package."""
+    keys = []
+    for dep in pkg.get('dependencies') or []:
+        if '@' not in dep or '/' not in dep:
+            continue
+        value, version = dep.split('@', 1)
+        family, name = value.split('/', 1)
+        key = (family, name, version)
+        if key not in keys:
+            keys.append(key)
+    return keys
+
+
+def summarize(project, previous=None):
+    dct = dict(previous or {})
+    for key in MANIFEST_FIELDS:
+        if project.get(key) is not None:
+            dct[key] = project[key]
+    return dct
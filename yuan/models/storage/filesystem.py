@@ -0,0 +1,467 @@
+# coding: utf-8
+
+import os
+import shutil
+import threading
+import gevent
+from gevent import monkey
+try:
+    import ujson as json
+except ImportError:
+    from flask import json
+from ..cache import metacache
+from ..fileio import atomic_write, remove_file, gzip_file
+from ..record import serialize
+from . import Storage, DependentsIndex, summarize
+from . import group_downloads, add_downloads
+from .graph import update_transitive, count_all
+
+
+class FileStorage(Storage):
+    """Store metadata as json files under ``WWW_ROOT/repository``, the
+    layout can be served by nginx directly::
+
+        repository/index.json                       names of projects
+        repository/manifest.json                    summary of projects
+        repository/{family}/index.json              projects in family
+        repository/{family}/index.log               changes of the family
+        repository/{family}/{name}/index.json       project
+        repository/{family}/{name}/downloads.json   download counts
+        repository/{family}/{name}/{version}/index.json     package
+
+    The changes feed is a log of json lines in ``WWW_ROOT/changes.log``,
+    the reverse dependency index and the transitive dependents counts are
+    replayed from the log of dependencies in ``WWW_ROOT/dependents.log``.
+    With ``gzip``, every json file has a ``.gz`` sibling for the
+    ``gzip_static`` of nginx.
+    """
+
+    def __init__(self, root, log_size=32, gzip=False):
+        self.root = root
+        self.repository = os.path.join(root, 'repository')
+        self.lockdir = os.path.join(root, '.locks')
+        #: compact the family log when it has so many entries
+        self.log_size = log_size
+        self.gzip = gzip
+        self._dependents = None
+        self._dependents_lock = threading.Lock()
+
+    def datafile(self, key):
+        return os.path.join(self.repository, *(key + ('index.json',)))
+
+    def read(self, key):
+        return metacache.get(self.datafile(key), load_json)
+
+    def write(self, key, data):
+        return write_json(self.datafile(key), data, self.gzip)
+
+    def delete(self, key):
+        directory = os.path.dirname(self.datafile(key))
+        metacache.invalidate(self.datafile(key))
+        if os.path.exists(directory):
+            shutil.rmtree(directory)
+
+    def walk(self):
+        for family in self.families():
+            directory = os.path.join(self.repository, family)
+            for name in os.listdir(directory):
+                if os.path.exists(self.datafile((family, name))):
+                    yield (family, name)
+
+    def families(self):
+        if not os.path.exists(self.repository):
+            return []
+
+        def isdir(name):
+            return os.path.isdir(os.path.join(self.repository, name))
+        return filter(isdir, os.listdir(self.repository))
+
+    def projects(self, family):
+        # the log must be read before the index, a compaction between
+        # them makes the log replayed on the new index, which is harmless
+        log = self._read(self.logfile(family), [])
+        data = self._read(self.datafile((family,)), [])
+        if log:
+            data = _replay(data, log)
+        return data
+
+    def manifest(self):
+        return self._read(self.repofile('manifest.json'), {})
+
+    def names(self):
+        return self._read(self.repofile('index.json'), [])
+
+    def index(self, project, operation):
+        family, name = project['family'], project['name']
+        with self.lock('manifest'):
+            manifest = self.manifest()
+            fullname = '%s/%s' % (family, name)
+            if operation == 'delete':
+                manifest.pop(fullname, None)
+            else:
+                manifest[fullname] = summarize(
+                    project, manifest.get(fullname)
+                )
+            self._write_manifest(manifest)
+
+        if operation == 'delete':
+            self.delete((family, name))
+            entry = {'op': 'delete', 'name': name}
+        else:
+            item = dict((k, project[k]) for k in project if k != 'packages')
+            entry = {'op': 'update', 'name': name, 'project': item}
+
+        with self.lock(family):
+            fpath = self.logfile(family)
+            _append(fpath, entry)
+            if len(self._read(fpath, [])) >= self.log_size:
+                self.compact(family)
+
+    def compact(self, family=None):
+        """Merge the change log of a family into its index.json."""
+        if family is None:
+            for family in self.families():
+                self.compact(family)
+            return
+
+        with self.lock(family):
+            log = self._read(self.logfile(family), [])
+            if not log:
+                return
+            data = self._read(self.datafile((family,)), [])
+            self._write((family,), _replay(data, log))
+            truncate(self.logfile(family))
+
+    def record_change(self, change):
+        with self.lock('changes'):
+            change = dict(change, seq=self.last_seq() + 1)
+            _append(self.changefile, change)
+            return change['seq']
+
+    def changes(self, since=0, limit=100):
+        if not os.path.exists(self.changefile):
+            return []
+
+        results = []
+        with open(self.changefile, 'rb') as f:
+            f.seek(_bisect_log(f, since))
+            for line in f:
+                change = _parse_line(line)
+                if not change or change['seq'] <= since:
+                    continue
+                results.append(change)
+                if len(results) >= limit:
+                    break
+        return results
+
+    def last_seq(self):
+        if not os.path.exists(self.changefile):
+            return 0
+        with open(self.changefile, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            f.seek(max(0, size - 4096))
+            lines = f.read().splitlines()
+        for line in reversed(lines):
+            change = _parse_line(line)
+            if change:
+                return change['seq']
+        return 0
+
+    def dependents(self, family, name, version, offset=0, limit=None):
+        return self._load_dependents().dependents(
+            (family, name, version), offset, limit
+        )
+
+    def count_dependents(self, family, name, version):
+        return self._load_dependents().count((family, name, version))
+
+    def set_dependencies(self, key, dependencies):
+        key = tuple(key)
+        dependencies = set(map(tuple, dependencies))
+        with self.lock('dependents'):
+            index = self._load_dependents()
+            if index.dependencies(key) == dependencies:
+                return {}
+            try:
+                counts = update_transitive(
+                    index, lambda o: index.counts.get(o, 0),
+                    key, dependencies
+                )
+                index.set_counts(counts)
+                _append(self.dependentsfile, {
+                    'package': key, 'dependencies': sorted(dependencies),
+                    'counts': [o + (counts[o],) for o in sorted(counts)],
+                })
+            except:
+                # the index is loaded from the log again
+                self._dependents = None
+                raise
+            index = self._load_dependents()
+            # every package has a line at least, the older ones are dropped
+            if index.lines > 2 * len(index.sources) + 1024:
+                self._write_dependents(index)
+        return counts
+
+    def rebuild_dependents(self, dependencies):
+        index = DependentsIndex()
+        for key in dependencies:
+            index.update(tuple(key), map(tuple, dependencies[key]))
+        index.counts = count_all(index)
+        with self.lock('dependents'):
+            self._write_dependents(index)
+
+    def transitive_dependents(self, family, name):
+        return self._load_dependents().counts.get((family, name), 0)
+
+    def transitive_counts(self):
+        counts = self._load_dependents().counts
+        return dict(('%s/%s' % o, counts[o]) for o in counts)
+
+    def add_downloads(self, counts):
+        projects = group_downloads(counts)
+        for key in projects:
+            fpath = self.downloadfile(key)
+            if not os.path.exists(os.path.dirname(fpath)):
+                # the project is deleted
+                continue
+            with self.lock(*key):
+                data = add_downloads(
+                    self._read(fpath, None), projects[key]
+                )
+                write_json(fpath, data, self.gzip)
+
+    def downloads(self, family, name):
+        return self._read(
+            self.downloadfile((family, name)), {'total': 0, 'versions': {}}
+        )
+
+    def rebuild(self):
+        with self.lock('manifest'):
+            manifest = self._write_manifest(self.build_manifest())
+
+        families = {}
+        for key in self.walk():
+            project = self.read(key)
+            project.pop('packages', None)
+            families.setdefault(key[0], []).append(project)
+
+        for family in families:
+            data = sorted(
+                families[family],
+                key=lambda o: o.get('updated_at', ''),
+                reverse=True
+            )
+            with self.lock(family):
+                self._write((family,), data)
+                if os.path.exists(self.logfile(family)):
+                    truncate(self.logfile(family))
+        return manifest
+
+    def repofile(self, filename):
+        return os.path.join(self.repository, filename)
+
+    @property
+    def changefile(self):
+        return os.path.join(self.root, 'changes.log')
+
+    def downloadfile(self, key):
+        return os.path.join(self.repository, *(key + ('downloads.json',)))
+
+    @property
+    def dependentsfile(self):
+        return os.path.join(self.root, 'dependents.log')
+
+    def logfile(self, family):
+        return os.path.join(self.repository, family, 'index.log')
+
+    def _read(self, fpath, default):
+        if fpath.endswith('.log'):
+            data = metacache.get(fpath, load_log)
+        else:
+            data = metacache.get(fpath, load_json)
+        if not data:
+            return default
+        return data
+
+    def _write(self, key, data):
+        return write_json(self.datafile(key), data, self.gzip)
+
+    def _load_dependents(self):
+        """The index of this process, lines appended by other processes
+        since the last load are replayed on it. It is loaded again when the
+        log is replaced by a compaction.
+        """
+        with self._dependents_lock:
+            try:
+                st = os.stat(self.dependentsfile)
+                inode, size = st.st_ino, st.st_size
+            except OSError:
+                inode, size = None, 0
+
+            index = self._dependents
+            if index is None or index.inode != inode or size < index.offset:
+                index = self._dependents = DependentsIndex()
+                index.inode = inode
+                index.offset = 0
+                index.lines = 0
+            if size <= index.offset:
+                return index
+
+            with open(self.dependentsfile, 'rb') as f:
+                f.seek(index.offset)
+                data = f.read(size - index.offset)
+            # the last line may be half written
+            end = data.rfind('\n') + 1
+            for line in data[:end].splitlines():
+                entry = _parse_line(line)
+                if not entry:
+                    continue
+                if 'package' in entry:
+                    index.update(
+                        tuple(entry['package']),
+                        map(tuple, entry['dependencies'])
+                    )
+                index.set_counts(dict(
+                    ((f, n), c) for f, n, c in entry.get('counts') or []
+                ))
+                index.lines += 1
+            index.offset += end
+            return index
+
+    def _write_dependents(self, index):
+        entries = []
+        for key in sorted(index.sources):
+            entries.append({
+                'package': key,
+                'dependencies': sorted(index.sources[key]),
+            })
+        counts = index.counts
+        entries.append({
+            'counts': [o + (counts[o],) for o in sorted(counts)],
+        })
+        lines = []
+        for entry in entries:
+            line = json.dumps(entry)
+            if isinstance(line, unicode):
+                line = line.encode('utf-8')
+            lines.append(line + '\n')
+        atomic_write(self.dependentsfile, ''.join(lines))
+
+    def _write_manifest(self, manifest):
+        write_json(self.repofile('manifest.json'), manifest, self.gzip)
+        names = sorted(
+            manifest,
+            key=lambda o: manifest[o].get('created_at', ''),
+            reverse=True
+        )
+        write_json(self.repofile('index.json'), names, self.gzip)
+        return manifest
+
+
+def load_json(fpath):
+    with open(fpath, 'r') as f:
+        try:
+            return json.load(f)
+        except:
+            return {}
+
+
+def load_log(fpath):
+    entries = []
+    with open(fpath, 'r') as f:
+        for line in f:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                # the last line may be half written
+                continue
+    return entries
+
+
+def write_json(fpath, data, gzip=False):
+    content = json.dumps(serialize(data))
+    if isinstance(content, unicode):
+        content = content.encode('utf-8')
+    if gzip:
+        # nginx must not serve the old one while it is compressed
+        remove_file(fpath + '.gz')
+    atomic_write(fpath, content)
+    metacache.invalidate(fpath)
+    if gzip:
+        _background(gzip_file, fpath)
+    return data
+
+
+def truncate(fpath):
+    atomic_write(fpath, '')
+    metacache.invalidate(fpath)
+
+
+def _append(fpath, data):
+    directory = os.path.dirname(fpath)
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    line = json.dumps(serialize(data))
+    if isinstance(line, unicode):
+        line = line.encode('utf-8')
+    with open(fpath, 'ab') as f:
+        f.write(line + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+    metacache.invalidate(fpath)
+
+
+def _background(func, *args):
+    # gevent workers compress the file after the response is sent
+    if monkey.is_module_patched('socket'):
+        gevent.spawn(func, *args)
+    else:
+        func(*args)
+
+
+def _parse_line(line):
+    try:
+        return json.loads(line)
+    except ValueError:
+        return None
+
+
+def _bisect_log(f, since):
+    """Find an offset of the changes log, that every change before it
+    has a sequence not greater than ``since``.
+    """
+    f.seek(0, os.SEEK_END)
+    lo, hi = 0, f.tell()
+    while hi - lo > 8192:
+        mid = (lo + hi) // 2
+        f.seek(mid)
+        # skip the line that mid is in
+        f.readline()
+        change = _parse_line(f.readline())
+        if not change or change['seq'] > since:
+            hi = mid
+        else:
+            lo = mid
+    if lo:
+        # lo is in a line of an older change
+        f.seek(lo)
+        f.readline()
+        return f.tell()
+    return 0
+
+
+def _replay(data, log):
+    projects = dict((o['name'], o) for o in data)
+    for entry in log:
+        if entry['op'] == 'delete':
+            projects.pop(entry['name'], None)
+        else:
+            projects[entry['name']] = entry['project']
+
+    # ISO 8601 time strings sort in the order of time
+    return sorted(
+        projects.values(),
+        key=lambda o: o.get('updated_at', ''),
+        reverse=True
+    )
@@ -0,0 +1,232 @@
+# coding: utf-8
+
+
+class DependentsIndex(object):
+    """Reverse dependencies of packages kept in sets, for the storages
+    without an indexed table. It is the dependency graph of the functions
+    below, a graph of other storages has the same ``*_keys``,
+    ``project_dependents``, ``target_projects`` and ``update`` methods.
+    """
+
+    def __init__(self):
+        #: package -> frozenset of the packages it depends on
+        self.sources = {}
+        #: package -> set of the packages depend on it
+        self.targets = {}
+        #: project -> set of its versions that have dependents
+        self.versions = {}
+        #: project -> transitive dependents count
+        self.counts = {}
+        self._sorted = {}
+
+    def update(self, key, dependencies):
+        dependencies = frozenset(dependencies)
+        previous = self.sources.pop(key, frozenset())
+        if dependencies:
+            self.sources[key] = dependencies
+        for dep in previous - dependencies:
+            packages = self.targets[dep]
+            packages.discard(key)
+            if not packages:
+                del self.targets[dep]
+                versions = self.versions[dep[:2]]
+                versions.discard(dep[2])
+                if not versions:
+                    del self.versions[dep[:2]]
+            self._sorted.pop(dep, None)
+        for dep in dependencies - previous:
+            if dep not in self.targets:
+                self.targets[dep] = set()
+                self.versions.setdefault(dep[:2], set()).add(dep[2])
+            self.targets[dep].add(key)
+            self._sorted.pop(dep, None)
+
+    def set_counts(self, counts):
+        for project in counts:
+            if counts[project]:
+                self.counts[project] = counts[project]
+            else:
+                self.counts.pop(project, None)
+
+    def dependencies(self, key):
+        return self.sources.get(key, frozenset())
+
+    def dependents(self, key, offset=0, limit=None):
+        # sorted once, pages of a popular package are cheap then
+        if key not in self._sorted:
+            self._sorted[key] = sorted(self.targets.get(key, ()))
+        packages = self._sorted[key]
+        if limit is None:
+            packages = packages[offset:]
+        else:
+            packages = packages[offset:offset + limit]
+        return ['%s/%s@%s' % o for o in packages]
+
+    def count(self, key):
+        return len(self.targets.get(key, ()))
+
+    def dependency_keys(self, key):
+        return self.sources.get(key, ())
+
+    def dependent_keys(self, key):
+        return self.targets.get(key, ())
+
+    def project_dependents(self, project):
+        keys = set()
+        for version in self.versions.get(project, ()):
+            keys.update(self.targets[project + (version,)])
+        return keys
+
+    def target_projects(self):
+        return list(self.versions)
+
+
+def reach(graph, keys):
+    """Projects of the packages ``keys`` and the packages they depend on,
+    directly or not.
+    """
+    seen = set(keys)
+    stack = list(seen)
+    while stack:
+        for dep in graph.dependency_keys(stack.pop()):
+            if dep not in seen:
+                seen.add(dep)
+                stack.append(dep)
+    return set(key[:2] for key in seen)
+
+
+def count_transitive(graph, project):
+    """The transitive dependents count of a project, how many packages
+    reach it through any path. Packages of the project are not counted.
+    """
+    seen = set()
+    stack = list(graph.project_dependents(project))
+    seen.update(stack)
+    while stack:
+        for key in graph.dependent_keys(stack.pop()):
+            if key not in seen:
+                seen.add(key)
+                stack.append(key)
+    return len([o for o in seen if o[:2] != project])
+
+
+def count_all(graph):
+    """The counts of every project with dependents."""
+    counts = {}
+    for project in graph.target_projects():
+        count = count_transitive(graph, project)
+        if count:
+            counts[project] = count
+    return counts
+
+
+def update_transitive(graph, counts, key, dependencies):
+    """Replace the dependencies of the package ``key`` in the graph, and
+    return the new counts of the projects changed by it.
+
+    Only the projects the package reaches before or after the update,
+    but not both, may change, and only for the package and the packages
+    reach it. Such a package is moved in or out of the count of a project,
+    unless it reaches the project without the package. ``counts`` is
+    called with a project for its current count.
+    """
+    project = key[:2]
+    before = reach(graph, graph.dependency_keys(key))
+    graph.update(key, dependencies)
+    after = reach(graph, dependencies)
+
+    changed = (before ^ after) - set([project])
+    if not changed:
+        return {}
+
+    ancestors = set([key])
+    stack = [key]
+    while stack:
+        for o in graph.dependent_keys(stack.pop()):
+            if o not in ancestors:
+                ancestors.add(o)
+                stack.append(o)
+
+    # a new package has no ancestors, it is moved in or out of them all
+    reached = _reach_changed(graph, ancestors, changed, key)
+    groups = {}
+    for o in ancestors:
+        group = (o[:2], reached[o])
+        groups[group] = groups.get(group, 0) + 1
+
+    rv = {}
+    for o in changed:
+        delta = 0
+        for (p, projects), count in groups.iteritems():
+            if p != o and o not in projects:
+                delta += count
+        if o in after:
+            rv[o] = counts(o) + delta
+        else:
+            rv[o] = counts(o) - delta
+    return rv
+
+
+def _reach_changed(graph, roots, changed, skip):
+    """The changed projects every package reaches, not through the
+    dependencies of ``skip``. Packages in a cycle share the result of
+    their strongly connected component, found with Tarjan's algorithm.
+    """
+    found = {}
+    successors = {}
+    shared = {}
+
+    def deps(v):
+        if v not in successors:
+            successors[v] = () if v == skip else graph.dependency_keys(v)
+        return successors[v]
+
+    index = {}
+    low = {}
+    stack = []
+    onstack = set()
+    for root in roots:
+        if root in found:
+            continue
+        index[root] = low[root] = len(index)
+        stack.append(root)
+        onstack.add(root)
+        work = [(root, iter(deps(root)))]
+        while work:
+            v, it = work[-1]
+            for w in it:
+                if w in found:
+                    continue
+                if w not in index:
+                    index[w] = low[w] = len(index)
+                    stack.append(w)
+                    onstack.add(w)
+                    work.append((w, iter(deps(w))))
+                    break
+                if w in onstack:
+                    low[v] = min(low[v], index[w])
+            else:
+                work.pop()
+                if work:
+                    u = work[-1][0]
+                    low[u] = min(low[u], low[v])
+                if low[v] != index[v]:
+                    continue
+                component = []
+                while True:
+                    w = stack.pop()
+                    onstack.discard(w)
+                    component.append(w)
+                    if w == v:
+                        break
+                projects = set(o[:2] for o in component) & changed
+                for o in component:
+                    for w in deps(o):
+                        if w in found:
+                            projects |= found[w]
+                projects = frozenset(projects)
+                # most packages reach the same projects
+                projects = shared.setdefault(projects, projects)
+                for o in component:
+                    found[o] = projects
+    return found
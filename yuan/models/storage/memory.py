@@ -0,0 +1,121 @@
+# coding: utf-8
+
+import threading
+from ..cache import _copy
+from ..record import serialize
+from . import Storage, DependentsIndex, group_downloads, add_downloads
+from .graph import update_transitive, count_all
+
+
+class MemoryStorage(Storage):
+    """Keep metadata in a dict of the process, designed for testing."""
+
+    def __init__(self):
+        self._data = {}
+        self._changes = []
+        self._dependents = DependentsIndex()
+        self._downloads = {}
+        self._lock = threading.RLock()
+
+    def read(self, key):
+        data = self._data.get(tuple(key))
+        if data is None:
+            return None
+        return _copy(data)
+
+    def write(self, key, data):
+        self._data[tuple(key)] = _copy(serialize(data))
+        return data
+
+    def delete(self, key):
+        key = tuple(key)
+        if len(key) == 2:
+            self._downloads.pop(key, None)
+        for k in self._data.keys():
+            if k[:len(key)] == key:
+                del self._data[k]
+
+    def walk(self):
+        return sorted(k for k in self._data if len(k) == 2)
+
+    def families(self):
+        return sorted(set(k[0] for k in self.walk()))
+
+    def projects(self, family):
+        data = []
+        for key in self.walk():
+            if key[0] == family:
+                project = self.read(key)
+                project.pop('packages', None)
+                data.append(project)
+        return sorted(
+            data, key=lambda o: o.get('updated_at', ''), reverse=True
+        )
+
+    def manifest(self):
+        return self.build_manifest()
+
+    def index(self, project, operation):
+        if operation == 'delete':
+            self.delete((project['family'], project['name']))
+
+    def record_change(self, change):
+        with self._lock:
+            change = dict(change, seq=len(self._changes) + 1)
+            self._changes.append(change)
+            return change['seq']
+
+    def changes(self, since=0, limit=100):
+        return [dict(o) for o in self._changes[since:since + limit]]
+
+    def last_seq(self):
+        return len(self._changes)
+
+    def dependents(self, family, name, version, offset=0, limit=None):
+        return self._dependents.dependents(
+            (family, name, version), offset, limit
+        )
+
+    def count_dependents(self, family, name, version):
+        return self._dependents.count((family, name, version))
+
+    def set_dependencies(self, key, dependencies):
+        with self._lock:
+            index = self._dependents
+            counts = update_transitive(
+                index, lambda o: index.counts.get(o, 0),
+                tuple(key), set(map(tuple, dependencies))
+            )
+            index.set_counts(counts)
+            return counts
+
+    def rebuild_dependents(self, dependencies):
+        index = DependentsIndex()
+        for key in dependencies:
+            index.update(tuple(key), map(tuple, dependencies[key]))
+        index.counts = count_all(index)
+        self._dependents = index
+
+    def transitive_dependents(self, family, name):
+        return self._dependents.counts.get((family, name), 0)
+
+    def transitive_counts(self):
+        counts = self._dependents.counts
+        return dict(('%s/%s' % o, counts[o]) for o in counts)
+
+    def add_downloads(self, counts):
+        projects = group_downloads(counts)
+        with self._lock:
+            for key in projects:
+                self._downloads[key] = add_downloads(
+                    self._downloads.get(key), projects[key]
+                )
+
+    def downloads(self, family, name):
+        data = self._downloads.get((family, name))
+        if data is None:
+            return {'total': 0, 'versions': {}}
+        return _copy(data)
+
+    def lock(self, *names):
+        return self._lock
@@ -0,0 +1,400 @@
+# coding: utf-8
+
+import os
+import sqlite3
+import threading
+try:
+    import ujson as json
+except ImportError:
+    from flask import json
+from ..record import serialize
+from . import Storage, add_downloads
+from .graph import update_transitive, count_all
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS project (
+    family TEXT NOT NULL,
+    name TEXT NOT NULL,
+    version TEXT,
+    created_at TEXT,
+    updated_at TEXT,
+    data TEXT NOT NULL,
+    PRIMARY KEY (family, name)
+);
+CREATE INDEX IF NOT EXISTS project_updated ON project (family, updated_at);
+CREATE INDEX IF NOT EXISTS project_created ON project (created_at);
+
+CREATE TABLE IF NOT EXISTS package (
+    family TEXT NOT NULL,
+    name TEXT NOT NULL,
+    version TEXT NOT NULL,
+    tag TEXT,
+    created_at TEXT,
+    updated_at TEXT,
+    summary TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (family, name, version)
+);
+CREATE INDEX IF NOT EXISTS package_tag ON package (family, name, tag);
+
+CREATE TABLE IF NOT EXISTS dependency (
+    family TEXT NOT NULL,
+    name TEXT NOT NULL,
+    version TEXT NOT NULL,
+    dep_family TEXT NOT NULL,
+    dep_name TEXT NOT NULL,
+    dep_version TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS dependency_source
+    ON dependency (family, name, version);
+CREATE INDEX IF NOT EXISTS dependency_target
+    ON dependency (dep_family, dep_name, dep_version);
+
+CREATE TABLE IF NOT EXISTS transitive (
+    family TEXT NOT NULL,
+    name TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (family, name)
+);
+
+CREATE TABLE IF NOT EXISTS download (
+    family TEXT NOT NULL,
+    name TEXT NOT NULL,
+    version TEXT NOT NULL,
+    day TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (family, name, version, day)
+);
+
+CREATE TABLE IF NOT EXISTS change (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    data TEXT NOT NULL
+);
+"""
+
+
+class SQLiteStorage(Storage):
+    """Store metadata in a SQLite database.
+
+    Packages of a project are rows of the package table, they are not
+    rewritten with the project document. The reverse dependency index is
+    an indexed table of dependencies, the transitive dependents counts
+    are kept in a table of their own.
+    """
+
+    def __init__(self, database, root):
+        self.database = database
+        self.lockdir = os.path.join(root, '.locks')
+        self._local = threading.local()
+
+        directory = os.path.dirname(os.path.abspath(database))
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        with self.connection as conn:
+            conn.executescript(SCHEMA)
+
+    @property
+    def connection(self):
+        # a connection can not be shared by threads or forked processes
+        pid = os.getpid()
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != pid:
+            conn = sqlite3.connect(self.database, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+            self._local.pid = pid
+        return conn
+
+    def read(self, key):
+        conn = self.connection
+        if len(key) == 3:
+            row = conn.execute(
+                'SELECT data FROM package '
+                'WHERE family=? AND name=? AND version=?', key
+            ).fetchone()
+            if not row:
+                return None
+            return json.loads(row[0])
+
+        row = conn.execute(
+            'SELECT data FROM project WHERE family=? AND name=?', key
+        ).fetchone()
+        if not row:
+            return None
+        data = json.loads(row[0])
+        rows = conn.execute(
+            'SELECT version, summary FROM package WHERE family=? AND name=?',
+            key
+        )
+        packages = dict((v, json.loads(summary)) for v, summary in rows)
+        if packages:
+            data['packages'] = packages
+        return data
+
+    def write(self, key, data):
+        if len(key) == 3:
+            return self._write_package(key, data)
+
+        dct = serialize(data)
+        dct.pop('packages', None)
+        with self.connection as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO project '
+                '(family, name, version, created_at, updated_at, data) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                key + (
+                    dct.get('version'), dct.get('created_at'),
+                    dct.get('updated_at'), json.dumps(dct),
+                )
+            )
+        return data
+
+    def _write_package(self, key, data):
+        data = serialize(data)
+        summary = dict(data)
+        summary.pop('readme', None)
+
+        with self.connection as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO package '
+                '(family, name, version, tag, created_at, updated_at, '
+                'summary, data) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                key + (
+                    data.get('tag'), data.get('created_at'),
+                    data.get('updated_at'),
+                    json.dumps(summary), json.dumps(data),
+                )
+            )
+        return data
+
+    def delete(self, key):
+        if len(key) == 3:
+            where = 'WHERE family=? AND name=? AND version=?'
+        else:
+            where = 'WHERE family=? AND name=?'
+
+        with self.connection as conn:
+            if len(key) == 2:
+                conn.execute('DELETE FROM project %s' % where, key)
+                conn.execute('DELETE FROM download %s' % where, key)
+            conn.execute('DELETE FROM package %s' % where, key)
+
+    def walk(self):
+        rows = self.connection.execute(
+            'SELECT family, name FROM project ORDER BY family, name'
+        )
+        return [tuple(row) for row in rows]
+
+    def families(self):
+        rows = self.connection.execute(
+            'SELECT DISTINCT family FROM project ORDER BY family'
+        )
+        return [row[0] for row in rows]
+
+    def projects(self, family):
+        rows = self.connection.execute(
+            'SELECT data FROM project WHERE family=? '
+            'ORDER BY updated_at DESC', (family,)
+        )
+        return [json.loads(row[0]) for row in rows]
+
+    def manifest(self):
+        rows = self.connection.execute(
+            'SELECT family, name, version, created_at, updated_at '
+            'FROM project'
+        )
+        manifest = {}
+        for family, name, version, created_at, updated_at in rows:
+            dct = {'family': family, 'name': name}
+            if version:
+                dct['version'] = version
+            if created_at:
+                dct['created_at'] = created_at
+            if updated_at:
+                dct['updated_at'] = updated_at
+            manifest['%s/%s' % (family, name)] = dct
+        return manifest
+
+    def names(self):
+        rows = self.connection.execute(
+            'SELECT family, name FROM project ORDER BY created_at DESC'
+        )
+        return ['%s/%s' % tuple(row) for row in rows]
+
+    def index(self, project, operation):
+        if operation == 'delete':
+            self.delete((project['family'], project['name']))
+
+    def record_change(self, change):
+        with self.connection as conn:
+            cursor = conn.execute(
+                'INSERT INTO change (data) VALUES (?)',
+                (json.dumps(change),)
+            )
+            return cursor.lastrowid
+
+    def changes(self, since=0, limit=100):
+        rows = self.connection.execute(
+            'SELECT seq, data FROM change WHERE seq > ? '
+            'ORDER BY seq LIMIT ?', (since, limit)
+        )
+        results = []
+        for seq, data in rows:
+            change = json.loads(data)
+            change['seq'] = seq
+            results.append(change)
+        return results
+
+    def last_seq(self):
+        row = self.connection.execute('SELECT MAX(seq) FROM change').fetchone()
+        return row[0] or 0
+
+    def latest(self, family, name):
+        row = self.connection.execute(
+            'SELECT version FROM project WHERE family=? AND name=?',
+            (family, name)
+        ).fetchone()
+        if row:
+            return row[0]
+        return None
+
+    def dependents(self, family, name, version, offset=0, limit=None):
+        rows = self.connection.execute(
+            'SELECT family, name, version FROM dependency '
+            'WHERE dep_family=? AND dep_name=? AND dep_version=? '
+            'ORDER BY family, name, version LIMIT ? OFFSET ?',
+            (family, name, version, -1 if limit is None else limit, offset)
+        )
+        return ['%s/%s@%s' % tuple(row) for row in rows]
+
+    def count_dependents(self, family, name, version):
+        row = self.connection.execute(
+            'SELECT COUNT(*) FROM dependency '
+            'WHERE dep_family=? AND dep_name=? AND dep_version=?',
+            (family, name, version)
+        ).fetchone()
+        return row[0]
+
+    def set_dependencies(self, key, dependencies):
+        key = tuple(key)
+        dependencies = set(map(tuple, dependencies))
+        with self.lock('dependents'), self.connection as conn:
+            graph = _Graph(conn)
+            if set(graph.dependency_keys(key)) == dependencies:
+                return {}
+            counts = update_transitive(
+                graph, lambda o: _count(conn, o), key, dependencies
+            )
+            _write_counts(conn, counts)
+        return counts
+
+    def rebuild_dependents(self, dependencies):
+        rows = []
+        for key in dependencies:
+            for dep in set(map(tuple, dependencies[key])):
+                rows.append(tuple(key) + dep)
+        with self.lock('dependents'), self.connection as conn:
+            conn.execute('DELETE FROM dependency')
+            conn.executemany(
+                'INSERT INTO dependency VALUES (?, ?, ?, ?, ?, ?)', rows
+            )
+            conn.execute('DELETE FROM transitive')
+            _write_counts(conn, count_all(_Graph(conn)))
+
+    def transitive_dependents(self, family, name):
+        return _count(self.connection, (family, name))
+
+    def transitive_counts(self):
+        rows = self.connection.execute(
+            'SELECT family, name, count FROM transitive'
+        )
+        return dict(('%s/%s' % (f, n), c) for f, n, c in rows)
+
+    def add_downloads(self, counts):
+        with self.connection as conn:
+            for key in counts:
+                key = tuple(key)
+                conn.execute(
+                    'INSERT OR IGNORE INTO download VALUES (?, ?, ?, ?, 0)',
+                    key
+                )
+                conn.execute(
+                    'UPDATE download SET count=count+? WHERE family=? '
+                    'AND name=? AND version=? AND day=?',
+                    (counts[key],) + key
+                )
+
+    def downloads(self, family, name):
+        rows = self.connection.execute(
+            'SELECT version, day, count FROM download '
+            'WHERE family=? AND name=?', (family, name)
+        )
+        return add_downloads(None, dict(((v, d), c) for v, d, c in rows))
+
+
+class _Graph(object):
+    """The dependency graph of the functions in :mod:`.graph`, queried in
+    the transaction of the connection.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def dependency_keys(self, key):
+        rows = self.conn.execute(
+            'SELECT dep_family, dep_name, dep_version FROM dependency '
+            'WHERE family=? AND name=? AND version=?', key
+        )
+        return [tuple(row) for row in rows]
+
+    def dependent_keys(self, key):
+        rows = self.conn.execute(
+            'SELECT family, name, version FROM dependency '
+            'WHERE dep_family=? AND dep_name=? AND dep_version=?', key
+        )
+        return [tuple(row) for row in rows]
+
+    def project_dependents(self, project):
+        rows = self.conn.execute(
+            'SELECT family, name, version FROM dependency '
+            'WHERE dep_family=? AND dep_name=?', project
+        )
+        return [tuple(row) for row in rows]
+
+    def target_projects(self):
+        rows = self.conn.execute(
+            'SELECT DISTINCT dep_family, dep_name FROM dependency'
+        )
+        return [tuple(row) for row in rows]
+
+    def update(self, key, dependencies):
+        self.conn.execute(
+            'DELETE FROM dependency '
+            'WHERE family=? AND name=? AND version=?', key
+        )
+        self.conn.executemany(
+            'INSERT INTO dependency VALUES (?, ?, ?, ?, ?, ?)',
+            [key + dep for dep in dependencies]
+        )
+
+
+def _count(conn, project):
+    row = conn.execute(
+        'SELECT count FROM transitive WHERE family=? AND name=?', project
+    ).fetchone()
+    if row:
+        return row[0]
+    return 0
+
+
+def _write_counts(conn, counts):
+    for project in counts:
+        if counts[project]:
+            conn.execute(
+                'INSERT OR REPLACE INTO transitive VALUES (?, ?, ?)',
+                project + (counts[project],)
+            )
+        else:
+            conn.execute(
+                'DELETE FROM transitive WHERE family=? AND name=?', project
+            )
@@ -0,0 +1,285 @@
+# coding: utf-8
+
+import os
+import zlib
+import hashlib
+import tarfile
+import threading
+from collections import OrderedDict
+from flask import current_app, json
+from .cache import metacache
+from .fileio import atomic_write
+
+__all__ = [
+    'TarballIndex', 'index_tarball', 'save_files', 'package_files',
+    'read_member',
+]
+
+CHUNK_SIZE = 64 * 1024
+BLOCKSIZE = tarfile.BLOCKSIZE
+
+# decompressor snapshots of so many tarballs are kept in every worker
+SNAPSHOT_CACHE_SIZE = 32
+
+
+class TarballIndex(object):
+    """Index a gzipped tarball in a single pass, as it is written.
+
+    Every regular file is recorded with its path, size, mode, sha256 and
+    the offset of its data in the uncompressed stream. A checkpoint
+    ``[compressed, uncompressed]`` is recorded every ``interval``
+    uncompressed bytes, reading a file starts from the nearest one.
+    """
+
+    def __init__(self, interval=None):
+        if interval is None:
+            interval = current_app.config.get(
+                'TARBALL_CHECKPOINT_INTERVAL', 1024 * 1024
+            )
+        self.interval = interval
+        self.files = []
+        self.checkpoints = [[0, 0]]
+        self.compressed = 0
+        self.size = 0
+        self.md5 = hashlib.md5()
+        self.error = None
+
+        self._z = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self._buf = b''
+        self._pos = 0
+        self._state = None
+        self._info = None
+        self._hash = None
+        self._offset = 0
+        self._remaining = 0
+        self._skip = 0
+        self._name = None
+        self._eof = False
+
+    def update(self, chunk):
+        self.md5.update(chunk)
+        if self.error or self._eof:
+            return
+        try:
+            data = self._z.decompress(chunk)
+        except zlib.error as e:
+            self.error = str(e)
+            return
+        self.compressed += len(chunk)
+        self.size += len(data)
+        if self.size - self.checkpoints[-1][1] >= self.interval:
+            self.checkpoints.append([self.compressed, self.size])
+
+        self._buf = self._buf[self._pos:] + data
+        self._pos = 0
+        try:
+            self._parse()
+        except tarfile.HeaderError as e:
+            self.error = str(e)
+
+    def result(self):
+        """The index, or None if the tarball is not a complete tarball."""
+        if self.error or self._state or not self.compressed:
+            return None
+        return {
+            'md5': self.md5.hexdigest(),
+            'files': self.files,
+            'checkpoints': self.checkpoints,
+        }
+
+    def _parse(self):
+        while not self._eof:
+            available = len(self._buf) - self._pos
+            if self._skip:
+                n = min(self._skip, available)
+                self._pos += n
+                self._skip -= n
+                if self._skip:
+                    return
+            elif self._state == 'data':
+                n = min(self._remaining, available)
+                if n:
+                    if self._hash:
+                        self._hash.update(self._buf[self._pos:self._pos + n])
+                    self._pos += n
+                    self._remaining -= n
+                if self._remaining:
+                    return
+                self._finish()
+            elif self._state == 'extended':
+                size = self._info.size
+                if available < _block(size):
+                    return
+                data = self._buf[self._pos:self._pos + size]
+                self._pos += _block(size)
+                self._extend(self._info, data)
+                self._state = None
+            else:
+                if available < BLOCKSIZE:
+                    return
+                buf = self._buf[self._pos:self._pos + BLOCKSIZE]
+                self._pos += BLOCKSIZE
+                try:
+                    info = tarfile.TarInfo.frombuf(buf)
+                except tarfile.EOFHeaderError:
+                    self._eof = True
+                    return
+                self._start(info)
+
+    def _start(self, info):
+        self._info = info
+        if info.type in (tarfile.GNUTYPE_LONGNAME, tarfile.XHDTYPE):
+            self._state = 'extended'
+            return
+
+        self._state = 'data'
+        if info.type in (tarfile.GNUTYPE_LONGLINK, tarfile.XGLTYPE):
+            # not recorded, the data is skipped
+            pass
+        else:
+            if self._name is not None:
+                info.name = self._name
+                self._name = None
+            if info.isfile():
+                self._hash = hashlib.sha256()
+        self._offset = self.size - len(self._buf) + self._pos
+        self._remaining = info.size
+        self._skip = 0
+
+    def _finish(self):
+        info = self._info
+        if self._hash:
+            path = '/'.join(o for o in info.name.split('/') if o and o != '.')
+            self.files.append({
+                'path': path,
+                'size': info.size,
+                'mode': info.mode,
+                'sha256': self._hash.hexdigest(),
+                'offset': self._offset,
+            })
+        self._skip = _block(info.size) - info.size
+        self._state = None
+        self._info = None
+        self._hash = None
+
+    def _extend(self, info, data):
+        if info.type == tarfile.GNUTYPE_LONGNAME:
+            self._name = tarfile.nts(data)
+            return
+        # records of a pax header look like "%d %s=%s\n"
+        pos = 0
+        while pos < len(data):
+            length = data[pos:].split(' ', 1)[0]
+            if not length.isdigit() or not int(length):
+                break
+            record = data[pos:pos + int(length)]
+            keyword, _, value = record.partition(' ')[2].partition('=')
+            if keyword == 'path':
+                self._name = value[:-1]
+            pos += int(length)
+
+
+def index_tarball(fpath, interval=None):
+    """Index the tarball of ``fpath``, return None if it is not readable."""
+    index = TarballIndex(interval)
+    with open(fpath, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            index.update(chunk)
+    return index.result()
+
+
+def save_files(package, index):
+    fpath = os.path.join(os.path.dirname(package.datafile), 'files.json')
+    atomic_write(fpath, json.dumps(index))
+
+
+def package_files(package):
+    """The index of the package tarball. It is built when it is missing,
+    or it is not of the current tarball.
+    """
+    directory = os.path.dirname(package.datafile)
+    fpath = os.path.join(directory, 'files.json')
+    index = metacache.get(fpath, _load_json)
+    if index and index['md5'] == package.md5:
+        return index
+
+    tarball = os.path.join(directory, package.filename)
+    if not os.path.exists(tarball):
+        return None
+    index = index_tarball(tarball)
+    if index:
+        save_files(package, index)
+    return index
+
+
+def read_member(tarball, entry, checkpoints):
+    """Generate the data of a file in the index.
+
+    Decompressing starts from the nearest checkpoint before the file.
+    A gzip stream can not be resumed at an arbitrary position with the
+    zlib module, so the checkpoints are snapshots of the decompressor,
+    taken in memory when they are passed for the first time.
+    """
+    st = os.stat(tarball)
+    snapshots = _snapshots((tarball, st.st_mtime, st.st_size))
+
+    start = entry['offset']
+    end = start + entry['size']
+    compressed, offset, z = 0, 0, None
+    for c, u in checkpoints:
+        if u > start:
+            break
+        if c in snapshots:
+            compressed, offset, z = c, u, snapshots[c]
+    if z is None:
+        z = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    else:
+        z = z.copy()
+    marks = [c for c, u in checkpoints if compressed < c and u <= start]
+
+    with open(tarball, 'rb') as f:
+        f.seek(compressed)
+        while offset < end:
+            size = CHUNK_SIZE
+            if marks:
+                size = min(size, marks[0] - compressed)
+            chunk = f.read(size)
+            if not chunk:
+                raise IOError('tarball is truncated')
+            data = z.decompress(chunk)
+            compressed += len(chunk)
+            if marks and compressed == marks[0]:
+                snapshots[marks.pop(0)] = z.copy()
+
+            lo = max(start - offset, 0)
+            hi = min(end - offset, len(data))
+            if lo < hi:
+                yield data[lo:hi]
+            offset += len(data)
+
+
+_snapshot_cache = OrderedDict()
+_snapshot_lock = threading.Lock()
+
+
+def _snapshots(key):
+    with _snapshot_lock:
+        snapshots = _snapshot_cache.pop(key, None)
+        if snapshots is None:
+            snapshots = {}
+        _snapshot_cache[key] = snapshots
+        while len(_snapshot_cache) > SNAPSHOT_CACHE_SIZE:
+            _snapshot_cache.popitem(last=False)
+        return snapshots
+
+
+def _block(size):
+    blocks, remainder = divmod(size, BLOCKSIZE)
+    if remainder:
+        blocks += 1
+    return blocks * BLOCKSIZE
+
+
+def _load_json(fpath):
+    with open(fpath) as f:
+        return json.load(f)
@@ -0,0 +1,203 @@
+# coding: utf-8
+
+import os
+import re
+import time
+import errno
+import uuid
+import shutil
+import hashlib
+import tempfile
+from datetime import datetime
+from flask import current_app, json
+from .fileio import file_lock, atomic_write
+
+__all__ = ['UploadSession', 'collect_uploads']
+
+CHUNK_SIZE = 64 * 1024
+
+# chunks larger than this are received in a temporary file
+SPOOL_SIZE = 1024 * 1024
+
+_id = re.compile(r'^[0-9a-f]{32}$')
+
+
+class UploadSession(dict):
+    """A resumable upload of a tarball.
+
+    A session is a directory in ``WWW_ROOT/.uploads``. Chunks are
+    written at their offsets into a single data file, which is renamed
+    to the tarball when the upload is committed::
+
+        .uploads/{id}/session.json      the session and received chunks
+        .uploads/{id}/data              the tarball
+    """
+
+    def __getattr__(self, key):
+        try:
+            return self[key]
+        except KeyError:
+            return None
+
+    @classmethod
+    def create(cls, **kwargs):
+        session = cls(kwargs)
+        session['id'] = uuid.uuid4().hex
+        session['chunks'] = {}
+        session['created_at'] = datetime.utcnow().strftime(
+            '%Y-%m-%dT%H:%M:%SZ'
+        )
+        os.makedirs(session.directory)
+        with open(session.datafile, 'wb') as f:
+            f.truncate(session.size)
+        session.save()
+        return session
+
+    @classmethod
+    def load(cls, id):
+        if not _id.match(id):
+            return None
+        fpath = os.path.join(_root(), id, 'session.json')
+        if not os.path.exists(fpath):
+            return None
+        with open(fpath) as f:
+            return cls(json.load(f))
+
+    @property
+    def directory(self):
+        return os.path.join(_root(), self.id)
+
+    @property
+    def datafile(self):
+        return os.path.join(self.directory, 'data')
+
+    def lock(self):
+        return file_lock(os.path.join(self.directory, 'session.lock'))
+
+    def save(self):
+        atomic_write(
+            os.path.join(self.directory, 'session.json'), json.dumps(self)
+        )
+        return self
+
+    def write(self, number, offset, stream, length, md5=None):
+        """Write a chunk read from stream at offset. The chunk is not
+        recorded when it is short or doesn't match md5.
+        """
+        if offset < 0 or offset + length > self.size:
+            raise ValueError('chunk out of range')
+
+        # the chunk is received before taking the lock, a slow client
+        # will not hold the other chunks and the commit
+        buf = _receive(stream, length, md5)
+        try:
+            with self.lock():
+                # the data file is renamed to the tarball when committed,
+                # the session is loaded again before it is written
+                current = UploadSession.load(self.id)
+                if current is None:
+                    raise ValueError('upload is committed or deleted')
+                try:
+                    with open(self.datafile, 'r+b') as f:
+                        f.seek(offset)
+                        shutil.copyfileobj(buf, f, CHUNK_SIZE)
+                        f.flush()
+                        os.fsync(f.fileno())
+                except IOError as e:
+                    if e.errno != errno.ENOENT:
+                        raise
+                    raise ValueError('upload is committed or deleted')
+
+                # other chunks may be recorded by other requests
+                self.update(current)
+                self['chunks'][str(number)] = [offset, length]
+                return self.save()
+        finally:
+            buf.close()
+
+    def missing(self):
+        """Ranges ``[start, end)`` of the data that are not received."""
+        rv = []
+        position = 0
+        for offset, length in sorted(self['chunks'].values()):
+            if offset > position:
+                rv.append([position, offset])
+            position = max(position, offset + length)
+        if position < self.size:
+            rv.append([position, self.size])
+        return rv
+
+    def progress(self):
+        missing = self.missing()
+        return {
+            'id': self.id,
+            'size': self.size,
+            'received': self.size - sum(end - start for start, end in missing),
+            'chunks': self['chunks'],
+            'missing': missing,
+        }
+
+    def checksum(self):
+        """The md5 and sha256 of the data."""
+        md5 = hashlib.md5()
+        sha256 = hashlib.sha256()
+        with open(self.datafile, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                md5.update(chunk)
+                sha256.update(chunk)
+        return md5.hexdigest(), sha256.hexdigest()
+
+    def delete(self):
+        if os.path.exists(self.directory):
+            shutil.rmtree(self.directory)
+
+
+def collect_uploads(expires=None):
+    """Remove sessions that are not changed in ``expires`` seconds."""
+    if expires is None:
+        expires = current_app.config.get('UPLOAD_EXPIRES', 24 * 3600)
+    root = _root()
+    if not os.path.exists(root):
+        return 0
+
+    count = 0
+    deadline = time.time() - expires
+    for name in os.listdir(root):
+        directory = os.path.join(root, name)
+        fpath = os.path.join(directory, 'session.json')
+        try:
+            if os.path.getmtime(fpath) > deadline:
+                continue
+        except OSError:
+            # a session being created has no session.json yet
+            if os.path.getmtime(directory) > deadline:
+                continue
+        shutil.rmtree(directory, ignore_errors=True)
+        count += 1
+    return count
+
+
+def _receive(stream, length, md5=None):
+    m = hashlib.md5()
+    received = 0
+    buf = tempfile.SpooledTemporaryFile(SPOOL_SIZE)
+    while received < length:
+        chunk = stream.read(min(CHUNK_SIZE, length - received))
+        if not chunk:
+            break
+        received += len(chunk)
+        m.update(chunk)
+        buf.write(chunk)
+
+    if received != length:
+        buf.close()
+        raise ValueError('chunk is incomplete')
+    if md5 and md5 != m.hexdigest():
+        buf.close()
+        raise ValueError('chunk md5 does not match')
+    buf.seek(0)
+    return buf
+
+
+def _root():
+    return os.path.join(current_app.config['WWW_ROOT'], '.uploads')
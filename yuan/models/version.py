@@ -0,0 +1,94 @@
+# coding: utf-8
+
+import re
+
+__all__ = [
+    'parse_version', 'version_key', 'is_prerelease',
+    'sort_versions', 'insert_version',
+]
+
+# 1.0, 1.0.4, 1.0.4a3 and 1.0.4b1 of StrictVersion
+_strict = re.compile(r'^(\d+)\.(\d+)(?:\.(\d+))?(?:([ab])(\d+))?$')
+
+# 1.0.0, 1.0.0-beta.1 and 1.0.0-rc.1+build.5 of semver
+_semver = re.compile(
+    r'^(\d+)\.(\d+)\.(\d+)'
+    r'(?:-([0-9A-Za-z-]+(?:\.[0-9A-Za-z-]+)*))?'
+    r'(?:\+[0-9A-Za-z-]+(?:\.[0-9A-Za-z-]+)*)?$'
+)
+
+_cache = {}
+_CACHE_SIZE = 10000
+
+
+def parse_version(version):
+    """Parse a version into a key that sorts in semver precedence.
+
+    A release sorts after its prereleases, numeric prerelease
+    identifiers sort before alphanumeric ones. Raise ValueError on an
+    invalid version.
+    """
+    m = _strict.match(version)
+    if m:
+        major, minor, patch, pre, num = m.groups()
+        if pre:
+            prerelease = ((1, pre), (0, int(num)))
+        else:
+            prerelease = None
+    else:
+        m = _semver.match(version)
+        if not m:
+            raise ValueError('invalid version number %r' % version)
+        major, minor, patch, pre = m.groups()
+        if pre:
+            prerelease = tuple(_identifier(i) for i in pre.split('.'))
+        else:
+            prerelease = None
+
+    release = (int(major), int(minor), int(patch or 0))
+    if prerelease is None:
+        return release + (1, ())
+    return release + (0, prerelease)
+
+
+def version_key(version):
+    """The cached :func:`parse_version`."""
+    try:
+        return _cache[version]
+    except KeyError:
+        pass
+    if len(_cache) >= _CACHE_SIZE:
+        _cache.clear()
+    key = _cache[version] = parse_version(version)
+    return key
+
+
+def is_prerelease(version):
+    return version_key(version)[3] == 0
+
+
+def sort_versions(versions):
+    """Sort versions, the greatest version comes first."""
+    return sorted(versions, key=version_key, reverse=True)
+
+
+def insert_version(versions, version):
+    """Insert a version into a list sorted by :func:`sort_versions`."""
+    if version in versions:
+        return versions
+    key = version_key(version)
+    lo, hi = 0, len(versions)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if version_key(versions[mid]) > key:
+            lo = mid + 1
+        else:
+            hi = mid
+    versions.insert(lo, version)
+    return versions
+
+
+def _identifier(value):
+    if value.isdigit():
+        return (0, int(value))
+    return (1, value)
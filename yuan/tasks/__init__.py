@@ -1,24 +1,28 @@
 import gevent
 from flask import Flask, current_app
-from ..models import project_signal, package_signal, index_project
+from ..models import project_signal, package_signal
+from ..models import index_project, record_change, resolver
+from ..models import rank_project, rank_popular
 from ..elastic import index_project as index_search
 from .assets import extract_assets
-from .dependent import calculate_dependents
+from .dependent import calculate_dependents, remove_dependents
 
 
 def _connect_package(sender, changes):
     package, operation = changes
 
+    def _index():
+        extract_assets(package, operation)
+        rank_popular(calculate_dependents(package, operation))
+
     def _run(config):
         app = Flask('yuan')
         app.config = config
         with app.test_request_context():
-            extract_assets(package, operation)
-            calculate_dependents(package, operation)
+            _index()
 
     if current_app.testing:
-        extract_assets(package, operation)
-        calculate_dependents(package, operation)
+        _index()
     else:
         gevent.spawn(_run, current_app.config)
 
@@ -26,20 +30,47 @@ def _connect_package(sender, changes):
 def _connect_project(sender, changes):
     project, operation = changes
 
+    def _index():
+        index_project(project, operation)
+        if operation == 'delete':
+            rank_popular(remove_dependents(project))
+        rank_project(project, operation)
+
     def _run(config):
         app = Flask('yuan')
         app.config = config
         with app.test_request_context():
             # must index search first.
             index_search(project, operation)
-            index_project(project, operation)
+            _index()
 
     if current_app.testing:
-        index_project(project, operation)
+        _index()
     else:
         gevent.spawn(_run, current_app.config)
 
 
+def _record_package(sender, changes):
+    package, operation = changes
+    record_change('package', package, operation)
+
+
+def _record_project(sender, changes):
+    project, operation = changes
+    record_change('project', project, operation)
+
+
+def _invalidate_resolved(sender, changes):
+    package, operation = changes
+    resolver.invalidate(
+        (package['family'], package['name'], package['version'])
+    )
+
+
 def connect():
+    # changes are recorded in the request, so the feed keeps their order
+    package_signal.connect(_record_package)
+    package_signal.connect(_invalidate_resolved)
+    project_signal.connect(_record_project)
     package_signal.connect(_connect_package)
     project_signal.connect(_connect_project)
@@ -1,9 +1,18 @@
 import os
+import zlib
 import shutil
 import tarfile
 import tempfile
-import werkzeug
+from gevent.threadpool import ThreadPool
 from flask import current_app
+from ..models import store_tree, remove_tree
+from ..models.fileio import gzip_file
+
+# files of these types have a .gz sibling with GZIP_STATIC
+GZIP_TYPES = (
+    '.js', '.css', '.json', '.html', '.htm', '.svg', '.txt', '.map',
+    '.xml', '.tpl', '.md',
+)
 
 
 def extract_assets(package, operation):
@@ -11,9 +20,9 @@ def extract_assets(package, operation):
     if not assets:
         return
 
-    pkgdir = os.path.dirname(package.datafile)
+    dest = os.path.join(assets, package.family, package.name, package.version)
     if operation == 'delete':
-        shutil.rmtree(pkgdir)
+        remove_tree(dest)
         return
 
     if operation != 'upload':
@@ -23,55 +32,161 @@ def extract_assets(package, operation):
         # only extract stable version
         return
 
-    tarball = os.path.join(pkgdir, package.filename)
+    tarball = os.path.join(os.path.dirname(package.datafile), package.filename)
     if not os.path.exists(tarball):
         return
 
+    parent = os.path.dirname(dest)
+    if not os.path.exists(parent):
+        os.makedirs(parent)
+
+    # the staging directory is next to dest, so it can be renamed to dest
+    staging = tempfile.mkdtemp(prefix='.%s.' % package.version, dir=parent)
+    try:
+        rootdir = _extract(tarball, staging)
+        if rootdir:
+            if current_app.config.get('GZIP_STATIC'):
+                gzip_tree(rootdir)
+            # files that are the same in other versions are linked
+            store_tree(rootdir)
+            _swap(rootdir, dest)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+
+def gzip_tree(directory, types=GZIP_TYPES, workers=1):
+    """Compress the files of ``types`` in ``directory``, return the count
+    of the compressed ones. zlib releases the GIL, files are compressed
+    in parallel with a pool of threads of ``workers``.
+    """
+    def _files():
+        for root, dirs, files in os.walk(directory):
+            dirs[:] = [o for o in dirs if not o.startswith('.')]
+            for name in files:
+                if os.path.splitext(name)[1] in types:
+                    yield os.path.join(root, name)
+
+    if workers > 1:
+        pool = ThreadPool(workers)
+        results = pool.imap_unordered(gzip_file, _files())
+    else:
+        results = (gzip_file(o) for o in _files())
+    return len([o for o in results if o])
+
+
+def _extract(tarball, staging):
+    """Extract dist/** and package.json of the tarball into staging in a
+    single pass over the members, other members are skipped. They are
+    written as the assets layout of both the tarball root and the only
+    top directory, return the one that has a dist and a package.json.
+    """
     try:
         tar = tarfile.open(tarball, mode='r:gz')
-    except:
-        return
-
-    filename = '%s-%s' % (
-        package.family, werkzeug.secure_filename(package.filename)
-    )
-    fpath = os.path.join(tempfile.gettempdir(), filename)
-
-    if os.path.exists(fpath):
-        shutil.rmtree(fpath)
+    except (tarfile.TarError, IOError, zlib.error):
+        return None
 
-    def _members(tar):
+    roots = {'': os.path.join(staging, 'root')}
+    tops = set()
+    try:
         for info in tar:
-            if os.path.basename(info.name).startswith('.'):
+            parts = [o for o in info.name.split('/') if o and o != '.']
+            if not parts or '..' in parts:
+                continue
+            if not info.isfile() or parts[-1].startswith('.'):
+                continue
+            top = parts[0]
+            # stray files like .DS_Store or a .git directory beside the
+            # top directory are not counted
+            if not top.startswith('.'):
+                tops.add(top)
+            if os.path.splitext(parts[-1])[1] == '.php':
+                # ignore some danger files
                 continue
-            ext = os.path.splitext(info.name)[1]
-            # ignore some danger files
-            if ext not in ['.php'] and not info.name.startswith('.'):
-                yield info
-
-    tar.extractall(path=fpath, members=_members(tar))
-
-    rootdir = fpath
-    indir = os.listdir(fpath)
 
-    if len(indir) == 1 and os.path.isdir(os.path.join(fpath, indir[0])):
-        rootdir = os.path.join(fpath, indir[0])
+            if top not in roots:
+                roots[top] = os.path.join(staging, 'top', top)
+            targets = []
+            for root, path in ((roots[''], parts), (roots[top], parts[1:])):
+                if path == ['package.json']:
+                    targets.append(os.path.join(root, 'package.json'))
+                elif len(path) > 1 and path[0] == 'dist':
+                    targets.append(os.path.join(root, 'dist', *path[1:]))
+            if targets:
+                _write(tar, info, targets)
+    except (tarfile.TarError, IOError, EOFError, zlib.error):
+        return None
+    finally:
+        tar.close()
+
+    # a tarball of a directory is rooted at the directory
+    if len(tops) == 1 and list(tops)[0] in roots:
+        rootdir = roots[list(tops)[0]]
+    else:
+        rootdir = roots['']
 
     distdir = os.path.join(rootdir, 'dist')
-    if not os.path.exists(distdir):
-        return
     pkgfile = os.path.join(rootdir, 'package.json')
-    if not os.path.exists(pkgfile):
-        return
+    if not os.path.isdir(distdir) or not os.path.isfile(pkgfile):
+        return None
+    os.rename(pkgfile, os.path.join(distdir, 'package.json'))
+    return distdir
+
+
+def extract_member(tarball, filename, fileobj):
+    """Write ``dist/<filename>`` of the tarball into fileobj, it is looked
+    up in the tarball root and its top directories. Return False when the
+    tarball has no such file.
+    """
+    path = [o for o in filename.split('/') if o and o != '.']
+    if not path or '..' in path or path[-1].startswith('.'):
+        return False
+    if os.path.splitext(path[-1])[1] == '.php':
+        return False
+    path = ['dist'] + path
 
-    dest = os.path.join(assets, package.family, package.name, package.version)
-
-    if os.path.exists(dest):
-        shutil.rmtree(dest)
+    try:
+        tar = tarfile.open(tarball, mode='r:gz')
+    except (tarfile.TarError, IOError, zlib.error):
+        return False
 
-    shutil.move(distdir, dest)
-    shutil.move(pkgfile, dest)
     try:
-        shutil.rmtree(fpath)
-    except:
+        for info in tar:
+            parts = [o for o in info.name.split('/') if o and o != '.']
+            if parts != path and parts[1:] != path:
+                continue
+            if not info.isfile():
+                continue
+            shutil.copyfileobj(tar.extractfile(info), fileobj, 64 * 1024)
+            return True
+    except (tarfile.TarError, IOError, EOFError, zlib.error):
+        return False
+    finally:
+        tar.close()
+    return False
+
+
+def _write(tar, info, targets):
+    # the member is read once, other targets are copied from the first
+    for i, fpath in enumerate(targets):
+        directory = os.path.dirname(fpath)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        if i:
+            shutil.copyfile(targets[0], fpath)
+            continue
+        src = tar.extractfile(info)
+        with open(fpath, 'wb') as f:
+            shutil.copyfileobj(src, f, 64 * 1024)
+
+
+def _swap(src, dest):
+    if not os.path.exists(dest):
+        os.rename(src, dest)
         return
+    # the old assets are renamed away, and removed after the swap
+    old = tempfile.mkdtemp(
+        prefix='.%s.' % os.path.basename(dest), dir=os.path.dirname(dest)
+    )
+    os.rename(dest, os.path.join(old, 'assets'))
+    os.rename(src, dest)
+    remove_tree(old)
@@ -1,42 +1,25 @@
-from ..models import Package
+from ..models import get_storage, package_dependencies
 
 
 def calculate_dependents(pkg, operation):
-    dependencies = pkg.get('dependencies', None)
-    if not dependencies:
-        return
-
-    if isinstance(pkg, Package):
-        p = str(pkg)
+    """Replace the dependencies of the package in the reverse dependency
+    index, a deleted package depends on nothing. Return the changed
+    transitive dependents counts.
+    """
+    key = (pkg['family'], pkg['name'], pkg['version'])
+    if operation == 'delete':
+        dependencies = []
     else:
-        p = '%s/%s@%s' % (pkg['family'], pkg['name'], pkg['version'])
-
-    for dep in dependencies:
-        package = _parse(dep)
-        if not package:
-            continue
-
-        package = Package(**package)
-        dependents = package.get('dependents', [])
-
-        if operation == 'delete' and p in dependents:
-            dependents.remove(p)
-            package.dependents = dependents
-            package.save()
-            continue
-
-        if operation != 'delete' and p not in dependents:
-            dependents.append(p)
-            package.dependents = dependents
-            package.save()
-            continue
-
-
-def _parse(dep):
-    # family/name@version
-    if '@' not in dep or '/' not in dep:
-        return None
-
-    value, version = dep.split('@')
-    family, name = value.split('/')
-    return {'family': family, 'name': name, 'version': version}
+        dependencies = package_dependencies(pkg)
+    return get_storage().set_dependencies(key, dependencies)
+
+
+def remove_dependents(project):
+    """Drop the packages of a deleted project from the index."""
+    storage = get_storage()
+    counts = {}
+    for version in project.get('packages') or {}:
+        counts.update(storage.set_dependencies(
+            (project['family'], project['name'], version), []
+        ))
+    return counts
@@ -0,0 +1,105 @@
+# coding: utf-8
+
+import os
+import hashlib
+import mimetypes
+from urllib import unquote
+from flask import Blueprint, current_app
+from flask import request, abort, Response
+from ..models import combocache
+
+bp = Blueprint('assets', __name__)
+
+CHUNK_SIZE = 64 * 1024
+
+
+@bp.before_app_request
+def concat():
+    """The combo syntax of the concat module of nginx,
+    ``/assets/path/??a.js,b.js?v=1``. It is handled before the url is
+    routed, as the rules of the front pages would match the path.
+    """
+    query = request.query_string
+    if not query.startswith('?') or not request.path.endswith('/'):
+        return None
+
+    roots = (
+        ('/assets/', current_app.config.get('ASSETS_ROOT')),
+        ('/_static/', current_app.static_folder),
+    )
+    for prefix, root in roots:
+        if not request.path.startswith(prefix):
+            continue
+        parts = [o for o in request.path[len(prefix):].split('/') if o]
+        if not root or '..' in parts or any(o.startswith('.') for o in parts):
+            return abort(404)
+        directory = os.path.join(root, *parts)
+        return combo(directory, query[1:].split('?')[0])
+    return None
+
+
+def combo(directory, query):
+    names = [unquote(o) for o in query.split(',') if o]
+    limit = current_app.config.get('COMBO_MAX_FILES', 999)
+    if not names or len(names) > limit:
+        return abort(400)
+
+    files = []
+    ctype = None
+    for name in names:
+        parts = name.split('/')
+        if '..' in parts or any(o.startswith('.') for o in parts if o):
+            return abort(404)
+        fpath = os.path.join(directory, *[o for o in parts if o])
+        try:
+            st = os.stat(fpath)
+        except OSError:
+            return abort(404)
+        if not os.path.isfile(fpath):
+            return abort(404)
+        mimetype = mimetypes.guess_type(fpath)[0]
+        if ctype and mimetype != ctype:
+            # the concat module only combines files of the same type
+            return abort(400)
+        ctype = mimetype
+        files.append((fpath, st))
+
+    key = (directory, tuple(names))
+    signature = tuple((st.st_mtime, st.st_size, st.st_ino) for _, st in files)
+    etag = hashlib.md5(repr((key, signature))).hexdigest()
+
+    data = combocache.get(key, signature)
+    if data is None:
+        data = _concat(key, signature, [o[0] for o in files])
+
+    response = Response(
+        data, mimetype=ctype or 'application/octet-stream',
+        direct_passthrough=True,
+    )
+    response.content_length = sum(st.st_size for _, st in files)
+    response.last_modified = max(st.st_mtime for _, st in files)
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = current_app.config.get(
+        'COMBO_MAX_AGE', 365 * 24 * 3600
+    )
+    return response.make_conditional(request)
+
+
+def _concat(key, signature, files):
+    """Generate the files one by one, the whole is cached at the end if
+    it is not too large for the cache.
+    """
+    cached = []
+    size = 0
+    for fpath in files:
+        with open(fpath, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                size += len(chunk)
+                if cached is not None:
+                    cached.append(chunk)
+                    if size > combocache.capacity / 4:
+                        cached = None
+                yield chunk
+    if cached is not None:
+        combocache.set(key, signature, b''.join(cached))
@@ -3,8 +3,8 @@
 from flask import Blueprint
 from flask import request
 from flask import abort, render_template
-from distutils.version import StrictVersion
-from ..models import Project, Package, Account
+from ..models import Project, Package, Account, sort_versions
+from ..models import get_storage
 from ..elastic import search_project
 
 
@@ -35,9 +35,10 @@ def project(family, name):
 
     project['latest'] = package
 
-    versions = project.packages.keys()
-    versions = sorted(versions, key=lambda i: StrictVersion(i), reverse=True)
-    project['versions'] = versions
+    # versions are stored in order, projects published before it was
+    # stored need a sort
+    if not project.versions:
+        project['versions'] = sort_versions(project.packages.keys())
 
     account = Account.query.filter_by(name=family).first()
     return render_template('project.html', project=project, account=account)
@@ -48,6 +49,9 @@ def version(family, name, version):
     pkg = Package(family=family, name=name, version=version)
     if 'created_at' not in pkg:
         return abort(404)
+    pkg.dependents = get_storage().dependents(
+        family, name, version, limit=100
+    )
     return render_template('version.html', package=pkg)
 
 
@@ -7,36 +7,75 @@ import tarfile
 import werkzeug
 import tempfile
 import shutil
+import time
 from flask import Blueprint, current_app
 from flask import g, request, jsonify, abort
 from flask import json, Response
-from distutils.version import StrictVersion
 from flask.ext.babel import gettext as _
 from ..models import Project, Package, Account
 from ..models import project_signal, package_signal
+from ..models import parse_version, is_prerelease, get_storage
+from ..models import UploadSession, collect_uploads
+from ..models import assetcache
+from ..models import TarballIndex, save_files, package_files, read_member
+from ..models import store_blob, release_blob
+from ..models import resolver, parse_dependency
+from ..models.fileio import atomic_file
 from ..elastic import search_project
+from ..helpers import send_file
+from ..tasks.assets import extract_member
 
 __all__ = ['bp']
 
+CHUNK_SIZE = 64 * 1024
+
 bp = Blueprint('repository', __name__)
 
 
 @bp.route('/')
 def index():
-    repo = os.path.join(current_app.config['WWW_ROOT'], 'repository')
-    if not os.path.exists(repo):
-        return Response('[]', content_type='application/json')
+    projects = Project.names()
+    return Response(json.dumps(projects), content_type='application/json')
 
-    def list_projects():
-        for name in Project.all():
-            yield Project.list(name)
 
-    projects = []
-    for proj in list_projects():
-        projects.extend(proj)
+@bp.route('/_changes')
+def changes():
+    """Changes after the sequence ``since``. With ``feed=longpoll``, wait
+    for a change until ``timeout`` seconds.
+    """
+    since = max(request.args.get('since', 0, type=int), 0)
+    limit = min(max(request.args.get('limit', 100, type=int), 1), 1000)
+    storage = get_storage()
+    results = storage.changes(since, limit)
+
+    if not results and request.args.get('feed') == 'longpoll':
+        timeout = min(
+            request.args.get('timeout', 30, type=float),
+            current_app.config.get('CHANGES_TIMEOUT', 60),
+        )
+        deadline = time.time() + timeout
+        while not results and time.time() < deadline:
+            # workers are patched by gevent, sleeping yields to others
+            time.sleep(0.5)
+            results = storage.changes(since, limit)
+
+    if results:
+        last_seq = results[-1]['seq']
+    else:
+        last_seq = since
+    return jsonify(results=results, last_seq=last_seq)
 
-    projects = map(lambda o: '%(family)s/%(name)s' % o, projects)
-    return Response(json.dumps(projects), content_type='application/json')
+
+@bp.route('/_resolve')
+def resolve():
+    """The transitive dependencies of ``pkg=family/name@version``."""
+    key = parse_dependency(request.args.get('pkg', ''))
+    if not key:
+        return abortify(400, message=_('Invalid package.'))
+    rv = resolver.resolve(key)
+    if rv is None:
+        return abortify(404, message=_('Package not found.'))
+    return jsonify(rv)
 
 
 @bp.route('/<path:filename>.json')
@@ -67,7 +106,16 @@ def project(family, name):
         return abortify(404, message=_('Project not found.'))
 
     if request.method == 'GET':
-        return jsonify(project)
+        storage = get_storage()
+        count = storage.transitive_dependents(family, name)
+        downloads = storage.downloads(family, name)
+        versions = downloads['versions']
+        downloads['versions'] = dict(
+            (v, versions[v]['total']) for v in versions
+        )
+        return jsonify(
+            project, transitive_dependents=count, downloads=downloads
+        )
 
     account = Account.query.filter_by(name=family).first()
     allow_anonymous = current_app.config.get('ALLOW_ANONYMOUS', False)
@@ -90,8 +138,8 @@ def package(family, name, version):
     """Create, delete, upload, and get information of a package."""
 
     try:
-        _ver = StrictVersion(version)
-    except:
+        parse_version(version)
+    except ValueError:
         return abortify(
             406, message=_('Invalid version %(version)s.', version=version)
         )
@@ -153,7 +201,7 @@ def package(family, name, version):
             project_signal.send(current_app, changes=(project, 'create'))
 
         data = request.json or {}
-        if 'tag' not in data and _ver.prerelease:
+        if 'tag' not in data and is_prerelease(version):
             data['tag'] = 'unstable'
         elif 'tag' not in data:
             data['tag'] = 'stable'
@@ -168,7 +216,6 @@ def package(family, name, version):
         package_signal.send(current_app, changes=(package, 'update'))
 
         project.update(package)
-        project = project.save()
         project_signal.send(current_app, changes=(project, 'update'))
         return jsonify(package)
 
@@ -180,7 +227,6 @@ def package(family, name, version):
         package_signal.send(current_app, changes=(package, 'upload'))
 
         project.update(package)
-        project.save()
         project_signal.send(current_app, changes=(project, 'update'))
         return jsonify(package)
 
@@ -197,12 +243,101 @@ def tarball(family, name, version, filename):
     ctype, encoding = mimetypes.guess_type(filename)
     if not ctype:
         ctype = 'text/html'
-    with open(fpath, 'rb') as f:
-        data = f.read()
-        resp = Response(data, content_type=ctype)
-        if encoding:
-            resp.content_encoding = encoding
-        return resp
+    return send_file(fpath, ctype, encoding)
+
+
+@bp.route('/<family>/<name>/<version>/dist/<path:filename>')
+def asset(family, name, version, filename):
+    """A file in dist of the tarball. It is extracted on the first request,
+    and kept in the assets cache by the md5 of the tarball.
+    """
+    parts = filename.split('/')
+    if '..' in parts or any(o.startswith('.') for o in parts):
+        return abortify(404)
+
+    package = _read_package(family, name, version)
+    ctype, encoding = mimetypes.guess_type(filename)
+    if not ctype:
+        ctype = 'application/octet-stream'
+
+    # stable versions may be extracted already
+    assets = current_app.config.get('ASSETS_ROOT')
+    if assets:
+        fpath = os.path.join(assets, family, name, version, *parts)
+        if os.path.isfile(fpath):
+            return send_file(fpath, ctype, encoding)
+
+    tarball = os.path.join(
+        os.path.dirname(package.datafile), package.filename
+    )
+    # a version uploaded again with force has a tarball of another md5
+    stamp = package.md5
+    if not stamp:
+        try:
+            stamp = '%d' % os.path.getmtime(tarball)
+        except OSError:
+            return abortify(404)
+    path = os.path.join(family, name, version, stamp, *parts)
+    fpath = assetcache.get(
+        path, lambda f: extract_member(tarball, filename, f)
+    )
+    if not fpath:
+        return abortify(404)
+    return send_file(fpath, ctype, encoding)
+
+
+@bp.route('/<family>/<name>/<version>/-/files')
+def files(family, name, version):
+    package = _read_package(family, name, version)
+    index = package_files(package)
+    if index is None:
+        return abortify(404, message=_('Tarball is not readable.'))
+    return jsonify(files=index['files'])
+
+
+@bp.route('/<family>/<name>/<version>/-/files/<path:path>')
+def file(family, name, version, path):
+    """A file in the tarball, only the part of the tarball before it is
+    decompressed.
+    """
+    package = _read_package(family, name, version)
+    index = package_files(package)
+    if index is None:
+        return abortify(404, message=_('Tarball is not readable.'))
+    entry = None
+    for o in index['files']:
+        if o['path'] == path:
+            entry = o
+    if entry is None:
+        return abortify(404)
+
+    tarball = os.path.join(
+        os.path.dirname(package.datafile), package.filename
+    )
+    ctype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    response = Response(
+        read_member(tarball, entry, index['checkpoints']),
+        mimetype=ctype, direct_passthrough=True,
+    )
+    response.content_length = entry['size']
+    response.set_etag(entry['sha256'])
+    return response.make_conditional(request)
+
+
+@bp.route('/<family>/<name>/<version>/-/dependents')
+def dependents(family, name, version):
+    """Packages depend on the package, ``limit`` of them in a page."""
+    page = max(request.args.get('page', 1, type=int), 1)
+    limit = min(max(request.args.get('limit', 100, type=int), 1), 1000)
+    storage = get_storage()
+    total = storage.count_dependents(family, name, version)
+    results = storage.dependents(
+        family, name, version, (page - 1) * limit, limit
+    )
+    return jsonify(
+        dependents=results, total=total, page=page,
+        pages=(total + limit - 1) // limit,
+    )
 
 
 @bp.route('/search')
@@ -233,51 +368,128 @@ def upload(family):
     if 'file' not in request.files:
         return abortify(406, message=_('file is missing.'))
 
-    try:
-        tar = tarfile.open(fileobj=tarball, mode='r:gz')
-    except:
-        return abortify(415)
-
     name = request.form.get('name', family)
     tag = request.form.get('tag', 'latest')
+    upload_docs(family, name, tag, tarball, tarball.filename)
+    return jsonify(status='info', message=_('upload docs success.'))
 
-    filename = '%s-%s-%s' % (
-        family, name, werkzeug.secure_filename(tarball.filename)
+
+@bp.route('/_uploads', methods=['POST'])
+def create_upload():
+    """Create a resumable upload of a package tarball or documentation.
+
+    The json body has family, name, size, an optional md5, and version
+    for a package, or ``"target": "docs"`` and tag for documentation.
+    """
+    data = request.json or {}
+    family = data.get('family')
+    name = data.get('name')
+    target = data.get('target', 'package')
+    try:
+        size = int(data.get('size'))
+    except (TypeError, ValueError):
+        size = -1
+    if not family or not name or size < 0 or \
+            target not in ('package', 'docs'):
+        return abortify(400)
+    check_family(family)
+
+    limit = current_app.config.get('MAX_PACKAGE_SIZE')
+    if limit and size > limit:
+        return abortify(413)
+
+    info = dict(
+        family=family, name=name, target=target, size=size,
+        md5=data.get('md5'), account=g.user and g.user.name,
     )
-    fpath = os.path.join(tempfile.gettempdir(), filename)
-    if os.path.exists(fpath):
-        shutil.rmtree(fpath)
+    if target == 'package':
+        info['version'] = data.get('version') or ''
+        package = _upload_package(info)
+        force = request.headers.get('X-Yuan-Force', False)
+        if package.md5 and not force:
+            return abortify(444)
+    else:
+        info['tag'] = data.get('tag', 'latest')
 
-    def _members(tar):
-        for info in tar:
-            if os.path.basename(info.name).startswith('.'):
-                continue
-            ext = os.path.splitext(info.name)[1]
-            # ignore some danger files
-            if ext not in ['.php'] and not info.name.startswith('.'):
-                yield info
+    collect_uploads()
+    session = UploadSession.create(**info)
+    response = jsonify(session.progress())
+    response.status_code = 201
+    return response
 
-    tar.extractall(path=fpath, members=_members(tar))
 
-    rootdir = fpath
-    indir = os.listdir(fpath)
-    if len(indir) == 1 and os.path.isdir(os.path.join(fpath, indir[0])):
-        rootdir = os.path.join(fpath, indir[0])
+@bp.route('/_uploads/<id>', methods=['GET', 'DELETE'])
+def upload_session(id):
+    session = _upload_session(id)
+    if request.method == 'DELETE':
+        session.delete()
+        return jsonify(status='info', message=_('Upload is deleted.'))
+    return jsonify(session.progress())
 
-    if tag == 'latest':
-        dest = os.path.join(
-            current_app.config['WWW_ROOT'], 'docs', family, name
-        )
-    else:
-        dest = os.path.join(
-            current_app.config['WWW_ROOT'], 'archive', family, name, tag
-        )
 
-    if os.path.exists(dest):
-        shutil.rmtree(dest)
+@bp.route('/_uploads/<id>/<int:number>', methods=['PUT'])
+def upload_chunk(id, number):
+    """Upload the chunk ``number`` at the offset in query string."""
+    session = _upload_session(id)
+    offset = request.args.get('offset', type=int)
+    length = request.content_length
+    if offset is None or length is None:
+        return abortify(400, message=_('Offset and length are required.'))
 
-    shutil.move(rootdir, dest)
-    return jsonify(status='info', message=_('upload docs success.'))
+    md5 = request.headers.get('X-Chunk-MD5', None)
+    try:
+        session = session.write(number, offset, request.stream, length, md5)
+    except ValueError as e:
+        return abortify(400, message=str(e))
+    return jsonify(session.progress())
+
+
+@bp.route('/_uploads/<id>/commit', methods=['POST'])
+def commit_upload(id):
+    """Verify the uploaded data and publish it."""
+    session = _upload_session(id)
+    with session.lock():
+        session = _upload_session(id)
+        if session.missing():
+            return abortify(
+                400, message=_('Upload is incomplete.'), **session.progress()
+            )
+        md5, sha256 = session.checksum()
+        expected = session.md5 or request.headers.get('X-Package-MD5')
+        if expected and expected != md5:
+            return abortify(400, message=_('MD5 does not match.'))
+
+        if session.target == 'docs':
+            with open(session.datafile, 'rb') as f:
+                upload_docs(session.family, session.name, session.tag, f,
+                            'docs.tar.gz')
+            session.delete()
+            return jsonify(status='info', message=_('upload docs success.'))
+
+        package = _upload_package(session)
+        project = Project(family=package.family, name=package.name)
+        filename = '%s-%s.tar.gz' % (package.name, package.version)
+        directory = os.path.dirname(package.datafile)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        # the data file is the tarball, it is not copied
+        tarball = os.path.join(directory, filename)
+        os.rename(session.datafile, tarball)
+        store_blob(tarball, sha256)
+        session.delete()
+        # the blob of a tarball replaced with force
+        if package.sha256 != sha256:
+            release_blob(package.sha256)
+
+    package.md5 = md5
+    package.sha256 = sha256
+    package.filename = filename
+    package.save()
+    package_signal.send(current_app, changes=(package, 'upload'))
+
+    project.update(package)
+    project_signal.send(current_app, changes=(project, 'update'))
+    return jsonify(package)
 
 
 # helpers
@@ -292,6 +504,7 @@ def abortify(code, **kwargs):
         403: _('Permission denied.'),
         404: _('Not found.'),
         406: _('Not acceptable.'),
+        413: _('Request entity too large.'),
         415: _('Unsupported media type.'),
         426: _('Upgrade required.'),
         444: _('Force option required.'),
@@ -319,19 +532,139 @@ def upload_package(package):
     if package.md5 and not force:
         return abortify(444)
 
-    package.md5 = hashlib.md5(request.data).hexdigest()
-    md5 = request.headers.get('X-Package-MD5', None)
-    if md5 and md5 != package.md5:
-        return abortify(400, message=_('MD5 does not match.'))
+    limit = current_app.config.get('MAX_PACKAGE_SIZE')
+    if limit and request.content_length > limit:
+        return abortify(413)
 
     filename = '%s-%s.tar.gz' % (package.name, package.version)
     directory = os.path.dirname(package.datafile)
-    if not os.path.exists(directory):
-        os.makedirs(directory)
-
-    f = open(os.path.join(directory, filename), 'wb')
-    f.write(request.data)
-    f.close()
+    tarball = os.path.join(directory, filename)
+    sha256 = hashlib.sha256()
+    # the index keeps the md5 of the whole body as well
+    index = TarballIndex()
+    size = 0
+
+    # the body is spooled to a temp file, it replaces the tarball only
+    # when it is complete and verified
+    with atomic_file(tarball) as f:
+        while True:
+            chunk = request.stream.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if limit and size > limit:
+                return abortify(413)
+            sha256.update(chunk)
+            index.update(chunk)
+            f.write(chunk)
+
+        md5 = index.md5.hexdigest()
+        expected = request.headers.get('X-Package-MD5', None)
+        if expected and expected != md5:
+            return abortify(400, message=_('MD5 does not match.'))
+
+    sha256 = sha256.hexdigest()
+    store_blob(tarball, sha256)
+    # the blob of a tarball replaced with force
+    if package.sha256 != sha256:
+        release_blob(package.sha256)
+    package.md5 = md5
+    package.sha256 = sha256
     package.filename = filename
     package.save()
+
+    # the index is built in the same pass, or later when it is requested
+    index = index.result()
+    if index:
+        save_files(package, index)
+    return package
+
+
+def upload_docs(family, name, tag, fileobj, filename):
+    try:
+        tar = tarfile.open(fileobj=fileobj, mode='r:gz')
+    except:
+        return abortify(415)
+
+    filename = '%s-%s-%s' % (
+        family, name, werkzeug.secure_filename(filename)
+    )
+    fpath = os.path.join(tempfile.gettempdir(), filename)
+    if os.path.exists(fpath):
+        shutil.rmtree(fpath)
+
+    def _members(tar):
+        for info in tar:
+            if os.path.basename(info.name).startswith('.'):
+                continue
+            ext = os.path.splitext(info.name)[1]
+            # ignore some danger files
+            if ext not in ['.php'] and not info.name.startswith('.'):
+                yield info
+
+    tar.extractall(path=fpath, members=_members(tar))
+
+    rootdir = fpath
+    indir = os.listdir(fpath)
+    if len(indir) == 1 and os.path.isdir(os.path.join(fpath, indir[0])):
+        rootdir = os.path.join(fpath, indir[0])
+
+    if tag == 'latest':
+        dest = os.path.join(
+            current_app.config['WWW_ROOT'], 'docs', family, name
+        )
+    else:
+        dest = os.path.join(
+            current_app.config['WWW_ROOT'], 'archive', family, name, tag
+        )
+
+    if os.path.exists(dest):
+        shutil.rmtree(dest)
+
+    shutil.move(rootdir, dest)
+
+
+def check_family(family):
+    """Abort if the current user can not write to the family."""
+    allow_anonymous = current_app.config.get('ALLOW_ANONYMOUS', False)
+    if not allow_anonymous and not g.user:
+        return abortify(401)
+
+    account = Account.query.filter_by(name=family).first()
+    if not allow_anonymous and not account:
+        return abortify(404, message=_('Family not found.'))
+
+    if account and not account.permission_write.can():
+        return abortify(403)
+
+
+def _read_package(family, name, version):
+    package = Package(family=family, name=name, version=version)
+    if not package.read() or not package.filename:
+        return abortify(404, message=_('Package not found.'))
+    return package
+
+
+def _upload_session(id):
+    session = UploadSession.load(id)
+    if not session:
+        return abortify(404, message=_('Upload not found.'))
+    if session.account != (g.user and g.user.name):
+        return abortify(403)
+    return session
+
+
+def _upload_package(info):
+    try:
+        parse_version(info['version'])
+    except ValueError:
+        return abortify(
+            406, message=_('Invalid version %(version)s.',
+                           version=info['version'])
+        )
+    package = Package(
+        family=info['family'], name=info['name'], version=info['version']
+    )
+    if not package.read():
+        return abortify(404, message=_('Package not found.'))
     return package